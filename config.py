@@ -1,6 +1,13 @@
 import abc
+import contextlib
+import copy
+import fcntl
 import logging
 import os
+import re
+import stat
+import tempfile
+import threading
 import typing
 
 import yaml
@@ -8,6 +15,8 @@ from kubernetes import client
 from kubernetes import config
 from kubernetes.client import ApiException
 
+from informer import Informer
+
 Logger = logging.getLogger(__name__)
 
 
@@ -136,52 +145,234 @@ class Config(abc.ABC):
     def save(self, doc: dict, service: str):
         pass
 
+    def batch(self):
+        """
+        Context in which saves are coalesced into one write when it exits
+        """
+        return contextlib.nullcontext()
+
     def __getitem__(self, item: str) -> DbConfig:
         pass
 
 
+# libyaml's loader and dumper, when PyYAML was built with it, are several times faster than the pure Python ones
+_Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+_Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+# a top level key of a block style mapping, as written by yaml.dump, whose value follows on indented lines
+_TOP_LEVEL_KEY = re.compile(r"^([A-Za-z0-9_.\-]+):\s*$")
+
+
+def _yaml_load(text):
+    return yaml.load(text, Loader=_Loader)
+
+
+def _yaml_dump(doc, stream=None):
+    return yaml.dump(doc, stream, Dumper=_Dumper)
+
+
+def _split_services(text: str) -> typing.Optional[typing.Dict[str, str]]:
+    """
+    Splits a block style yaml mapping into one document per top level key without parsing the values
+    :return: service -> yaml document "service:\n  ...", or None if text has another layout
+    """
+    services = {}
+    name = None
+    for line in text.splitlines(keepends=True):
+        if not line.strip() or line[0] in " \t#":
+            if name is None and line.strip() and not line.startswith("#"):
+                return None
+            if name is not None:
+                services[name].append(line)
+            continue
+        match = _TOP_LEVEL_KEY.match(line)
+        if not match or match.group(1) in services:
+            return None
+        name = match.group(1)
+        services[name] = [line]
+    docs = {k: "".join(lines) for k, lines in services.items()}
+    return {k: doc if doc.endswith("\n") else doc + "\n" for k, doc in docs.items()}
+
+
+class _ServiceDocs:
+    """
+    Raw yaml document of each service, parsed into a DbConfig on first access. A parsed service is kept until its
+    document changes, so a task reading one service parses one document.
+    """
+
+    def __init__(self, parse: typing.Callable[[str, str], dict]):
+        """
+        :param parse: (service, document) -> props
+        """
+        self._parse = parse
+        self._raw: typing.Dict[str, typing.Optional[str]] = {}  # service -> document, None if parsed up front
+        self._parsed: typing.Dict[str, typing.Tuple[typing.Optional[str], DbConfig]] = {}  # service -> (document, config)
+        self.parses = 0
+
+    def reset(self, raw: dict, parsed: typing.Optional[dict] = None):
+        """
+        :param raw: service -> document
+        :param parsed: service -> props, for services parsed up front
+        """
+        self._raw = {**raw, **{k: None for k in (parsed or {})}}
+        self._parsed = {k: v for k, v in self._parsed.items() if v[0] is not None and self._raw.get(k) == v[0]}
+        for k, props in (parsed or {}).items():
+            self._parsed[k] = (None, DbConfig(k, props))
+
+    def keys(self):
+        return self._raw.keys()
+
+    def raw(self, service) -> typing.Optional[str]:
+        return self._raw[service]
+
+    def get(self, service, *overlays: dict) -> DbConfig:
+        """
+        :param overlays: service -> props saved but not stored yet, applied when the service is parsed
+        """
+        raw = self._raw[service]
+        memo = self._parsed.get(service)
+        if memo is not None and memo[0] == raw:
+            return memo[1]
+        config = DbConfig(service, self._parse(service, raw))
+        self.parses += 1
+        for overlay in overlays:
+            if service in overlay:
+                config.props.update(copy.deepcopy(overlay[service]))
+        self._parsed[service] = (raw, config)
+        return config
+
+    def stored(self, service, raw):
+        """
+        Records that the parsed props of service were stored as raw
+        """
+        self._raw[service] = raw
+        memo = self._parsed.get(service)
+        if memo is not None:
+            self._parsed[service] = (raw, memo[1])
+
+
 class FileBasedConfig(Config):
+    """
+    Config stored in a yaml file. Saves hold an flock on a sidecar lock file, so parallel CLI runs don't lose each
+    other's updates, and replace the file atomically through a temp file, so it is never seen half written.
+    The file is read again only if another process changed it, and a service is parsed when it is first used;
+    saves inside batch() are written once.
+    """
+
     def __init__(self, fn):
         self._config_location = fn
-        self._config = {}  # serviceName -> DbConfig
+        self._lock_location = os.path.join(os.path.dirname(os.path.abspath(fn)), f".{os.path.basename(fn)}.lock")
+        self._config = _ServiceDocs(lambda service, raw: _yaml_load(raw)[service])
+        self._stat = None  # (inode, mtime, size) of the file self._config was read from or written to
+        self._lock = threading.Lock()  # fleet runs save from several threads
+        self._pending: typing.Dict[str, dict] = {}  # serviceName -> props saved but not written yet
+        self._batch_depth = 0
         self._load()
 
+    @staticmethod
+    def _file_stat(fn):
+        st = os.stat(fn)
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
     def _load(self):
         with open(self._config_location) as f:
-            doc = yaml.safe_load(f)
-            for service_name, service_doc in doc.items():
-                self._config[service_name] = DbConfig(service_name, service_doc)
+            text = f.read()
+            self._stat = self._file_stat(self._config_location)
+        docs = _split_services(text)
+        if docs is None:
+            self._config.reset({}, parsed=_yaml_load(text) or {})
+        else:
+            self._config.reset(docs)
 
     def keys(self):
         return self._config.keys()
 
     def __getitem__(self, item):
-        return self._config[item]
+        with self._lock:
+            return self._config.get(item, self._pending)
+
+    @contextlib.contextmanager
+    def batch(self):
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self._flush()
 
     def save(self, doc, service):
+        with self._lock:
+            self._config.get(service, self._pending).props.update(doc)
+            self._pending.setdefault(service, {}).update(doc)
+            if not self._batch_depth:
+                self._flush()
+
+    def _flush(self):
+        """
+        must hold self._lock
+        """
+        if not self._pending:
+            return
+        with open(self._lock_location, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._write()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write(self):
         try:
-            with open(self._config_location, 'r') as f:
-                current = yaml.safe_load(f)
-                for k, v in doc.items():
-                    current[service][k] = v
+            if self._file_stat(self._config_location) != self._stat:
+                # another process saved meanwhile: read its updates, ours are applied again when parsing
+                self._load()
         except Exception as error:
             Logger.warning("Could NOT LOAD {}: {}".format(self._config_location, error))
 
+        # services without updates are written back as they were read
+        docs = {}
+        for service in self._config.keys():
+            raw = self._config.raw(service)
+            if raw is None or service in self._pending:
+                raw = _yaml_dump({service: self._config.get(service, self._pending).props})
+            docs[service] = raw
+
+        directory, name = os.path.split(os.path.abspath(self._config_location))
+        fd, tmp = tempfile.mkstemp(prefix=f".{name}.", dir=directory)
         try:
-            with open(self._config_location, 'w') as f:
-                yaml.safe_dump(current, f)
+            with os.fdopen(fd, 'w') as f:
+                f.write("".join(docs.values()))
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp, stat.S_IMODE(os.stat(self._config_location).st_mode))
+            os.replace(tmp, self._config_location)
         except Exception as error:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
             raise Exception(f"Failed to update {self._config_location} with error: {error}")
-
-        self._load()
+        self._stat = self._file_stat(self._config_location)
+        for service, raw in docs.items():
+            self._config.stored(service, raw)
+        self._pending = {}
 
 
 class K8sConfig(Config):
+    """
+    Config stored in a ConfigMap, one yaml document per service. The ConfigMap is kept in memory by a watch, so
+    reads and saves need no extra read. Saves are merged: updates made while another save is in flight, or inside
+    batch(), go out together as one patch, guarded by the resourceVersion it was computed from.
+    """
+
     def __init__(self,
                  name="cloudsql-migration",
                  namespace="tmc-iam",
                  logger=None,
-                 v1: typing.Optional[client.CoreV1Api] = None):
+                 v1: typing.Optional[client.CoreV1Api] = None,
+                 max_conflicts=10):
         if v1 is None:
             if os.path.isfile(config.incluster_config.SERVICE_TOKEN_FILENAME):
                 config.load_incluster_config()
@@ -192,43 +383,138 @@ class K8sConfig(Config):
             self._v1 = v1
         self._namespace = namespace
         self._name = name
-        self._config: typing.Mapping[str, DbConfig] = {}  # serviceName -> DbConfig
-        self._load()
         self._logger = logger if logger is not None else Logger
+        self._max_conflicts = max_conflicts
+        self._config = _ServiceDocs(lambda service, raw: _yaml_load(raw))
+        self._config_version = None  # resourceVersion self._config was read from
+        self._lock = threading.Lock()  # guards self._config and self._pending
+        self._flush_lock = threading.Lock()  # one patch in flight, sync steps save from several threads
+        self._pending: typing.Dict[str, dict] = {}  # serviceName -> props saved but not patched yet
+        self._inflight: typing.Dict[str, dict] = {}  # serviceName -> props of the patch in flight
+        self._batch_depth = 0
+        self.saves = 0
+        self.patches = 0
+        self.conflicts = 0
+        self._informer = Informer(self._v1.list_namespaced_config_map, namespace,
+                                  field_selector=f"metadata.name={name}", name=f"configmap/{namespace}/{name}",
+                                  logger=self._logger).start()
+        self._load()
+
+    def _cm(self):
+        cm = self._informer.get(self._name)
+        if cm is None:
+            raise Exception(f"configmap {self._namespace}/{self._name} not found")
+        return cm
 
     def _load(self):
-        self._cm_obj = self._v1.read_namespaced_config_map(self._name, self._namespace)
-        # service -> yaml map
-        c = {}
-        for k, v in self._cm_obj.data.items():
-            c[k] = DbConfig(k, yaml.safe_load(v))
-        self._config = c
+        """
+        Takes the documents of the ConfigMap if the watch delivered a new version. Services are parsed when
+        first used, and parsed again only if their document changed.
+        must hold self._lock or run before other threads use this config
+        """
+        cm = self._cm()
+        if cm.metadata.resource_version == self._config_version:
+            return
+        self._config.reset(cm.data or {})
+        self._config_version = cm.metadata.resource_version
+
+    def _service(self, service) -> DbConfig:
+        """
+        must hold self._lock; saved but unpatched props stay visible
+        """
+        self._load()
+        return self._config.get(service, self._inflight, self._pending)
 
     def keys(self):
-        return self._config.keys()
+        with self._lock:
+            self._load()
+            return self._config.keys()
 
     def __getitem__(self, item):
-        return self._config[item]
+        with self._lock:
+            return self._service(item)
+
+    @property
+    def stats(self) -> dict:
+        return {"saves": self.saves, "patches": self.patches, "conflicts": self.conflicts}
+
+    @contextlib.contextmanager
+    def batch(self):
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                flush = self._batch_depth == 0
+            if flush:
+                self._flush()
 
     def save(self, updated_props, service):
         self._logger.info(f"updating config properties: {service}::{list(updated_props.keys())}")
-        limit = 10
-        attempt = 0
-        while attempt < limit:
+        with self._lock:
+            self._load()
+            if service not in self._config.keys():
+                raise Exception(f"service {service} not found in configmap {self._namespace}/{self._name}")
+            self._service(service).props.update(copy.deepcopy(updated_props))
+            self._pending.setdefault(service, {}).update(copy.deepcopy(updated_props))
+            self.saves += 1
+            if self._batch_depth:
+                return
+        self._flush()
+
+    def _flush(self):
+        """
+        Patches all pending props. A save waiting here whose props were already patched by the save before it
+        returns without a request.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._inflight = pending
+            if not pending:
+                return
+            try:
+                self._patch(pending)
+            except BaseException:
+                with self._lock:
+                    # keep them for the next save, props saved meanwhile are newer
+                    for service, props in pending.items():
+                        self._pending[service] = {**props, **self._pending.get(service, {})}
+                raise
+            finally:
+                with self._lock:
+                    self._inflight = {}
+
+    def _patch(self, pending):
+        cm = self._cm()
+        for attempt in range(self._max_conflicts):
+            missing = [service for service in pending if service not in (cm.data or {})]
+            if missing:
+                # removed from the configmap meanwhile: dropped from pending, so later saves don't fail on them too
+                for service in missing:
+                    del pending[service]
+                raise Exception(f"services {missing} not found in configmap {self._namespace}/{self._name}")
+            data = {}
+            for service, props in pending.items():
+                current = _yaml_load(cm.data[service])
+                current.update(props)
+                data[service] = _yaml_dump(current)
+            body = {"metadata": {"resourceVersion": cm.metadata.resource_version}, "data": data}
             try:
-                self._load()  # ensure we have the latest data... not a perfect guarantee though so wrap in try/catch
-                props = self._config[service].props
-                for k, v in updated_props.items():
-                    props[k] = v
-                cm_data = self._cm_obj.data
-                cm_data[service] = yaml.safe_dump(props)
-                self._cm_obj.data = cm_data
-                self._v1.patch_namespaced_config_map(self._name, self._namespace, self._cm_obj)
-                return  # success
+                patched = self._v1.patch_namespaced_config_map(self._name, self._namespace, body)
             except ApiException as e:
-                if e.status == 409:
-                    attempt += 1
-                else:
+                if e.status != 409:
                     raise e
-        raise Exception(f"max retries ({limit}) for apply configmap change exceeded")
-
+                self.conflicts += 1
+                self._logger.debug(f"configmap {self._namespace}/{self._name} changed concurrently, "
+                                   f"{self.conflicts} conflicts")
+                cm = self._v1.read_namespaced_config_map(self._name, self._namespace)
+                self._informer.put(cm)
+                continue
+            self.patches += 1
+            self._informer.put(patched)
+            self._logger.debug(f"patched configmap {self._namespace}/{self._name} {list(pending.keys())}: {self.stats}")
+            return
+        raise Exception(f"max retries ({self._max_conflicts}) for apply configmap change exceeded")
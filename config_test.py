@@ -1,4 +1,16 @@
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+import yaml
+from kubernetes.client import ApiException
+
+import config
+import informer
 from config import DbConfig
+from config import FileBasedConfig
+from config import K8sConfig
 
 def test_dbconfig_infers_database_name():
     cfg = DbConfig("test", {"aws-readwrite-secret-name": "x.y.z"})
@@ -29,4 +41,149 @@ def test_validate_remote():
     props['aws-readonly-password'] = 'x'
     props['aws-readwrite-password'] = 'x'
     errors = DbConfig("test", props).validate()
-    assert len(errors) == 0
\ No newline at end of file
+    assert len(errors) == 0
+
+class _ConfigMaps:
+    """
+    stands in for CoreV1Api: one ConfigMap, patches fail with 409 unless they carry its resourceVersion
+    """
+
+    def __init__(self, **services):
+        self.cm = self._cm({k: yaml.safe_dump(v) for k, v in services.items()}, 1)
+        self.patches = []
+
+    @staticmethod
+    def _cm(data, rv):
+        return SimpleNamespace(metadata=SimpleNamespace(name="cloudsql-migration", resource_version=str(rv)),
+                               data=data)
+
+    def list_namespaced_config_map(self, namespace, **kwargs):
+        return SimpleNamespace(items=[self.cm], metadata=self.cm.metadata)
+
+    def read_namespaced_config_map(self, name, namespace):
+        return self.cm
+
+    def write(self, service, **props):
+        """
+        a concurrent writer
+        """
+        data = dict(self.cm.data)
+        data[service] = yaml.safe_dump({**yaml.safe_load(data[service]), **props})
+        self.cm = self._cm(data, int(self.cm.metadata.resource_version) + 1)
+
+    def patch_namespaced_config_map(self, name, namespace, body):
+        self.patches.append(body)
+        if body["metadata"]["resourceVersion"] != self.cm.metadata.resource_version:
+            raise ApiException(status=409)
+        self.cm = self._cm({**self.cm.data, **body["data"]}, int(self.cm.metadata.resource_version) + 1)
+        return self.cm
+
+
+@pytest.fixture
+def no_watch(monkeypatch):
+    class _Watch:
+        def stream(self, *args, **kwargs):
+            threading.Event().wait(60)
+            yield from ()
+
+    monkeypatch.setattr(informer.watch, "Watch", _Watch)
+
+
+def test_k8s_config_batch_coalesces_saves(no_watch):
+    v1 = _ConfigMaps(a={"x": 1}, b={"x": 1})
+    cfg = K8sConfig(v1=v1)
+    with cfg.batch():
+        cfg.save({"x": 2}, "a")
+        cfg.save({"y": 3}, "a")
+        cfg.save({"x": 4}, "b")
+        assert cfg["a"]["x"] == 2 and not v1.patches
+    assert len(v1.patches) == 1
+    assert yaml.safe_load(v1.cm.data["a"]) == {"x": 2, "y": 3}
+    assert cfg["b"]["x"] == 4
+    assert cfg.stats == {"saves": 3, "patches": 1, "conflicts": 0}
+
+
+def test_k8s_config_conflict_merges_concurrent_write(no_watch):
+    v1 = _ConfigMaps(a={"x": 1})
+    cfg = K8sConfig(v1=v1)
+    v1.write("a", other="kept")  # not seen by the watch yet
+    cfg.save({"x": 2}, "a")
+    assert yaml.safe_load(v1.cm.data["a"]) == {"x": 2, "other": "kept"}
+    assert cfg.conflicts == 1 and cfg.patches == 1
+    assert cfg["a"]["other"] == "kept"
+
+
+def test_k8s_config_unknown_service(no_watch):
+    v1 = _ConfigMaps(a={"x": 1}, b={"x": 1})
+    cfg = K8sConfig(v1=v1)
+    with pytest.raises(Exception, match="service c not found in configmap"):
+        cfg.save({"x": 2}, "c")
+    assert not v1.patches
+
+    # a removed by another writer, not seen by the watch yet
+    with pytest.raises(Exception, match=r"services \['a'\] not found in configmap"):
+        with cfg.batch():
+            cfg.save({"x": 2}, "a")
+            cfg.save({"x": 2}, "b")
+            v1.cm = v1._cm({"b": v1.cm.data["b"]}, 2)
+            cfg._informer.put(v1.cm)
+    cfg.save({"y": 3}, "b")
+    assert list(v1.cm.data) == ["b"] and yaml.safe_load(v1.cm.data["b"]) == {"x": 2, "y": 3}
+
+
+def test_file_config_writes_atomically_once_per_batch(tmp_path, monkeypatch):
+    fn = tmp_path / "config.yaml"
+    fn.write_text(yaml.safe_dump({"a": {"x": 1}, "b": {"x": 1}}))
+    cfg = FileBasedConfig(str(fn))
+    replaced = []
+    monkeypatch.setattr(config.os, "replace", lambda src, dst: replaced.append(dst) or os.rename(src, dst))
+    with cfg.batch():
+        cfg.save({"x": 2}, "a")
+        cfg.save({"x": 3}, "b")
+        assert cfg["a"]["x"] == 2 and not replaced
+    assert replaced == [str(fn)]
+    assert yaml.safe_load(fn.read_text()) == {"a": {"x": 2}, "b": {"x": 3}}
+    assert [p.name for p in tmp_path.iterdir() if p.name != ".config.yaml.lock"] == ["config.yaml"]
+
+
+def test_file_config_merges_other_writers(tmp_path):
+    fn = tmp_path / "config.yaml"
+    fn.write_text(yaml.safe_dump({"a": {"x": 1}}))
+    cfg = FileBasedConfig(str(fn))
+    cfg.save({"x": 2}, "a")
+    cfg.save({"y": 2}, "a")
+    assert cfg._config.parses == 1  # own writes are not parsed again
+
+    FileBasedConfig(str(fn)).save({"other": "kept"}, "a")
+    cfg.save({"y": 3}, "a")
+    assert yaml.safe_load(fn.read_text()) == {"a": {"x": 2, "y": 3, "other": "kept"}}
+
+
+def test_file_config_parses_services_on_first_use(tmp_path):
+    fn = tmp_path / "config.yaml"
+    fn.write_text("# fleet\n" + yaml.safe_dump({"a": {"x": 1, "l": [1, 2]}, "b": {"x": 1}, "c": {"x": 1}}))
+    cfg = FileBasedConfig(str(fn))
+    assert list(cfg.keys()) == ["a", "b", "c"]
+    assert cfg["b"]["x"] == 1 and cfg["b"]["x"] == 1
+    assert cfg._config.parses == 1
+    cfg.save({"x": 2}, "c")
+    assert cfg._config.parses == 2
+    assert yaml.safe_load(fn.read_text()) == {"a": {"x": 1, "l": [1, 2]}, "b": {"x": 1}, "c": {"x": 2}}
+
+
+def test_file_config_reads_other_layouts(tmp_path):
+    fn = tmp_path / "config.yaml"
+    fn.write_text("{a: {x: 1}, b: {x: 1}}\n")
+    cfg = FileBasedConfig(str(fn))
+    cfg.save({"x": 2}, "a")
+    assert yaml.safe_load(fn.read_text()) == {"a": {"x": 2}, "b": {"x": 1}}
+
+
+def test_k8s_config_keeps_unchanged_services_parsed(no_watch):
+    v1 = _ConfigMaps(a={"x": 1}, b={"x": 1})
+    cfg = K8sConfig(v1=v1)
+    a = cfg["a"]
+    cfg.save({"x": 2}, "b")
+    assert cfg["a"] is a
+    assert cfg["b"]["x"] == 2
+    assert cfg._config.parses == 3  # b again, from its patched document
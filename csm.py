@@ -1,12 +1,20 @@
 import base64
+import functools
+import itertools
 import logging
 import multiprocessing
 import random
 import string
 import sys
+import threading
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Optional
 
 import fire
 
@@ -14,9 +22,19 @@ from config import Config
 from config import DbConfig
 from config import FileBasedConfig
 from config import ValidationError
+from fleet import FleetRunner
+from fleet import parse_services
 from gcp import GcpApi
+from journal import Journal
 from kube import K8sApiBase
 from kube import K8sApiLocal
+from loadcontrol import LoadController
+from pipeline import StepGraph
+from polling import AdaptivePoller
+from progress import DumpProgress
+from scheduler import CapacityScheduler
+from timeline import Timeline
+from verify import ParityVerifier
 
 DEFAULT_PORT = 5432
 MJ_PREFIX = 'auto-mj-'
@@ -27,6 +45,24 @@ VPC = {
     "prod": {"host": "prj-p-vpc-host", "base": "vpc-p-shared-base"},
     "sb1": {"host": "prj-sb-vpc-host", "base": "vpc-sb-shared-base"}
 }
+# expected time to reach a job state/phase, the FULL_DUMP estimate scales with the source database size
+EXPECTED_DURATION_S = {
+    "RUNNING": 30,
+    "COMPLETED": 180,
+    "default": 600,
+}
+FULL_DUMP_OVERHEAD_S = 60
+DEFAULT_DUMP_THROUGHPUT_MBPS = 20
+DEFAULT_ROLLOUT_TIMEOUT_S = 600
+DEFAULT_MAX_LAG_BYTES = 16 * 1024 * 1024
+LAG_SAMPLE_INTERVAL_S = 5
+# polls inside the write freeze add their latency to the downtime
+FREEZE_POLL_MAX_INTERVAL_S = 8
+DEFAULT_VERIFY_WORKERS = 4
+DEFAULT_VERIFY_CHUNK_ROWS = 200000
+REPLICATION_FINGERPRINT_KEY = 'aws-replication-fingerprint'
+# failed databases listed per instance by preflight, the server keeps at most 16KB of a task's result
+PREFLIGHT_MAX_FAILED_DATABASES = 10
 ENVCODE = {
     "dev": "d",
     "staging": "s",
@@ -40,20 +76,36 @@ RDS_ROOT_PEM64 = "LS0tLS1CRUdJTiBDRVJUSUZJQ0FURS0tLS0tCk1JSUVCakNDQXU2Z0F3SUJBZ0
 
 class MigrationCommands:
 
-    def __init__(self, config: Config, k8s: K8sApiBase, logger=logging.getLogger("x")):
+    def __init__(self, config: Config, k8s: K8sApiBase, logger=logging.getLogger("x"),
+                 reporter: Optional[Callable[[str, Any], None]] = None):
+        """
+        :param reporter: called with (key, value) to publish live progress, e.g. to the server's task json
+        """
         self._logger = logger
+        self._reporter = reporter
         self._config = config
         self._now_str = datetime.now().strftime("%Y%m%dt%H%M%S")
         self._rds_cert = str(base64.b64decode(bytes(RDS_ROOT_PEM64, encoding="UTF-8")), encoding='UTF-8')
 
         self._k8s = k8s
         self._gcp = GcpApi(logger=self._logger)
+        self._source_sizes = {}  # service -> bytes
+        self._journals = {}  # service -> Journal
+        self._replication_setups = {}  # (aws-host, aws-port, replication user) -> setup result
+        self._setup_locks = {}
+        self._setup_lock = threading.Lock()
+
+    def close(self):
+        """
+        Ends the database sessions and the watches of the k8s api
+        """
+        self._k8s.close()
 
-    def preflight(self, service) -> dict:
+    def preflight(self, service, force=False) -> dict:
         """
         does pre-flight preparation of DB and check for app health
         do:
-        1/ idempotent create/update replication user, assign permissions
+        1/ idempotent create/update replication user, assign permissions, once per RDS instance
         check:
         1/ target pod exists in target namespace
         2/ target database can be connected to
@@ -61,10 +113,11 @@ class MigrationCommands:
         TODO:
         1/ service account can access these namespaces
         :param service:
+        :param force: redo the replication setup even if the instance did not change since the last preflight
         :return: dict of statuses for various preflight checks. key "pass" will be True/False if there were no/any errors
         """
         def is_ok(statuses):
-            return not any(filter(lambda k,v: v != 'ok', statuses.items()))
+            return all(v == 'ok' for v in statuses.values())
 
         status = {}
         cfg = self._config[service]
@@ -80,26 +133,110 @@ class MigrationCommands:
             return status  # short-circuit
 
         # prepare rds instance, if running on k8s
-        try:
-            repl_pw = self._k8s.create_replication_user(
-                cfg['aws-replication-username'],
-                cfg['aws-replication-password'],
-                dbname=cfg['database-name'],
-                host=cfg['aws-host'],
-                port=cfg['aws-port'],
-                user=cfg['aws-master-username'],
-                password=cfg['aws-master-password']
-            )
-            if repl_pw is not None:
-                self._config.save({"aws-replication-password": repl_pw}, service)
-        except Exception as e:
-            status['rdsReplication'] = f"failed to create replication user {cfg['aws-host']}/{cfg['database-name']}: {str(e)}"
-
-        status['pass'] = is_ok(status)
+        setup = self._setup_replication(service, force=force)
+        if setup['error'] is not None:
+            status['rdsReplication'] = setup['error']
+        status['rdsReplicationSetup'] = "skipped" if setup['skipped'] else "done"
+        failed = {db: error for db, error in (setup.get('databases') or {}).items() if error != 'ok'}
+        if failed:
+            # only the failures: an instance may have hundreds of databases
+            shown = {db: error.splitlines()[0][:200]
+                     for db, error in itertools.islice(failed.items(), PREFLIGHT_MAX_FAILED_DATABASES)}
+            if len(failed) > len(shown):
+                shown['...'] = f"{len(failed) - len(shown)} more failed"
+            status['rdsReplicationDatabases'] = shown
+
+        status['pass'] = is_ok({k: v for k, v in status.items()
+                                if k not in ('rdsReplicationSetup', 'rdsReplicationDatabases')})
         return status
 
+    def preflight_all(self, services="all", force=False) -> Dict[str, dict]:
+        """
+        preflight for many services. Services on the same RDS instance share one replication setup, and
+        instances are prepared concurrently
+        :param services: "all" or comma separated list of services
+        :return: service -> preflight status
+        """
+        names = parse_services(services, self._config.keys())
+        hosts = {}
+        for service in names:
+            hosts.setdefault(self._replication_group(service), []).append(service)
+
+        def preflight_host(group):
+            # forced once per instance, the other services reuse that setup
+            statuses = {s: self.preflight(s, force=force and i == 0) for i, s in enumerate(group)}
+            # the databases are the instance's: list them once, with its first service
+            for s in group[1:]:
+                statuses[s].pop('rdsReplicationDatabases', None)
+            return statuses
+
+        statuses = {}
+        with ThreadPoolExecutor(max_workers=8, thread_name_prefix="preflight") as pool:
+            for result in pool.map(preflight_host, hosts.values()):
+                statuses.update(result)
+        failed = [s for s, status in statuses.items() if not status['pass']]
+        self._logger.info(f"preflight of {len(names)} services on {len(hosts)} instances: {len(failed)} failed"
+                          + (f": {failed}" if failed else ""))
+        return statuses
+
+    def _replication_group(self, service) -> tuple:
+        cfg = self._config[service]
+        return cfg['aws-host'], cfg['aws-port'], cfg['aws-replication-username']
 
-    def sync(self, service):
+    def _setup_replication(self, service, force=False) -> dict:
+        """
+        Creates the replication user and grants it access to every database of the RDS instance, once per
+        instance and replication user: the result is reused for every service on the instance, unless forced. The
+        instance fingerprint is saved for all these services, and the setup is skipped entirely when it did not change.
+        :return: {error: None or message, skipped:, fingerprint:, databases: database -> "ok" or error}
+        """
+        group = self._replication_group(service)
+        with self._setup_lock:
+            lock = self._setup_locks.setdefault(group, threading.Lock())
+        with lock:
+            if group in self._replication_setups and not force:
+                return self._replication_setups[group]
+
+            cfg = self._config[service]
+            host, port, username = group
+            group_services = [s for s in self._config.keys() if self._replication_group(s) == group]
+            connection = dict(dbname=cfg['database-name'], host=host, port=port,
+                              user=cfg['aws-master-username'], password=cfg['aws-master-password'])
+            result = {"error": None, "skipped": False, "fingerprint": None}
+            try:
+                fingerprint = self._k8s.replication_fingerprint(username, cfg['aws-replication-password'],
+                                                                **connection)
+                stored = {self._config[s].get(REPLICATION_FINGERPRINT_KEY) for s in group_services}
+                if fingerprint is not None and not force and stored == {fingerprint}:
+                    self._logger.info(f"replication setup of {host} unchanged, skipping for {group_services}")
+                    result.update(skipped=True, fingerprint=fingerprint)
+                else:
+                    databases = {}
+                    repl_pw = self._k8s.create_replication_user(username, cfg['aws-replication-password'],
+                                                                db_statuses=databases, **connection)
+                    result['databases'] = databases
+                    failed = {db: error for db, error in databases.items() if error != 'ok'}
+                    if failed:
+                        result['error'] = f"failed to prepare {len(failed)}/{len(databases)} databases on {host}"
+                    fingerprint = self._k8s.replication_fingerprint(
+                        username, repl_pw if repl_pw is not None else cfg['aws-replication-password'], **connection)
+                    update = {}
+                    if repl_pw is not None:
+                        update["aws-replication-password"] = repl_pw
+                    if fingerprint is not None and not failed:
+                        # a partial setup must be retried by the next preflight
+                        update[REPLICATION_FINGERPRINT_KEY] = fingerprint
+                    if update:
+                        with self._config.batch():
+                            for s in group_services:
+                                self._config.save(update, s)
+                    result['fingerprint'] = fingerprint
+            except Exception as e:
+                result['error'] = f"failed to create replication user {host}/{cfg['database-name']}: {str(e)}"
+            self._replication_setups[group] = result
+            return result
+
+    def sync(self, service, reset=False):
         """
         Starts db migration process and creates rw and ro secrets for
         respective services in gcp cluster based on which migration
@@ -107,24 +244,50 @@ class MigrationCommands:
         1. Creates and starts migration job
         2. Create gcp or aws secret in gcp env cluster
         3. Restart gcp service
+        Steps run as a dependency graph: independent steps (e.g. k8s secrets and the root secret) run concurrently.
         :param service: name of service in the config yaml
+        :param reset: rerun all steps and restart a FAILED migration job, see _check_sync_journal
+        :return: step timings and the critical path
         """
         cfg = self._config[service]
-
-        # Prepare migration job and Start
-        self._create_connection_profile(service)
-        self._create_dms_job(service)
-
-        # Create cloudsql users and Retrieve cloudsql information
+        local = cfg["gcp-migration-strategy"] == 'local'
         self._logger.debug(f'migrating {service} using strategy "{cfg["gcp-migration-strategy"]}"')
-        self._create_db_users(service)
-        self._create_sync_secrets(service)
-        self._k8s.restart_gcp_service(cfg['k8s-service'], cfg['k8s-namespace'])
-
-        self._await_state(service, "RUNNING")
-        self._logger.info(f"job running, await database CDC phase")
-        self._await_phase(service, target_phase="CDC")
+        journal = self._journal(service)
+        self._check_sync_journal(service, journal, reset)
+        timeline = Timeline(f"sync/{service}", logger=self._logger)
+        timeline.mark('sync-begin')
+
+        def step(name, fn):
+            # completed steps are journaled and skipped when sync is rerun
+            return lambda: journal.run(f"sync/{name}", fn)
+
+        def switch_secrets():
+            self._create_sync_secrets(service)
+            timeline.mark('secret-switch')
+
+        def restart():
+            with timeline.span('restart'):
+                self._k8s.restart_gcp_service(cfg['k8s-service'], cfg['k8s-namespace'])
+
+        graph = StepGraph(f"sync/{service}", logger=self._logger)
+        graph.add('source-profile', step('source-profile', lambda: self._create_source_profile(service)))
+        graph.add('destination', step('destination', lambda: self._create_destination_profile(service)),
+                  deps=['source-profile'])
+        graph.add('root-secret', step('root-secret', lambda: self._create_root_secret(service, graph['destination'].value)),
+                  deps=['destination'])
+        graph.add('dms-job', step('dms-job', lambda: self._create_dms_job(service)), deps=['destination'])
+        # Create cloudsql users and Retrieve cloudsql information
+        graph.add('db-users', step('db-users', lambda: self._create_db_users(service)), deps=['dms-job'])
+        # local secrets point to the cloudsql instance, remote secrets only need the aws config. Either way the app
+        # is only switched and restarted once the migration job exists
+        graph.add('sync-secrets', step('sync-secrets', switch_secrets), deps=['db-users'] if local else ['dms-job'])
+        graph.add('restart', step('restart', restart), deps=['sync-secrets'])
+        graph.add('await-running', lambda: self._await_state(service, "RUNNING"), deps=['dms-job'])
+        graph.add('await-cdc', lambda: self._await_phase(service, target_phase="CDC"), deps=['await-running'])
+        graph.run()
+        timeline.mark('cdc-reached')
         self._logger.info(f"CDC phase reached, sync complete, ready to cutover")
+        return {**graph.report(), **timeline.to_dict()}
 
     def _create_sync_secrets(self, service, force_local=False):
         """
@@ -150,18 +313,10 @@ class MigrationCommands:
             rw_password = cfg['aws-readwrite-password']
             ro_password = cfg['aws-readonly-password']
 
-        self._k8s.create_secret(rw_secret_name, namespace,
-                                username=rw_username,
-                                password=rw_password,
-                                dbname=dbname,
-                                host=host,
-                                port=port)
-        self._k8s.create_secret(ro_secret_name, namespace,
-                                username='readonly',
-                                password=ro_password,
-                                dbname=dbname,
-                                host=host,
-                                port=port)
+        self._k8s.create_secrets(namespace, {
+            rw_secret_name: dict(username=rw_username, password=rw_password, dbname=dbname, host=host, port=port),
+            ro_secret_name: dict(username='readonly', password=ro_password, dbname=dbname, host=host, port=port),
+        })
 
     def validate_service(self, service="all"):
         """
@@ -178,19 +333,54 @@ class MigrationCommands:
                 raise ValidationError(errors)
         else:
             cfg = self._config[service]
-            restarts, states, raw = self._k8s.get_pods_status(cfg['k8s-service'])
+            restarts, states, raw = self._k8s.get_pods_status(cfg['k8s-service'], cfg['k8s-namespace'])
             self._logger.info(f"{service} states: {states}, restarts: {restarts}")
 
             for pod in raw:
-                self._logger.debug(f"pod: {pod['name']}, state: {pod['state']}, restarts: {pod['restartCount']}")
+                self._logger.debug(f"pod: {pod['pod']}/{pod['name']}, state: {pod['state']}, "
+                                   f"restarts: {pod['restartCount']}")
 
             if states != {"running"}:
                 raise ValidationError([f"service {service} is not running"])
 
+    def _check_sync_journal(self, service, journal: Journal, reset=False):
+        """
+        Journaled sync steps only hold while the migration job they started exists and has not failed. They are
+        forgotten when the job is gone or on reset, keeping the instance name (and the fact its root password was saved)
+        since the instance may still exist.
+        A FAILED job is restarted on reset, otherwise sync refuses to run.
+        """
+        if not reset and not journal.done('sync/dms-job'):
+            return
+        cfg = self._config[service]
+        project_id = self._gcp.list_projects().get(cfg["gcp-project-name"]).get("projectId")
+        region_id = cfg["gcp-instance-region"]
+        migration_job_id = f"{MJ_PREFIX}{service}"
+        state = self._gcp.check_migration_job_state(project_id, region_id, migration_job_id)
+        if state == 'FAILED':
+            if not reset:
+                raise Exception(f"migration job {migration_job_id} FAILED, rerun sync with reset to restart it")
+            self._gcp.restart_migration_job(project_id, region_id, migration_job_id)
+        elif state != 'NOT_EXISTS' and not reset:
+            return
+        self._logger.warning(f"{service}: forgetting the journaled sync steps, migration job is {state}")
+        journal.clear('sync/', keep=('sync/instance-name', 'sync/root-password-instance'))
+
+    def _journal(self, service) -> Journal:
+        if service not in self._journals:
+            self._journals[service] = Journal(self._config, service, logger=self._logger)
+        return self._journals[service]
+
     def _sql_instance_name(self, service):
         # conform the pattern that terraform expects (sql-{env-code}-p-{service-name}-{hash})
-        env = self._config[service]['k8s-env']
-        return f"sql-{ENVCODE[env]}-p-{service}-{self._now_str}"
+        # journaled on first use so that reruns create and reference the same instance
+        journal = self._journal(service)
+        name = journal.get('sync/instance-name')
+        if name is None:
+            env = self._config[service]['k8s-env']
+            name = f"sql-{ENVCODE[env]}-p-{service}-{self._now_str}"
+            journal.record('sync/instance-name', name)
+        return name
 
     def _grant_access_to_user(self, service, username_to_grant):
         """
@@ -200,7 +390,7 @@ class MigrationCommands:
 
         # Retrieve db name from readwrite-secret-name
         # Cloudsql db and AWS rds db names are same
-        self._k8s.grant_access_to_user(cfg['gcp-host'],
+        return self._k8s.grant_access_to_user(cfg['gcp-host'],
                                        DEFAULT_PORT,
                                        cfg['readwrite-secret-name'].split(".")[1],
                                        "postgres",
@@ -241,32 +431,107 @@ class MigrationCommands:
         self._logger.warning(f"not ready to promote job {service}. Job: {job_desc}")
         return False
 
-    def _await_state(self, service, target_state):
+    def _source_database_size(self, service) -> Optional[int]:
+        """
+        :return: size in bytes of the source database or None if it could not be measured
+        """
+        if service not in self._source_sizes:
+            cfg = self._config[service]
+            try:
+                self._source_sizes[service] = self._k8s.get_database_size(
+                    cfg['aws-host'], cfg['aws-port'], cfg['database-name'],
+                    cfg['aws-master-username'], cfg.get('aws-master-password'))
+            except Exception as e:
+                self._logger.warning(f"unable to measure source database size of {service}: {e}")
+                self._source_sizes[service] = None
+        return self._source_sizes[service]
+
+    def _report(self, key, value):
+        if self._reporter is not None:
+            self._reporter(key, value)
+
+    def _destination_database_size(self, service) -> int:
+        """
+        :return: size in bytes of the database on the cloudsql instance, 0 if it cannot be measured yet
+        """
+        cfg = self._config[service]
+        try:
+            return self._k8s.get_database_size(cfg['gcp-host'], DEFAULT_PORT, cfg['database-name'],
+                                               'postgres', cfg['gcp-root-password'])
+        except Exception as e:
+            self._logger.debug(f"unable to measure destination database size of {service}: {e}")
+            return 0
+
+    def _sample_dump_progress(self, service, progress: Optional[DumpProgress], poller: AdaptivePoller):
+        """
+        Sample the destination size during FULL_DUMP, log and report throughput and ETA, and refine the
+        poller's expected completion with the ETA
+        """
+        if progress is None:
+            return
+        progress.add(self._destination_database_size(service))
+        snapshot = progress.snapshot()
+        self._report('fullDump', {**snapshot, "polls": poller.polls})
+        if snapshot['stalled']:
+            self._logger.warning(f"FULL_DUMP {service} looks stalled: {progress}")
+        else:
+            self._logger.info(f"FULL_DUMP {service}: {progress}")
+        if snapshot['etaSeconds']:
+            # once the data is copied DMS may still be building indexes, let the poller back off from then on
+            poller.update_expected(poller.elapsed + snapshot['etaSeconds'])
+
+    def _expected_duration(self, service, target, size: Optional[int] = None) -> float:
+        """
+        :param target: state or phase being awaited
+        :param size: source database size in bytes, measured if not given
+        :return: expected total duration in seconds of reaching target, from the size of the source database
+        """
+        if target != 'CDC':
+            return EXPECTED_DURATION_S.get(target, EXPECTED_DURATION_S['default'])
+        size = self._source_database_size(service) if size is None else size
+        if size is None:
+            return EXPECTED_DURATION_S['default']
+        throughput = float(self._config[service].get('dms-dump-throughput-mbps', DEFAULT_DUMP_THROUGHPUT_MBPS))
+        return FULL_DUMP_OVERHEAD_S + size / (throughput * 1024 * 1024)
+
+    @staticmethod
+    def _job_duration(job_desc) -> float:
+        """
+        :return: seconds the job has been running according to DMS, e.g. "123.456s"
+        """
+        try:
+            return float(job_desc['body']['duration'].rstrip("s"))
+        except Exception:
+            return 0.0
+
+    def _await_state(self, service, target_state, max_interval=120.0):
         """
         Await a state of job
         https://cloud.google.com/database-migration/docs/reference/rest/v1alpha2/projects.locations.migrationJobs#phase
+        :param max_interval: max seconds between polls
         """
         job_desc = self._describe_dms_job(service)
         if job_desc["state"] is None:
             raise Exception(f"job was not found")
 
         current_state = job_desc['state']
-        sleep_time = 1
+        poller = AdaptivePoller(f"job/{service} {target_state}", self._expected_duration(service, target_state),
+                                max_interval=max_interval, logger=self._logger)
         self._logger.info(f"state of job/{service}: {current_state}, target: {target_state}")
         while current_state != target_state:
-            time.sleep(sleep_time)
-            sleep_time = min(10, sleep_time * 2)
+            poller.sleep()
             job_desc = self._describe_dms_job(service)
             if job_desc['state'] == 'FAILED':
                 raise Exception(f"job failed: {job_desc}")
             else:
                 current_state = job_desc['state']
-        self._logger.info(f"state of job/{service}: {job_desc}")
+        self._logger.info(f"state of job/{service}: {job_desc} after {poller.summary()}")
 
     def _await_phase(self, service, target_phase="CDC"):
         """
         Await a phase of data transfer. Note that the STATE of the job must be RUNNING!!!
         https://cloud.google.com/database-migration/docs/reference/rest/v1alpha2/projects.locations.migrationJobs#phase
+        Polls sparsely early on and more often near the completion expected from the source database size.
         :param service:
         :param target_phase:
         :return:
@@ -276,13 +541,17 @@ class MigrationCommands:
         if job_desc["state"] != "RUNNING":
             raise Exception(f"job was not in RUNNING state: {job_desc}")
 
-        start_time = time.time()
         current_phase = job_desc['phase']
-        sleep_time = 1
-        self._logger.info(f"phase {service}: {current_phase}, target: {target_phase}")
+        poller = AdaptivePoller(f"job/{service} {target_phase}", self._expected_duration(service, target_phase),
+                                elapsed=self._job_duration(job_desc), logger=self._logger)
+        self._logger.info(f"phase {service}: {current_phase}, target: {target_phase}, "
+                          f"expected after {poller.expected:.0f}s")
+        source_size = self._source_database_size(service)
+        progress = DumpProgress(source_size) if source_size else None
         while phases.get(current_phase, -1) < phases.get(target_phase, -2):
-            time.sleep(sleep_time)
-            sleep_time = min(10, sleep_time * 2)
+            poller.sleep()
+            if current_phase == 'FULL_DUMP':
+                self._sample_dump_progress(service, progress, poller)
             job_desc = self._describe_dms_job(service)
             if job_desc['state'] == 'COMPLETED':
                 break
@@ -290,67 +559,401 @@ class MigrationCommands:
                 raise Exception(f"job was not in RUNNING state: {job_desc}")
             else:
                 current_phase = job_desc['phase']
-        self._logger.info(f"phase {service}: {job_desc}, target: {target_phase} after {time.time() - start_time}s")
+        self._logger.info(f"phase {service}: {job_desc}, target: {target_phase} after {poller.summary()}")
+
+    def plan(self, services="all", measure=False) -> dict:
+        """
+        Shows what sync would create or change for each service and how many API calls and waits that involves,
+        without changing anything. Jobs, connection profiles and instances are listed once per project/region
+        and cached, instead of one get per resource per service.
+        :param services: "all" or comma separated list of services
+        :param measure: connect to each source database to estimate the FULL_DUMP from its actual size,
+                        otherwise gcp-instance-storage is used as an upper bound
+        :return: service -> {actions:, apiCalls:, estimatedSeconds:}
+        """
+        names = parse_services(services, self._config.keys())
+        list_calls = self._gcp.list_calls
+        plans = {}
+        for service in names:
+            plans[service] = self._plan_service(service, measure)
+            lines = [f"  {a['op']} {a['action']}  [{a['apiCalls']} calls, ~{a['seconds']:.0f}s]"
+                     for a in plans[service]['actions']]
+            self._logger.info(f"plan for {service} ({self._config[service]['gcp-migration-strategy']}), "
+                              f"~{plans[service]['estimatedSeconds']:.0f}s:\n" + "\n".join(lines))
+
+        total_calls = sum(p['apiCalls'] for p in plans.values())
+        longest = max([p['estimatedSeconds'] for p in plans.values()], default=0)
+        self._logger.info(f"plan: {len(plans)} services, ~{total_calls} API calls, longest sync ~{longest:.0f}s, "
+                          f"planned with {self._gcp.list_calls - list_calls} list calls")
+        return plans
+
+    def _plan_service(self, service, measure) -> dict:
+        """
+        :return: {actions: [{op: +|~|=|.|!, action:, apiCalls:, seconds:}], apiCalls:, estimatedSeconds:}
+        op: + create, ~ update, = unchanged, . wait, ! blocked
+        """
+        cfg = self._config[service]
+        actions = []
+
+        def add(op, action, api_calls=0, seconds=0.0):
+            actions.append({"op": op, "action": action, "apiCalls": api_calls, "seconds": seconds})
+
+        def result():
+            return {"actions": actions,
+                    "apiCalls": sum(a['apiCalls'] for a in actions),
+                    "estimatedSeconds": sum(a['seconds'] for a in actions)}
+
+        try:
+            errors = cfg.validate()
+        except Exception as e:
+            errors = [str(e)]
+        if errors:
+            add("!", f"invalid config: {errors}")
+            return result()
+        project = self._gcp.list_projects().get(cfg["gcp-project-name"])
+        if project is None:
+            add("!", f"project {cfg['gcp-project-name']} not found")
+            return result()
+        project_id = project.get("projectId")
+        region = cfg["gcp-instance-region"]
+        jobs = self._gcp.list_migration_jobs(project_id, region)
+        profiles = self._gcp.list_connection_profiles(project_id, region)
+        instances = self._gcp.list_cloudsql_instances(project_id)
+
+        job = jobs.get(f"{MJ_PREFIX}{service}")
+        if job is not None and job.get('state') == 'COMPLETED':
+            add("!", f"job {MJ_PREFIX}{service} is COMPLETED, run cleanup before syncing again")
+            return result()
+
+        src = f"{CP_SRC_PREFIX}{service}"
+        if src in profiles:
+            add("~", f"update connection profile {src} -> {cfg['aws-host']}:{cfg['aws-port']}", 2, 1)
+        else:
+            add("+", f"create connection profile {src} -> {cfg['aws-host']}:{cfg['aws-port']}", 8, 15)
+
+        tier = f"db-custom-{cfg['gcp-instance-cpu']}-{cfg['gcp-instance-mem']}"
+        if job is not None:
+            instance = job['destination'].split("/")[-1]
+            state = instances.get(instance, {}).get('state', 'NOT_FOUND')
+            add("=", f"cloudsql instance {instance} ({state})")
+        else:
+            instance = self._journal(service).get('sync/instance-name') or \
+                f"sql-{ENVCODE[cfg['k8s-env']]}-p-{service}-<timestamp>"
+            if instance in profiles:
+                add("=", f"connection profile {instance} exists from an earlier run")
+            else:
+                add("+", f"create cloudsql instance {instance} ({tier}, {cfg['gcp-instance-storage']}GB, "
+                         f"{cfg['gcp-database-version']}) and root secret {cfg['gcp-rootuser-secret-name']}", 25, 600)
+
+        if job is None:
+            add("+", f"create and start migration job {MJ_PREFIX}{service}", 12, 60)
+        else:
+            add("=", f"migration job {MJ_PREFIX}{service} is {job.get('state')}/{job.get('phase')}")
+
+        add("~", f"upsert cloudsql users readonly, readwrite and grant access", 4, 5)
+        if cfg['gcp-migration-strategy'] == 'local':
+            add("~", f"point secrets {cfg['readwrite-secret-name']}, {cfg['readonly-secret-name']} "
+                     f"to cloudsql (readonly)", 4, 1)
+        else:
+            add("~", f"point secrets {cfg['readwrite-secret-name']}, {cfg['readonly-secret-name']} to rds", 4, 1)
+        add("~", f"restart {cfg['k8s-namespace']}/{cfg['k8s-service']}", 2, 1)
+
+        if job is None or job.get('phase') == 'FULL_DUMP':
+            size = self._source_database_size(service) if measure else \
+                int(cfg['gcp-instance-storage']) * 1024 ** 3
+            running = self._expected_duration(service, 'RUNNING')
+            dump = self._expected_duration(service, 'CDC', size=size)
+            if job is not None:
+                dump = max(0.0, dump - self._job_duration({"body": job}))
+            add(".", f"await RUNNING", AdaptivePoller.estimate_polls(running), running)
+            add(".", f"await CDC ({size // 1024 ** 2}MB {'measured' if measure else 'upper bound'})",
+                AdaptivePoller.estimate_polls(dump), dump)
+        return result()
 
     def cutover(self, service):
         """
         Promote the DMS job and attach the GCP service to the newly promoted database
         :param service:
-        :return: True if promotion was successful
+        :return: timing events and the write-unavailability window, None if the job was already completed
         """
+        ctx = self._cutover_begin(service, Timeline(f"cutover/{service}", logger=self._logger))
+        if ctx is None:
+            return
+        self._cutover_freeze(ctx)
+        self._cutover_promote(ctx)
+        return self._cutover_finish(ctx)
 
-        # if remote, update the secrets to point to cloudSQL such that no
-        # new writes go to RDS from this point forward
-        cfg = self._config[service]
-        app = cfg['k8s-service']
-        namespace = cfg['k8s-namespace']
-        strategy = cfg['gcp-migration-strategy']
+    def _cutover_begin(self, service, timeline: Timeline) -> Optional[dict]:
+        """
+        Checks the job can be cut over and waits until replication lag is low enough to freeze writes
+        :return: cutover context passed to the next phases, None if the job was already completed
+        """
+        journal = self._journal(service)
 
-        # precondition: check for CDC phase
+        # precondition: check for CDC phase. A completed job is resumed if an earlier cutover promoted it
         state = self._describe_dms_job(service)
-        if state['state'] == 'COMPLETED':
+        if state['state'] == 'COMPLETED' and not journal.done('cutover/promote'):
             self._logger.info("job already completed, exiting")
-            return
-        elif state['state'] != 'RUNNING' and state['phase'] != 'CDC':
+            return None
+        elif state['state'] != 'COMPLETED' and state['state'] != 'RUNNING' and state['phase'] != 'CDC':
             raise Exception(f"{service} dms state: {state}, but expecting 'CDC' mode")
 
-        if strategy == 'remote':
+        timeline.mark('cutover-begin')
+        lag = []
+        if not journal.done('cutover/promote'):
+            # only freeze writes once CDC has caught up, otherwise the freeze lasts until it has
+            with timeline.span('lag-gate'):
+                lag = self._await_replication_lag(service)
+        return {"service": service, "timeline": timeline, "lag": lag}
+
+    def _cutover_freeze(self, ctx: dict) -> dict:
+        """
+        remote strategy: update the secrets to point to cloudSQL such that no new writes go to RDS from this point
+        forward, and restart the service
+        """
+        service, timeline = ctx['service'], ctx['timeline']
+        journal = self._journal(service)
+
+        def switch_secrets():
             self._create_sync_secrets(service, force_local=True)
-            self._k8s.restart_gcp_service(app, namespace)
-            # TODO: improve restart: wait until service finishes restarting
-            self._logger.info("waiting 2m for service to restart")
-            time.sleep(120)
+            # from here on the app only has the readonly user of the cloudsql instance
+            timeline.mark('secret-switch')
+
+        if self._config[service]['gcp-migration-strategy'] == 'remote':
+            journal.run('cutover/secret-switch', switch_secrets)
+            journal.run('cutover/restart', lambda: self._restart_and_await(service, timeline, 'restart'))
+        return ctx
 
-        self._create_cutover_secrets(service)
-        promote_success = self._promote_dms_job(service)
-        if not promote_success:
-            raise Exception(f"dms job for service {service} was not promoted")
+    def _cutover_promote(self, ctx: dict) -> dict:
+        """
+        Writes the final secrets, optionally verifies the data, promotes the job and waits for its completion
+        """
+        service, timeline = ctx['service'], ctx['timeline']
+        cfg = self._config[service]
+        journal = self._journal(service)
+        journal.run('cutover/secrets', lambda: self._create_cutover_secrets(service))
+
+        mode = cfg.get('cutover-verify')
+        if mode:
+            def verify():
+                with timeline.span('verify'):
+                    report = self.verify(service, sample=None if mode == 'full' else float(mode))
+                if not report['pass']:
+                    raise Exception(f"{service}: {len(report['mismatches'])} chunks differ between source and "
+                                    f"destination, not promoting: {report['mismatches'][:10]}")
+                return {k: report[k] for k in ('chunks', 'compared', 'seconds')}
+            journal.run('cutover/verify', verify)
+
+        def promote():
+            timeline.mark('promote-request')
+            if not self._promote_dms_job(service):
+                raise Exception(f"dms job for service {service} was not promoted")
+        journal.run('cutover/promote', promote)
 
         self._logger.info(f"await job completion for {service}")
-        self._await_state(service, 'COMPLETED')
+        self._await_state(service, 'COMPLETED', max_interval=FREEZE_POLL_MAX_INTERVAL_S)
+        timeline.mark('job-completed')
+        return ctx
 
+    def _cutover_finish(self, ctx: dict) -> dict:
+        """
+        Transfers table ownership to the readwrite user and restarts the service on the promoted database
+        :return: timing events and the write-unavailability window
+        """
+        service, timeline = ctx['service'], ctx['timeline']
+        cfg = self._config[service]
+        journal = self._journal(service)
         self._logger.info(f"job/{service} complete, doing final setup")
-        self._k8s.set_owner_all_tables(
-            cfg['gcp-host'], DEFAULT_PORT,
-            cfg['readwrite-secret-name'].split(".")[1], "postgres",
-            cfg['gcp-root-password'], 'readwrite')
-        self._k8s.restart_gcp_service(app, namespace)
-        self._logger.info(f"cutover for {service} complete. {cfg['k8s-service']} is restarting")
+
+        def transfer_ownership():
+            with timeline.span('ownership-transfer'):
+                result = self._k8s.set_owner_all_tables(
+                    cfg['gcp-host'], DEFAULT_PORT,
+                    cfg['readwrite-secret-name'].split(".")[1], "postgres",
+                    cfg['gcp-root-password'], 'readwrite')
+            self._report('ownershipTransfer', result)
+            return result
+        journal.run('cutover/owner', transfer_ownership)
+        journal.run('cutover/final-restart', lambda: self._restart_and_await(service, timeline, 'final-restart'))
+        timeline.mark('cutover-end')
+        self._logger.info(f"cutover for {service} complete. {cfg['k8s-service']} has restarted")
+        # every sample is logged, keep the task value small
+        return {**self._cutover_timing(service, timeline), "replicationLag": ctx['lag'][-60:]}
+
+    def cutover_instance(self, aws_instance) -> dict:
+        """
+        Cutover of all services migrating from the same RDS instance inside one write freeze: the lag gate, then
+        the secret switch and restart, then promote and final setup run for all services concurrently, so the
+        freeze lasts about as long as the slowest service rather than the sum of all of them.
+        A failure before the freeze aborts the whole group; a service failing after it is dropped while the
+        others complete.
+        :param aws_instance: aws-instance of the services
+        :return: service -> {writeUnavailableSeconds:, writeUnavailableFrom:, replicationLag: last sample} or {error:},
+                 and "group" -> {writeUnavailableSeconds:}
+        """
+        services = [s for s in self._config.keys() if self._config[s].get('aws-instance') == aws_instance]
+        if not services:
+            raise ValueError(f"no service with aws-instance '{aws_instance}'")
+        self._logger.info(f"group cutover of {aws_instance}: {services}")
+        origin = time.monotonic()
+        timelines = {s: Timeline(f"cutover/{s}", logger=self._logger, origin=origin) for s in services}
+        results = {}
+
+        with ThreadPoolExecutor(max_workers=len(services), thread_name_prefix=f"cutover-{aws_instance}") as pool:
+            def phase(fn, items: Dict[str, Any]) -> Dict[str, Any]:
+                futures = {s: pool.submit(fn, item) for s, item in items.items()}
+                done = {}
+                for s, future in futures.items():
+                    try:
+                        done[s] = future.result()
+                    except Exception as e:
+                        self._logger.error(f"cutover/{s} failed: {traceback.format_exc()}")
+                        results[s] = {"error": f"{type(e).__name__}: {e}"}
+                return done
+
+            contexts = phase(lambda s: self._cutover_begin(s, timelines[s]), {s: s for s in services})
+            if len(contexts) < len(services):
+                raise Exception(f"group cutover of {aws_instance} aborted before freezing writes: {results}")
+            for s in [s for s, ctx in contexts.items() if ctx is None]:
+                results[s] = None
+                del contexts[s]
+
+            # every service is frozen before any is promoted; after that each one finishes as soon as it can
+            frozen = phase(self._cutover_freeze, contexts)
+            results.update(phase(lambda ctx: self._cutover_finish(self._cutover_promote(ctx)), frozen))
+
+        window = self._group_window([timelines[s] for s in contexts])
+        self._logger.info(f"group cutover of {aws_instance}: writes unavailable for {window}s")
+        # events and lag samples are logged; the task value of the server holds 16KB, keep one line per service
+        results = {s: self._cutover_summary(r) for s, r in results.items()}
+        results["group"] = {"writeUnavailableSeconds": window}
+        failed = [s for s, r in results.items() if isinstance(r, dict) and 'error' in r]
+        if failed:
+            raise Exception(f"group cutover of {aws_instance} failed for {failed}: {results}")
+        return results
+
+    @staticmethod
+    def _cutover_summary(result: Optional[dict]) -> Optional[dict]:
+        """
+        :return: write-unavailability window and last replication lag sample of a cutover result
+        """
+        if not result or 'error' in result:
+            return result
+        lag = result.get('replicationLag') or []
+        keys = ('writeUnavailableSeconds', 'writeUnavailableFrom', 'frozenSince')
+        return {**{k: result[k] for k in keys if k in result}, "replicationLag": lag[-1] if lag else None}
+
+    @staticmethod
+    def _group_window(timelines) -> Optional[float]:
+        """
+        :return: seconds from the first write freeze to the last final restart of timelines sharing an origin
+        """
+        starts = [t.first('secret-switch') if t.first('secret-switch') is not None else t.first('cutover-begin')
+                  for t in timelines]
+        ends = [t.last('final-restart-end') for t in timelines]
+        starts, ends = [t for t in starts if t is not None], [t for t in ends if t is not None]
+        if not starts or not ends:
+            return None
+        return round(max(ends) - min(starts), 3)
+
+    def verify(self, service, sample: Optional[float] = None) -> dict:
+        """
+        Compares row counts and hashes of the source and the cloudsql database by primary key range chunks.
+        Needs direct network access to both databases.
+        :param sample: fraction of chunks to compare for a quick check, e.g. 0.05. All chunks if None
+        :return: see ParityVerifier.run
+        """
+        cfg = self._config[service]
+        source = dict(host=cfg['aws-host'], port=cfg['aws-port'], dbname=cfg['database-name'],
+                      user=cfg['aws-master-username'], password=cfg.get('aws-master-password'))
+        target = dict(host=cfg['gcp-host'], port=DEFAULT_PORT, dbname=cfg['database-name'],
+                      user='postgres', password=cfg['gcp-root-password'])
+        verifier = ParityVerifier(source, target,
+                                  workers=int(cfg.get('verify-workers', DEFAULT_VERIFY_WORKERS)),
+                                  chunk_rows=int(cfg.get('verify-chunk-rows', DEFAULT_VERIFY_CHUNK_ROWS)),
+                                  logger=self._logger)
+        report = verifier.run(sample=sample)
+        self._report('verify', {k: report[k] for k in ('compared', 'seconds', 'pass')})
+        return report
+
+    def _await_replication_lag(self, service) -> list:
+        """
+        Waits until the replication lag of the source database stays below cutover-max-lag-bytes for
+        cutover-lag-stable-samples consecutive samples. Proceeds with a warning if the lag can't be measured.
+        :raises: TimeoutError if the lag did not settle within cutover-lag-timeout seconds
+        :return: lag timeline [{t:, bytes:, seconds:}]
+        """
+        cfg = self._config[service]
+        threshold = int(cfg.get('cutover-max-lag-bytes', DEFAULT_MAX_LAG_BYTES))
+        stable_samples = int(cfg.get('cutover-lag-stable-samples', 3))
+        timeout = int(cfg.get('cutover-lag-timeout', 900))
+        start_time = time.monotonic()
+        samples, below = [], 0
+        while below < stable_samples:
+            try:
+                lag_bytes, lag_seconds = self._k8s.get_replication_lag(
+                    cfg['aws-host'], cfg['aws-port'], cfg['database-name'],
+                    cfg['aws-master-username'], cfg.get('aws-master-password'))
+            except Exception as e:
+                self._logger.warning(f"unable to measure replication lag of {service}, not gating cutover: {e}")
+                return samples
+            samples.append({"t": round(time.monotonic() - start_time, 1), "bytes": lag_bytes, "seconds": lag_seconds})
+            self._report('replicationLag', samples[-1])
+            below = below + 1 if lag_bytes <= threshold else 0
+            self._logger.info(f"replication lag {service}: {lag_bytes} bytes, {lag_seconds}s "
+                              f"(threshold {threshold} bytes, {below}/{stable_samples} below)")
+            if below >= stable_samples:
+                break
+            if time.monotonic() - start_time > timeout:
+                raise TimeoutError(f"replication lag of {service} did not stay below {threshold} bytes "
+                                   f"within {timeout}s: {samples[-stable_samples:]}")
+            time.sleep(LAG_SAMPLE_INTERVAL_S)
+        return samples
+
+    def _cutover_timing(self, service, timeline: Timeline) -> dict:
+        """
+        Computes the write-unavailability window: writes fail from the moment the app only has a readonly
+        cloudsql user (remote: secret switch, local: since the sync restart) until the final restart completed.
+        """
+        strategy = self._config[service]['gcp-migration-strategy']
+        start_event = 'secret-switch' if timeline.first('secret-switch') is not None else 'cutover-begin'
+        window = timeline.window(start_event, 'final-restart-end')
+        result = {**timeline.to_dict(),
+                  "writeUnavailableSeconds": window,
+                  "writeUnavailableFrom": start_event}
+        if strategy == 'local' or start_event != 'secret-switch':
+            # the freeze began before this cutover run, e.g. at the sync restart
+            result['frozenSince'] = self._journal(service).completed_at(
+                'sync/restart' if strategy == 'local' else 'cutover/secret-switch')
+        self._logger.info(f"cutover/{service}: writes unavailable for {window}s measured from {start_event}")
+        self._report('cutover', {"writeUnavailableSeconds": window})
+        return result
+
+    def _restart_and_await(self, service, timeline: Optional[Timeline] = None, event='restart'):
+        """
+        Restart the service and wait until its rollout is complete, up to k8s-rollout-timeout seconds
+        :param timeline: if given, marks {event}-begin and {event}-end
+        """
+        cfg = self._config[service]
+        app = cfg['k8s-service']
+        namespace = cfg['k8s-namespace']
+        if timeline is not None:
+            timeline.mark(f"{event}-begin")
+        kind = self._k8s.restart_gcp_service(app, namespace)
+        if kind is not None:
+            self._logger.info(f"waiting for {kind} {namespace}/{app} to restart")
+            self._k8s.await_rollout(app, namespace, kind=kind,
+                                    timeout=int(cfg.get('k8s-rollout-timeout', DEFAULT_ROLLOUT_TIMEOUT_S)))
+        if timeline is not None:
+            timeline.mark(f"{event}-end")
 
     def _create_cutover_secrets(self, service):
         cfg = self._config[service]
-        self._k8s.create_secret(cfg['readwrite-secret-name'], cfg['k8s-namespace'],
-                                username='readwrite',
-                                password=cfg['gcp-readwrite-password'],
-                                dbname=cfg['database-name'],
-                                host=cfg['gcp-host'],
-                                port=cfg['gcp-port'])
-        self._k8s.create_secret(cfg['readonly-secret-name'], cfg['k8s-namespace'],
-                                username='readonly',
-                                password=cfg['gcp-readonly-password'],
-                                dbname=cfg['database-name'],
-                                host=cfg['gcp-host'],
-                                port=cfg['gcp-port'])
+        gcp = dict(dbname=cfg['database-name'], host=cfg['gcp-host'], port=cfg['gcp-port'])
+        self._k8s.create_secrets(cfg['k8s-namespace'], {
+            cfg['readwrite-secret-name']: dict(username='readwrite', password=cfg['gcp-readwrite-password'], **gcp),
+            cfg['readonly-secret-name']: dict(username='readonly', password=cfg['gcp-readonly-password'], **gcp),
+        })
 
     def _create_db_users(self, service):
         """
@@ -401,16 +1004,22 @@ class MigrationCommands:
         0. Checks if connection profile exists. If there is, then updates the connection profile with new info.
         1. Creates source "postgresql" connection profile (AWS)
         2. Creates destination "cloudsql" connection profile
+        3. Saves the cloudsql root user as a k8s secret
         :param service: name of service in the config yaml
         """
+        self._create_source_profile(service)
+        self._create_root_secret(service, self._create_destination_profile(service))
 
+    def _create_source_profile(self, service):
+        """
+        Creates or updates the source "postgresql" connection profile (AWS)
+        :param service: name of service in the config yaml
+        """
         self._logger.info(f"creating connection profiles for {service}")
         config :DbConfig = self._config[service]
         project_id = self._gcp.list_projects().get(config["gcp-project-name"]).get("projectId")
         region_id = config["gcp-instance-region"]
-        migration_job_id = f"{MJ_PREFIX}{service}"
 
-        # create source connection profile
         connection_profile_id_aws = f"{CP_SRC_PREFIX}{service}"
         request_body_aws = {
             "displayName": connection_profile_id_aws,
@@ -427,16 +1036,42 @@ class MigrationCommands:
         }
         self._gcp.upsert_connection_profile(project_id, region_id, connection_profile_id_aws, request_body_aws)
 
+    def _create_destination_profile(self, service) -> Optional[str]:
+        """
+        Creates the destination "cloudsql" connection profile, which creates the cloudsql instance, if the
+        migration job does not already have one
+        :param service: name of service in the config yaml
+        :return: cloudsql host if the instance was created by this or an interrupted earlier run, otherwise None
+        """
+        config :DbConfig = self._config[service]
+        project_id = self._gcp.list_projects().get(config["gcp-project-name"]).get("projectId")
+        region_id = config["gcp-instance-region"]
+        migration_job_id = f"{MJ_PREFIX}{service}"
+        connection_profile_id_aws = f"{CP_SRC_PREFIX}{service}"
+
         # create dest, if the cloudsql instance name exists
         connection_profile_id_gcp = self._gcp.get_cloudsql_instance_name(project_id, region_id, migration_job_id)
         if connection_profile_id_gcp is not None:
             self._logger.info(f"cloud SQL destination instance for {service} already created: {connection_profile_id_gcp}")
             return None
 
-        # must create dest cloudsql instance, and save its root password
+        # a previous run may have died after creating the profile, before the job existed
         connection_profile_id_gcp = self._sql_instance_name(service)
-        cloudsql_root_password = ''.join(
-            random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(12))
+        if self._gcp.check_connection_profile_state(project_id, region_id, connection_profile_id_gcp) != 'NOT_EXISTS':
+            self._logger.info(f"cloud SQL destination profile for {service} already created: {connection_profile_id_gcp}")
+            return self._gcp.get_cloudsql_host(project_id, connection_profile_id_gcp)
+
+        # must create dest cloudsql instance, and save its root password. An earlier run may have saved it and died
+        # while creating the instance: keep that password, the instance may exist with it
+        journal = self._journal(service)
+        if journal.get('sync/root-password-instance') == connection_profile_id_gcp and config.get('gcp-root-password'):
+            cloudsql_root_password = config['gcp-root-password']
+        else:
+            cloudsql_root_password = ''.join(
+                random.SystemRandom().choice(string.ascii_uppercase + string.digits) for _ in range(12))
+            # save the password first: the instance is unusable if we die after creating it without the password
+            self._config.save({"gcp-root-password": cloudsql_root_password}, service)
+            journal.record('sync/root-password-instance', connection_profile_id_gcp)
         gcp_cpu = config["gcp-instance-cpu"]
         gcp_mem = config["gcp-instance-mem"]
         self._logger.debug(f"{connection_profile_id_gcp} cpu: {gcp_cpu}, mem: {gcp_mem}")
@@ -462,15 +1097,21 @@ class MigrationCommands:
             }
         }
         self._gcp.upsert_connection_profile(project_id, region_id, connection_profile_id_gcp, request_body_cloudsql)
-        self._config.save({"gcp-root-password": cloudsql_root_password}, service)
         self._logger.debug(f"root_password for {service}/{connection_profile_id_gcp}: {cloudsql_root_password}")
 
-        cloudsql_host = self._gcp.get_cloudsql_host(project_id, connection_profile_id_gcp)
+        return self._gcp.get_cloudsql_host(project_id, connection_profile_id_gcp)
 
-        # save the root user just in case
+    def _create_root_secret(self, service, cloudsql_host: Optional[str]):
+        """
+        save the root user just in case
+        :param cloudsql_host: host of a newly created instance or None to skip
+        """
+        if cloudsql_host is None:
+            return
+        config :DbConfig = self._config[service]
         self._k8s.create_secret(config['gcp-rootuser-secret-name'], config['k8s-namespace'],
                                 username='postgres',
-                                password=cloudsql_root_password,
+                                password=config['gcp-root-password'],
                                 dbname='postgres',
                                 host=cloudsql_host,
                                 port=DEFAULT_PORT)
@@ -519,7 +1160,7 @@ class MigrationCommands:
         Delete the completed job associated with a service. Also deletes any content associated with it
         such as connection profiles
         :param service:
-        :return:
+        :return: resource -> "deleted" or error message, None if there was no completed job
         """
         cfg = self._config[service]
         project_id = self._gcp.list_projects().get(cfg["gcp-project-name"]).get("projectId")
@@ -533,31 +1174,90 @@ class MigrationCommands:
             self._logger.warning(f"job for service {service} was not COMPLETED, exiting")
             return
 
-        job_state = job_state['body']
-        aws_ref_instance = job_state['destination'].split("/")[-1] + "-master"
-        try:
-            self._logger.info(f"deleting db ref {aws_ref_instance}")
-            self._gcp.delete_cloudsql_instance(project_id, aws_ref_instance)
-        except Exception as e:
-            self._logger.debug(traceback.format_exc())
-            self._logger.warning(f"unable to delete sql instance '{aws_ref_instance}'. {str(e)}")
-
-        try:
-            self._logger.info(f"deleting profile {job_state['source']}")
-            self._gcp.delete_dms_connection_profile(job_state['source'])
-        except Exception as e:
-            self._logger.debug(traceback.format_exc())
-            self._logger.warning(f"unable to delete source connection profile '{job_state['source']}'. {str(e)}")
+        outcomes = self._cleanup_jobs([(project_id, region, job_id, job_state['body'])])
+        if outcomes[f"job/{job_id}"] == 'deleted':
+            # the migration is over, a new sync starts from scratch
+            self._journal(service).clear()
+        return outcomes
 
-        try:
-            self._logger.info(f"deleting job {job_id}")
-            self._gcp.delete_dms_job(project_id, region, job_id)
-        except Exception as e:
-            self._logger.debug(traceback.format_exc())
-            self._logger.warning(f"unable to delete dms job {job_id}. {str(e)}")
+    def cleanup_completed(self) -> dict:
+        """
+        Delete every COMPLETED auto-mj-* job, with its reference instance and source connection profile, in the
+        projects and regions of the configured services. Jobs are found with one listing per project/region and
+        deleted concurrently.
+        :return: resource -> "deleted" or error message
+        """
+        locations = set()
+        for service in self._config.keys():
+            cfg = self._config[service]
+            project = self._gcp.list_projects().get(cfg["gcp-project-name"])
+            if project is not None:
+                locations.add((project.get("projectId"), cfg["gcp-instance-region"]))
+
+        jobs = []
+        for project_id, region in sorted(locations):
+            for job_id, job in self._gcp.list_migration_jobs(project_id, region).items():
+                if job_id.startswith(MJ_PREFIX) and job.get('state') == 'COMPLETED':
+                    jobs.append((project_id, region, job_id, job))
+        self._logger.info(f"found {len(jobs)} completed jobs: {[j[2] for j in jobs]}")
+
+        outcomes = self._cleanup_jobs(jobs)
+        for _, _, job_id, _ in jobs:
+            service = job_id[len(MJ_PREFIX):]
+            if outcomes[f"job/{job_id}"] == 'deleted' and service in self._config.keys():
+                self._journal(service).clear()
+        failed = {k: v for k, v in outcomes.items() if v != 'deleted'}
+        self._logger.info(f"cleanup: {len(outcomes) - len(failed)} resources deleted, {len(failed)} failed")
+        return outcomes
+
+    def _cleanup_jobs(self, jobs: list) -> Dict[str, str]:
+        """
+        Deletes the -master reference instance, the job and then the source connection profile (still referenced
+        by the job until it is deleted) of completed jobs. Deletes are issued concurrently and their operations
+        awaited together.
+        :param jobs: [(project_id, region, job_id, job body)]
+        :return: resource -> "deleted" or error message
+        """
+        starts = {}
+        for project_id, region, job_id, job in jobs:
+            aws_ref_instance = job['destination'].split("/")[-1] + "-master"
+            starts[f"instance/{aws_ref_instance}"] = functools.partial(
+                self._gcp.start_delete_cloudsql_instance, project_id, aws_ref_instance)
+            starts[f"job/{job_id}"] = functools.partial(self._gcp.start_delete_dms_job, project_id, region, job_id)
+        outcomes = self._delete_concurrently(starts)
+
+        starts = {f"profile/{job['source'].split('/')[-1]}":
+                  functools.partial(self._gcp.start_delete_dms_connection_profile, job['source'])
+                  for _, _, job_id, job in jobs if outcomes[f"job/{job_id}"] == 'deleted'}
+        outcomes.update(self._delete_concurrently(starts))
+        return outcomes
+
+    def _delete_concurrently(self, starts: Dict[str, Callable[[], Callable[[], dict]]]) -> Dict[str, str]:
+        """
+        :param starts: resource -> function issuing the delete and returning its operation getter
+        :return: resource -> "deleted" or error message
+        """
+        outcomes, get_ops = {}, {}
+        with ThreadPoolExecutor(max_workers=8, thread_name_prefix="delete") as pool:
+            futures = {resource: pool.submit(start) for resource, start in starts.items()}
+        for resource, future in futures.items():
+            self._logger.info(f"deleting {resource}")
+            try:
+                get_ops[resource] = future.result()
+            except Exception as e:
+                self._logger.debug(traceback.format_exc())
+                outcomes[resource] = str(e)
+        for resource, error in self._gcp.await_operations(get_ops).items():
+            outcomes[resource] = 'deleted' if error is None else error
+        for resource, outcome in outcomes.items():
+            if outcome != 'deleted':
+                self._logger.warning(f"unable to delete {resource}. {outcome}")
+        return outcomes
 
 
 class FireCli(MigrationCommands):
+    _opened = []  # instances created by fire, closed once the command is done
+
     def __init__(self, config="config.yaml", verbose=False):
         def setup_logger(verbose):
             logger = logging.getLogger(__name__)
@@ -578,7 +1278,108 @@ class FireCli(MigrationCommands):
             config=FileBasedConfig(config),
             k8s=K8sApiLocal(logger=logger),
             logger=logger)
+        FireCli._opened.append(self)
+
+    def _fleet(self, task, services, parallel, log_dir, admission=None, key: Callable[[str], str] = None, **kwargs):
+        """
+        Run a task for many services at once, see FleetRunner
+        :param key: maps a service to the argument of the task, which then runs once per distinct key, e.g. per
+                    aws-instance. The service itself by default
+        :param kwargs: passed to the task of each service
+        :return: None, raises if any of the services failed
+        """
+        def factory(logger):
+            return MigrationCommands(config=self._config, k8s=K8sApiLocal(logger=logger), logger=logger)
+
+        names = parse_services(services, self._config.keys())
+        if key is not None:
+            names = list(dict.fromkeys(key(s) for s in names))
+        results = FleetRunner(factory, logger=self._logger, parallel=parallel, log_dir=log_dir).run(
+            task, names, admission=admission, **kwargs)
+        failed = [s for s, r in results.items() if r['state'] == 'failed']
+        if failed:
+            raise Exception(f"{task} failed for {len(failed)}/{len(names)}: {failed}")
+
+    def sync(self, service=None, services=None, parallel=4, log_dir="logs", reset=False):
+        """
+        :param service: single service to sync
+        :param services: "all" or comma separated list of services to sync concurrently
+        :param parallel: max number of services synced at the same time
+        :param reset: forget the journaled sync steps and restart FAILED migration jobs
+        """
+        if services is None:
+            return super(FireCli, self).sync(service, reset=reset)
+        self._fleet('sync', services, parallel, log_dir, reset=reset)
+
+    def cutover(self, service=None, services=None, parallel=4, log_dir="logs", grouped=False):
+        """
+        :param service: single service to cutover
+        :param services: "all" or comma separated list of services to cutover concurrently
+        :param parallel: max number of services (or groups) cut over at the same time
+        :param grouped: cutover all services of the aws-instances of the given services together, see cutover_instance
+        """
+        if services is None:
+            return super(FireCli, self).cutover(service)
+        if not grouped:
+            return self._fleet('cutover', services, parallel, log_dir)
+        self._fleet('cutover_instance', services, parallel, log_dir, key=lambda s: self._config[s]['aws-instance'])
+
+    def cleanup(self, service=None, services=None, parallel=4, log_dir="logs"):
+        """
+        :param service: single service to clean up
+        :param services: "all" or comma separated list of services to clean up concurrently
+        :param parallel: max number of services cleaned up at the same time
+        """
+        if services is None:
+            return super(FireCli, self).cleanup(service)
+        self._fleet('cleanup', services, parallel, log_dir)
 
+    def schedule(self, services="all", parallel=8, max_per_project=None, max_per_region=4, max_per_source=2,
+                 order="size", creation_interval=0, measure=False, adaptive=False, sample_interval=30,
+                 log_dir="logs"):
+        """
+        Sync many services, starting as many at once as the capacity limits allow
+        :param services: "all" or comma separated list of services
+        :param parallel: max number of services synced at the same time overall
+        :param max_per_project: max concurrent syncs per gcp project, unlimited if not set
+        :param max_per_region: max concurrent syncs per gcp project and region
+        :param max_per_source: max concurrent syncs per RDS instance (aws-instance)
+        :param order: "size" (largest database first) or "priority" (migration-priority, then size)
+        :param creation_interval: min seconds between two sync starts in the same gcp project
+        :param measure: order by the measured source database size instead of gcp-instance-storage
+        :param adaptive: start one sync per RDS instance and adjust up to max_per_source from the load of each
+                         instance, sampled every sample_interval seconds, see LoadController
+        """
+        names = parse_services(services, self._config.keys())
+        sizes = {s: self._source_database_size(s) or 0 for s in names} if measure else None
+        admission = CapacityScheduler(self._config,
+                                      limits={"project": max_per_project, "region": max_per_region,
+                                              "source": max_per_source},
+                                      order=order, creation_interval=creation_interval, sizes=sizes,
+                                      logger=self._logger)
+        controller = None
+        if adaptive:
+            # any service of an instance gives the master credentials to sample it
+            sources = {admission.keys(s)['source']: self._config[s] for s in names}
+
+            def sample(source):
+                cfg = sources[source]
+                return self._k8s.get_source_load(cfg['aws-host'], cfg['aws-port'], cfg['database-name'],
+                                                 cfg['aws-master-username'], cfg.get('aws-master-password'))
+
+            controller = LoadController(admission, sample, sources.keys(), max_limit=max_per_source,
+                                        interval=sample_interval, logger=self._logger)
+            controller.start()
+        try:
+            self._fleet('sync', names, parallel, log_dir, admission=admission)
+        finally:
+            if controller is not None:
+                controller.stop()
 
 if __name__ == '__main__':
-    fire.Fire(FireCli)
+    try:
+        fire.Fire(FireCli)
+    finally:
+        # each psql session holds a kubectl exec and a database connection
+        for cli in FireCli._opened:
+            cli.close()
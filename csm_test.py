@@ -0,0 +1,77 @@
+import json
+
+from config import Config
+from config import DbConfig
+from csm import MigrationCommands
+from csm import PREFLIGHT_MAX_FAILED_DATABASES
+
+
+class _Config(Config):
+    def __init__(self, **services):
+        self._services = {k: DbConfig(k, v) for k, v in services.items()}
+
+    def keys(self):
+        return self._services.keys()
+
+    def save(self, doc, service):
+        self._services[service].props.update(doc)
+
+    def __getitem__(self, item):
+        return self._services[item]
+
+
+class _K8s:
+    def __init__(self, databases):
+        self._databases = databases
+        self.setups = 0
+
+    def check_app_healthy(self, namespace, service):
+        return True, None
+
+    def check_connection(self, *args):
+        pass
+
+    def replication_fingerprint(self, username, replpw, **kwargs):
+        return None
+
+    def create_replication_user(self, username, replpw=None, db_statuses=None, **kwargs):
+        self.setups += 1
+        db_statuses.update({db: "ok" if i % 2 else f"permission denied for database {db}\nDETAIL: ..."
+                            for i, db in enumerate(self._databases)})
+        return None
+
+
+def _service(host):
+    return {'aws-host': host, 'aws-port': 5432, 'aws-replication-username': 'repl', 'aws-replication-password': 'p',
+            'aws-master-username': 'pgadmin', 'aws-master-password': 'm', 'database-name': 'db',
+            'k8s-namespace': 'ns', 'k8s-service': 'svc'}
+
+
+def test_preflight_all_lists_failed_databases_once_per_instance():
+    config = _Config(**{f"svc-{i}": _service(f"rds-{i % 3}") for i in range(60)})
+    commands = MigrationCommands(config=config, k8s=_K8s([f"database-{i}" for i in range(400)]))
+    statuses = commands.preflight_all()
+
+    assert len(statuses) == 60 and not any(status['pass'] for status in statuses.values())
+    listed = [s for s, status in statuses.items() if 'rdsReplicationDatabases' in status]
+    assert listed == ["svc-0", "svc-1", "svc-2"]
+    databases = statuses["svc-0"]['rdsReplicationDatabases']
+    assert len(databases) == PREFLIGHT_MAX_FAILED_DATABASES + 1
+    assert databases["database-0"] == "permission denied for database database-0"
+    assert databases["..."] == f"{200 - PREFLIGHT_MAX_FAILED_DATABASES} more failed"
+    assert statuses["svc-5"]['rdsReplication'] == "failed to prepare 200/400 databases on rds-2"
+    # fits the server's task result
+    assert len(json.dumps(statuses)) < 2 ** 14
+
+
+def test_force_redoes_the_replication_setup_once_per_instance():
+    config = _Config(a=_service("rds-1"), b=_service("rds-1"), c=_service("rds-2"))
+    k8s = _K8s(["db"])
+    commands = MigrationCommands(config=config, k8s=k8s)
+    commands.preflight("a")
+    commands.preflight("b")
+    assert k8s.setups == 1
+    commands.preflight("b", force=True)
+    assert k8s.setups == 2
+    commands.preflight_all(force=True)
+    assert k8s.setups == 4
@@ -0,0 +1,113 @@
+import re
+
+# Bulk privilege and ownership statements. Each block reads the catalog once and runs every statement server side,
+# so a database with thousands of objects takes a single round trip and a single transaction. The role is passed
+# through the transaction local setting csm.role and the number of statements executed is left in csm.ddl_count.
+
+# catalogs and the replication extension are never touched
+_SYSTEM_SCHEMAS = ('pg_catalog', 'information_schema', 'pglogical')
+# hasura metadata: readwrite is granted on it, but its objects keep their owner
+_HASURA_SCHEMAS = ('hdb_catalog', 'hdb_views')
+
+OWNERSHIP_EXCLUDED_SCHEMAS = _SYSTEM_SCHEMAS + _HASURA_SCHEMAS
+READWRITE_EXCLUDED_SCHEMAS = _SYSTEM_SCHEMAS
+
+
+def _sql_list(names) -> str:
+    return "(" + ", ".join(f"'{name}'" for name in names) + ")"
+
+
+OWNERSHIP = f"""
+DO $$
+DECLARE
+  grantee text := current_setting('csm.role');
+  obj record;
+  n int := 0;
+BEGIN
+  FOR obj IN
+    SELECT CASE c.relkind WHEN 'v' THEN 'VIEW' WHEN 'm' THEN 'MATERIALIZED VIEW' WHEN 'S' THEN 'SEQUENCE'
+                          WHEN 'f' THEN 'FOREIGN TABLE' ELSE 'TABLE' END AS kind,
+           format('%I.%I', s.nspname, c.relname) AS name
+    FROM pg_class c JOIN pg_namespace s ON s.oid = c.relnamespace
+    WHERE c.relkind IN ('r', 'p', 'v', 'm', 'S', 'f')
+      AND s.nspname NOT IN {_sql_list(OWNERSHIP_EXCLUDED_SCHEMAS)} AND s.nspname NOT LIKE 'pg\\_%'
+      AND pg_get_userbyid(c.relowner) <> grantee
+      -- sequences owned by a column follow their table, extension objects belong to the extension
+      AND NOT EXISTS (SELECT 1 FROM pg_depend d
+                      WHERE d.classid = 'pg_class'::regclass AND d.objid = c.oid
+                        AND (d.deptype = 'e' OR (c.relkind = 'S' AND d.deptype IN ('a', 'i'))))
+  LOOP
+    EXECUTE format('ALTER %s %s OWNER TO %I', obj.kind, obj.name, grantee);
+    n := n + 1;
+  END LOOP;
+  FOR obj IN
+    -- prokind only exists since postgres 11, read it through jsonb to also support 9.6
+    SELECT CASE to_jsonb(p) ->> 'prokind' WHEN 'p' THEN 'PROCEDURE' ELSE 'FUNCTION' END AS kind,
+           p.oid::regprocedure::text AS name
+    FROM pg_proc p JOIN pg_namespace s ON s.oid = p.pronamespace
+    WHERE s.nspname NOT IN {_sql_list(OWNERSHIP_EXCLUDED_SCHEMAS)} AND s.nspname NOT LIKE 'pg\\_%'
+      AND pg_get_userbyid(p.proowner) <> grantee
+      AND NOT EXISTS (SELECT 1 FROM pg_aggregate a WHERE a.aggfnoid = p.oid)
+      AND NOT EXISTS (SELECT 1 FROM pg_depend d
+                      WHERE d.classid = 'pg_proc'::regclass AND d.objid = p.oid AND d.deptype = 'e')
+  LOOP
+    EXECUTE format('ALTER %s %s OWNER TO %I', obj.kind, obj.name, grantee);
+    n := n + 1;
+  END LOOP;
+  PERFORM set_config('csm.ddl_count', n::text, true);
+END
+$$;
+"""
+
+# readwrite: all privileges on every object of every application schema, hasura's included
+GRANT_READWRITE = f"""
+DO $$
+DECLARE
+  grantee text := current_setting('csm.role');
+  schema_name text;
+  n int := 0;
+BEGIN
+  FOR schema_name IN
+    SELECT nspname FROM pg_namespace
+    WHERE nspname NOT IN {_sql_list(READWRITE_EXCLUDED_SCHEMAS)} AND nspname NOT LIKE 'pg\\_%'
+  LOOP
+    EXECUTE format('GRANT USAGE ON SCHEMA %I TO %I', schema_name, grantee);
+    EXECUTE format('GRANT ALL PRIVILEGES ON ALL TABLES IN SCHEMA %I TO %I', schema_name, grantee);
+    EXECUTE format('GRANT ALL PRIVILEGES ON ALL SEQUENCES IN SCHEMA %I TO %I', schema_name, grantee);
+    EXECUTE format('GRANT EXECUTE ON ALL FUNCTIONS IN SCHEMA %I TO %I', schema_name, grantee);
+    n := n + 4;
+  END LOOP;
+  PERFORM set_config('csm.ddl_count', n::text, true);
+END
+$$;
+"""
+
+# readonly: select on tables, views and sequences of the public schema
+GRANT_READONLY = """
+DO $$
+DECLARE
+  grantee text := current_setting('csm.role');
+BEGIN
+  EXECUTE format('GRANT SELECT ON ALL TABLES IN SCHEMA public TO %I', grantee);
+  EXECUTE format('GRANT SELECT ON ALL SEQUENCES IN SCHEMA public TO %I', grantee);
+  PERFORM set_config('csm.ddl_count', '2', true);
+END
+$$;
+"""
+
+
+def grant_block(username_to_grant) -> str:
+    return GRANT_READWRITE if username_to_grant == 'readwrite' else GRANT_READONLY
+
+
+def script(block: str, role: str) -> str:
+    """
+    :param block: one of the blocks above
+    :param role: role the block applies to
+    :return: statements to send as one query; the result of the last one is the number of statements executed
+    """
+    if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_\-]*", role):
+        raise ValueError(f"invalid role name '{role}'")
+    return (f"SELECT set_config('csm.role', '{role}', true);\n"
+            f"{block}\n"
+            f"SELECT current_setting('csm.ddl_count');")
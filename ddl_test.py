@@ -0,0 +1,26 @@
+import pytest
+
+import ddl
+
+
+def test_script_sets_role_and_returns_count():
+    sql = ddl.script(ddl.OWNERSHIP, 'readwrite')
+    assert sql.startswith("SELECT set_config('csm.role', 'readwrite', true);")
+    assert sql.rstrip().endswith("SELECT current_setting('csm.ddl_count');")
+    assert ddl.grant_block('readwrite') is ddl.GRANT_READWRITE
+    assert ddl.grant_block('readonly') is ddl.GRANT_READONLY
+
+
+def test_script_rejects_unsafe_role():
+    with pytest.raises(ValueError):
+        ddl.script(ddl.OWNERSHIP, "x', true); DROP TABLE t; --")
+
+
+def test_schema_sets():
+    # readwrite keeps the grants on hasura's schemas that the former shell grant gave it
+    assert {'hdb_catalog', 'hdb_views'}.isdisjoint(ddl.READWRITE_EXCLUDED_SCHEMAS)
+    assert {'hdb_catalog', 'hdb_views', 'pglogical'} <= set(ddl.OWNERSHIP_EXCLUDED_SCHEMAS)
+    assert {'pg_catalog', 'information_schema', 'pglogical'} <= set(ddl.READWRITE_EXCLUDED_SCHEMAS)
+    assert 'public' not in ddl.OWNERSHIP_EXCLUDED_SCHEMAS
+    assert "nspname NOT IN ('pg_catalog', 'information_schema', 'pglogical')" in ddl.GRANT_READWRITE
+    assert "hdb_catalog" not in ddl.GRANT_READWRITE and "hdb_catalog" in ddl.OWNERSHIP
@@ -0,0 +1,177 @@
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+
+
+def parse_services(services, known: Iterable[str]) -> list:
+    """
+    :param services: "all", a comma separated string or a list/tuple (fire parses "a,b,c" into a tuple)
+    :param known: all service names in the config
+    :return: list of service names, in the order given
+    """
+    known = list(known)
+    if services is None or services == 'all':
+        return known
+    if isinstance(services, str):
+        services = services.split(",")
+    names = [str(s).strip() for s in services if str(s).strip()]
+    unknown = [s for s in names if s not in known]
+    if unknown:
+        raise ValueError(f"unknown services: {unknown}")
+    return names
+
+
+class _ProgressHandler(logging.Handler):
+    """
+    Records the latest message of a service logger so the progress table can show the current step
+    """
+
+    def __init__(self, row: dict):
+        super().__init__(level=logging.INFO)
+        self._row = row
+
+    def emit(self, record):
+        self._row['step'] = record.getMessage().splitlines()[0]
+
+
+class FleetRunner:
+    """
+    Runs one MigrationCommands task (sync, cutover, cleanup...) for many services concurrently with bounded
+    concurrency. Each service gets its own logger writing to {log_dir}/{task}-{service}.log, while the
+    runner prints an aggregate progress table and a summary of failures.
+    """
+
+    def __init__(self, factory: Callable[[logging.Logger], object], logger=None, parallel=4, log_dir="logs",
+                 refresh=10):
+        """
+        :param factory: builds a fresh MigrationCommands for a service logger, so clients are not shared by threads
+        :param parallel: max number of services worked on at the same time
+        :param refresh: seconds between progress table updates
+        """
+        self._factory = factory
+        self._logger = logging.getLogger(__name__) if not logger else logger
+        self._parallel = max(1, int(parallel))
+        self._log_dir = log_dir
+        self._refresh = refresh
+        self._rows: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._drawn_lines = 0
+
+    def _service_logger(self, task, service, row) -> logging.Logger:
+        os.makedirs(self._log_dir, exist_ok=True)
+        logger = logging.getLogger(f"{__name__}.{task}.{service}")
+        logger.handlers.clear()
+        logger.propagate = False
+        logger.setLevel(self._logger.level if self._logger.level != logging.NOTSET else logging.INFO)
+        handler = logging.FileHandler(os.path.join(self._log_dir, f"{task}-{service}.log"))
+        handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(message)s', datefmt='%Y/%m/%d %H:%M:%S'))
+        logger.addHandler(handler)
+        logger.addHandler(_ProgressHandler(row))
+        return logger
+
+    def _run_one(self, task, service, args, kwargs):
+        row = self._rows[service]
+        logger = self._service_logger(task, service, row)
+        row.update({"state": "running", "start": time.time()})
+        commands = None
+        try:
+            commands = self._factory(logger)
+            row['value'] = getattr(commands, task)(service, *args, **kwargs)
+            row['state'] = "ok"
+        except BaseException as e:
+            logger.error(traceback.format_exc())
+            row['state'] = "failed"
+            row['error'] = f"{type(e).__name__}: {e}"
+        finally:
+            if hasattr(commands, 'close'):
+                # don't keep every finished service's database sessions open until the fleet is done
+                commands.close()
+            row['end'] = time.time()
+            for handler in logger.handlers:
+                handler.close()
+            logger.handlers.clear()
+
+    def _table(self) -> list:
+        now = time.time()
+        lines = [f"{'SERVICE':<40} {'STATE':<8} {'ELAPSED':>8}  STEP"]
+        for service, row in self._rows.items():
+            elapsed = (row.get('end') or now) - row['start'] if 'start' in row else 0
+            step = row.get('error') if row['state'] == 'failed' else row.get('step', '')
+            lines.append(f"{service:<40} {row['state']:<8} {int(elapsed):>7}s  {(step or '')[:80]}")
+        counts = {}
+        for row in self._rows.values():
+            counts[row['state']] = counts.get(row['state'], 0) + 1
+        lines.append(", ".join(f"{k}: {v}" for k, v in sorted(counts.items())))
+        return lines
+
+    def _draw(self):
+        lines = self._table()
+        with self._lock:
+            if sys.stdout.isatty():
+                # redraw in place
+                if self._drawn_lines:
+                    sys.stdout.write(f"\x1b[{self._drawn_lines}F\x1b[J")
+                sys.stdout.write("\n".join(lines) + "\n")
+                sys.stdout.flush()
+                self._drawn_lines = len(lines)
+            else:
+                self._logger.info("progress:\n" + "\n".join(lines))
+
+    def run(self, task: str, services: list, *args, admission=None, **kwargs) -> Dict[str, dict]:
+        """
+        :param task: name of the MigrationCommands method, called as method(service, *args, **kwargs)
+        :param services: service names
+        :param admission: optional admission control (see scheduler.CapacityScheduler) deciding the order of the
+                          services and when each of them may start, on top of the parallel limit
+        :return: service -> {state: ok|failed, error:, value:, start:, end:}
+        """
+        if admission is not None:
+            services = admission.order(services)
+        self._rows = {s: {"state": "pending"} for s in services}
+        self._logger.info(f"running {task} for {len(services)} services, parallel={self._parallel}, "
+                          f"logs in {self._log_dir}/")
+        with ThreadPoolExecutor(max_workers=self._parallel, thread_name_prefix=f"fleet-{task}") as pool:
+            queued, running = list(services), {}
+            while queued or running:
+                for service in list(queued):
+                    if len(running) >= self._parallel:
+                        break
+                    if admission is None or admission.try_acquire(service):
+                        queued.remove(service)
+                        running[pool.submit(self._run_one, task, service, args, kwargs)] = service
+                if not running and admission is not None:
+                    # with nothing running no slot frees up: services the limits never admit would wait forever
+                    for service in list(queued):
+                        reason = admission.blocked(service)
+                        if reason:
+                            queued.remove(service)
+                            self._rows[service].update(state="failed", error=f"not admitted: {reason}")
+                self._draw()
+                if not running:
+                    if queued:
+                        # nothing admitted yet, e.g. spacing of starts within a project
+                        time.sleep(1)
+                    continue
+                # services waiting for admission are retried whenever one finishes, or at least every 5s
+                done, _ = wait(running, timeout=self._refresh if not queued else min(self._refresh, 5),
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    service = running.pop(future)
+                    if admission is not None:
+                        admission.release(service)
+        self._draw()
+
+        failed = {s: row for s, row in self._rows.items() if row['state'] == 'failed'}
+        self._logger.info(f"{task} finished: {len(services) - len(failed)} ok, {len(failed)} failed")
+        for service, row in failed.items():
+            self._logger.error(f"{task}/{service} failed: {row['error']} (see {self._log_dir}/{task}-{service}.log)")
+        return self._rows
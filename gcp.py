@@ -1,7 +1,11 @@
 import logging
 import random
 import string
+import threading
 import time
+from typing import Callable
+from typing import Dict
+from typing import Optional
 
 from googleapiclient import discovery
 from googleapiclient.errors import HttpError
@@ -9,27 +13,28 @@ from googleapiclient.errors import HttpError
 
 class GcpApi:
     def __init__(self, logger=None):
-        self._dms_api = None
-        self._sqladmin_api = None
-        self._resource_manager_api = None
+        # discovery clients are not thread-safe (httplib2), so each thread builds its own
+        self._clients = threading.local()
         self._projects_cache = None
+        self._list_cache = {}  # (kind, project, region) -> {name: resource}
+        self.list_calls = 0
 
         self._logger = logging.getLogger(__name__) if not logger else logger
 
     def dms(self):
-        if self._dms_api is None:
-            self._dms_api = discovery.build('datamigration', 'v1')
-        return self._dms_api
+        if getattr(self._clients, 'dms', None) is None:
+            self._clients.dms = discovery.build('datamigration', 'v1')
+        return self._clients.dms
 
     def sqladmin(self):
-        if self._sqladmin_api is None:
-            self._sqladmin_api = discovery.build('sqladmin', 'v1beta4')
-        return self._sqladmin_api
+        if getattr(self._clients, 'sqladmin', None) is None:
+            self._clients.sqladmin = discovery.build('sqladmin', 'v1beta4')
+        return self._clients.sqladmin
 
     def resource_api(self):
-        if self._resource_manager_api is None:
-            self._resource_manager_api = discovery.build('cloudresourcemanager', 'v1')
-        return self._resource_manager_api
+        if getattr(self._clients, 'resource_manager', None) is None:
+            self._clients.resource_manager = discovery.build('cloudresourcemanager', 'v1')
+        return self._clients.resource_manager
 
     def get_dms_status(self, project_id, region_id, migration_job_id):
         """
@@ -53,6 +58,28 @@ class GcpApi:
             self._logger.warning(f"failed to get migration job for {project_id}/{migration_job_id}: {error}")
             return None
 
+    def check_migration_job_state(self, project_id, region_id, migration_job_id):
+        """
+        :return: state of the migration job or 'NOT_EXISTS' if it was not found, other errors are raised
+        """
+        try:
+            response = self.dms().projects().locations().migrationJobs().get(
+                name=f"projects/{project_id}/locations/{region_id}/migrationJobs/{migration_job_id}").execute()
+            return response.get("state")
+        except HttpError as error:
+            if error.status_code == 404:
+                return 'NOT_EXISTS'
+            raise
+
+    def restart_migration_job(self, project_id, region_id, migration_job_id):
+        """
+        Restarts a stopped or failed migration job: resets the destination instance and migrates from scratch
+        """
+        op = self.dms().projects().locations().migrationJobs().restart(
+            name=f"projects/{project_id}/locations/{region_id}/migrationJobs/{migration_job_id}").execute()
+        self._await_operation(lambda: self.dms().projects().locations().operations().get(name=op['name']).execute())
+        self._logger.info(f"restarted migration job {project_id}/{migration_job_id}")
+
     def promote_dms_job(self, project_id, region_id, migration_job_id):
         try:
             self.dms().projects().locations().migrationJobs().promote(
@@ -66,19 +93,29 @@ class GcpApi:
             self.get_dms_status(project_id, region_id, migration_job_id)
 
     def delete_dms_job(self, project_id, region_id, migration_job_id):
+        self._await_operation(self.start_delete_dms_job(project_id, region_id, migration_job_id))
+
+    def start_delete_dms_job(self, project_id, region_id, migration_job_id) -> Callable[[], dict]:
         """
-        :return: Operation object
+        :return: function returning the current state of the delete operation, see await_operations
         """
         name = f"projects/{project_id}/locations/{region_id}/migrationJobs/{migration_job_id}"
         op = self.dms().projects().locations().migrationJobs().delete(name=name).execute()
-        self._await_operation(lambda: self.dms().projects().locations().operations().get(name=op['name']).execute())
+        return lambda: self.dms().projects().locations().operations().get(name=op['name']).execute()
 
     def delete_dms_connection_profile(self, name):
         """
         :param name:  projects/{projectId}/locations/{region}/connectionProfiles/{name}
         """
+        self._await_operation(self.start_delete_dms_connection_profile(name))
+
+    def start_delete_dms_connection_profile(self, name) -> Callable[[], dict]:
+        """
+        :param name:  projects/{projectId}/locations/{region}/connectionProfiles/{name}
+        :return: function returning the current state of the delete operation, see await_operations
+        """
         op = self.dms().projects().locations().connectionProfiles().delete(name=name).execute()
-        self._await_operation(lambda: self.dms().projects().locations().operations().get(name=op['name']).execute())
+        return lambda: self.dms().projects().locations().operations().get(name=op['name']).execute()
 
     def get_cloudsql_instance_name(self, project_id=None, region_id=None, migration_job_id=None):
         """
@@ -94,15 +131,18 @@ class GcpApi:
             return None
 
     def check_connection_profile_state(self, project_id, region_id, connection_profile_id):
+        """
+        :return: state of the connection profile or 'NOT_EXISTS' if it was not found, other errors are raised
+        """
         profile_path = f"projects/{project_id}/locations/{region_id}/connectionProfiles/{connection_profile_id}"
         try:
             response = self.dms().projects().locations().connectionProfiles().get(name=profile_path).execute()
             return response.get("state")
         except HttpError as error:
+            if error.status_code == 404:
+                return 'NOT_EXISTS'
             self._logger.warning(f"failed to check for connectionProfile {profile_path}: {error.status_code}")
-        except:
-            self._logger.warning(f"failed to check for connectionProfile {profile_path}")
-        return 'NOT_EXISTS'
+            raise
 
     def upsert_connection_profile(self, project_id, region_id, connection_profile_id, request_body):
         """
@@ -184,8 +224,14 @@ class GcpApi:
             raise Exception("Cannot START migration job for {}: {}".format(dms_job_path, error))
 
     def delete_cloudsql_instance(self, project_id, instance):
+        self._await_operation(self.start_delete_cloudsql_instance(project_id, instance))
+
+    def start_delete_cloudsql_instance(self, project_id, instance) -> Callable[[], dict]:
+        """
+        :return: function returning the current state of the delete operation, see await_operations
+        """
         op = self.sqladmin().instances().delete(project=project_id, instance=instance).execute()
-        self._await_operation(lambda: self.sqladmin().operations().get(project=project_id, operation=op['name']).execute())
+        return lambda: self.sqladmin().operations().get(project=project_id, operation=op['name']).execute()
 
     def create_cloudsql_user(self, project_id, instance, username, password=None):
         """
@@ -217,10 +263,67 @@ class GcpApi:
             self._logger.debug(f"discovered project names: {str(list(self._projects_cache.keys()))}")
         return self._projects_cache
 
-    def _await_operation(self, get_op):
-        timeout = 120
-        start_time = time.time()
+    def _list_all(self, key, list_page, items_key) -> dict:
+        """
+        Lists every page of a collection once and memoizes it
+        :param key: cache key
+        :param list_page: function of a page token returning a response
+        :return: resource short name -> resource
+        """
+        if key not in self._list_cache:
+            resources = {}
+            token = None
+            while True:
+                response = list_page(token)
+                self.list_calls += 1
+                for item in response.get(items_key, []):
+                    resources[item['name'].split("/")[-1]] = item
+                token = response.get('nextPageToken')
+                if not token:
+                    break
+            self._list_cache[key] = resources
+        return self._list_cache[key]
+
+    def list_migration_jobs(self, project_id, region_id) -> dict:
+        """
+        :return: migration job id -> migration job, cached
+        """
+        return self._list_all(
+            ('migrationJobs', project_id, region_id),
+            lambda token: self.dms().projects().locations().migrationJobs().list(
+                parent=f"projects/{project_id}/locations/{region_id}", pageToken=token).execute(),
+            'migrationJobs')
 
+    def list_connection_profiles(self, project_id, region_id) -> dict:
+        """
+        :return: connection profile id -> connection profile, cached
+        """
+        return self._list_all(
+            ('connectionProfiles', project_id, region_id),
+            lambda token: self.dms().projects().locations().connectionProfiles().list(
+                parent=f"projects/{project_id}/locations/{region_id}", pageToken=token).execute(),
+            'connectionProfiles')
+
+    def list_cloudsql_instances(self, project_id) -> dict:
+        """
+        :return: instance name -> cloudsql instance, cached
+        """
+        return self._list_all(
+            ('instances', project_id, None),
+            lambda token: self.sqladmin().instances().list(project=project_id, pageToken=token).execute(),
+            'items')
+
+    def _await_operation(self, get_op, timeout=600):
+        error = self.await_operations({"op": get_op}, timeout=timeout)["op"]
+        if error is not None:
+            raise Exception(error)
+
+    def await_operations(self, get_ops: Dict[str, Callable[[], dict]], timeout=600) -> Dict[str, Optional[str]]:
+        """
+        Polls many long running operations (dms or sqladmin) together until all are done
+        :param get_ops: key -> function returning the current operation
+        :return: key -> None if the operation succeeded, otherwise an error message
+        """
         def is_done(op):
             if 'done' in op:
                 return op['done']
@@ -228,9 +331,26 @@ class GcpApi:
                 return op['status'] == 'DONE'
             raise Exception(f"unable to get status of op: {list(op.keys())}")
 
-        operation = {'status': 'x'}
-        while is_done(operation) and time.time() - start_time < timeout:
-            operation = get_op()
-            time.sleep(1)
-        if is_done(operation):
-            raise Exception(f"operation {operation['name']} did not complete: {operation['status']}")
+        results = {}
+        pending = dict(get_ops)
+        deadline = time.time() + timeout
+        sleep_time = 1
+        while pending:
+            for key, get_op in list(pending.items()):
+                try:
+                    operation = get_op()
+                    if not is_done(operation):
+                        continue
+                    error = operation.get('error')
+                    results[key] = f"operation {operation.get('name')} failed: {error}" if error else None
+                except Exception as e:
+                    results[key] = str(e)
+                del pending[key]
+            if pending:
+                if time.time() > deadline:
+                    break
+                time.sleep(sleep_time)
+                sleep_time = min(10, sleep_time * 2)
+        for key in pending:
+            results[key] = f"operation did not complete within {timeout}s"
+        return results
@@ -0,0 +1,167 @@
+import logging
+import threading
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from kubernetes import watch
+from kubernetes.client import ApiException
+
+
+def _older(obj, than) -> bool:
+    """
+    :return: True if obj is an older version than than. Resource versions are opaque, but those of the api
+             server are etcd revisions; versions that are not integers are never considered older
+    """
+    try:
+        return int(obj.metadata.resource_version) < int(than.metadata.resource_version)
+    except (TypeError, ValueError):
+        return False
+
+
+class Informer:
+    """
+    In-memory cache of a kind of k8s object in one namespace: listed once, then kept current by a watch running in
+    a background thread, so repeated lookups (e.g. pod status of every service) need no API round trip.
+    The watch resumes from the last resourceVersion and relists when it has expired.
+    """
+
+    def __init__(self, list_fn: Callable, namespace: str, label_selector: Optional[str] = None,
+                 field_selector: Optional[str] = None, name="", watch_timeout=300, logger=None):
+        """
+        :param list_fn: namespaced list function of the kubernetes client, e.g. CoreV1Api.list_namespaced_pod
+        :param watch_timeout: seconds after which the server ends a watch, which is then restarted
+        """
+        self._list_fn = list_fn
+        self._namespace = namespace
+        self._selectors = {k: v for k, v in (("label_selector", label_selector), ("field_selector", field_selector))
+                           if v}
+        self._name = name or f"{getattr(list_fn, '__name__', 'list')}/{namespace}"
+        self._watch_timeout = watch_timeout
+        self._logger = logging.getLogger(__name__) if not logger else logger
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._items: Dict[str, object] = {}  # name -> object
+        self._resource_version = None
+        self._synced = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.lists = 0
+        self.events = 0
+
+    def _list(self):
+        result = self._list_fn(self._namespace, **self._selectors)
+        with self._lock:
+            items = {}
+            for item in result.items:
+                cached = self._items.get(item.metadata.name)
+                # keep objects this process wrote after the list was served
+                items[item.metadata.name] = cached if cached is not None and _older(item, cached) else item
+            self._items = items
+            self._resource_version = result.metadata.resource_version
+        self.lists += 1
+        self._synced.set()
+
+    def _watch(self):
+        while not self._stop.is_set():
+            try:
+                for event in watch.Watch().stream(self._list_fn, self._namespace,
+                                                  resource_version=self._resource_version,
+                                                  timeout_seconds=self._watch_timeout, **self._selectors):
+                    self._apply(event['type'], event['object'])
+                    if self._stop.is_set():
+                        return
+            except ApiException as e:
+                if e.status == 410:
+                    self._logger.debug(f"informer {self._name}: resource version expired, relisting")
+                    self._relist()
+                    continue
+                self._logger.warning(f"informer {self._name}: watch failed, relisting: {e}")
+                self._stop.wait(5)
+                self._relist()
+            except Exception as e:
+                self._logger.warning(f"informer {self._name}: watch failed, relisting: {e}")
+                self._stop.wait(5)
+                self._relist()
+
+    def _relist(self):
+        try:
+            self._list()
+        except Exception as e:
+            self._logger.warning(f"informer {self._name}: list failed: {e}")
+
+    def _apply(self, event_type, obj):
+        self.events += 1
+        with self._lock:
+            if obj.metadata.resource_version:
+                self._resource_version = obj.metadata.resource_version
+            cached = self._items.get(obj.metadata.name)
+            if cached is not None and _older(obj, cached):
+                # an event the watch delivers after put() stored a newer version
+                return
+            if event_type == 'DELETED':
+                self._items.pop(obj.metadata.name, None)
+            elif event_type in ('ADDED', 'MODIFIED'):
+                self._items[obj.metadata.name] = obj
+
+    def start(self) -> 'Informer':
+        """
+        Lists synchronously, then watches in the background
+        """
+        with self._start_lock:
+            if self._thread is None:
+                self._list()
+                self._thread = threading.Thread(target=self._watch, name=f"informer-{self._name}", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def put(self, obj):
+        """
+        Stores an object written by this process, so reads see it before its watch event arrives
+        """
+        self._apply('MODIFIED', obj)
+
+    def get(self, name) -> Optional[object]:
+        with self._lock:
+            return self._items.get(name)
+
+    def select(self, **labels) -> List[object]:
+        """
+        :return: cached objects whose labels include all of labels
+        """
+        with self._lock:
+            items = list(self._items.values())
+        return [i for i in items
+                if all((i.metadata.labels or {}).get(k) == v for k, v in labels.items())]
+
+    def wait_synced(self, timeout=None) -> bool:
+        return self._synced.wait(timeout)
+
+
+class InformerFactory:
+    """
+    Shares one started informer per (list function, namespace)
+    """
+
+    def __init__(self, logger=None):
+        self._logger = logging.getLogger(__name__) if not logger else logger
+        self._lock = threading.Lock()
+        self._informers: Dict[tuple, Informer] = {}
+
+    def get(self, list_fn: Callable, namespace: str) -> Informer:
+        key = (getattr(list_fn, '__name__', str(list_fn)), namespace)
+        with self._lock:
+            informer = self._informers.get(key)
+            if informer is None:
+                informer = self._informers[key] = Informer(list_fn, namespace, logger=self._logger)
+        # concurrent callers wait for the first list
+        return informer.start()
+
+    def stop(self):
+        with self._lock:
+            for informer in self._informers.values():
+                informer.stop()
@@ -0,0 +1,94 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from kubernetes.client import ApiException
+
+import informer
+from informer import Informer
+from informer import InformerFactory
+
+
+def _obj(name, rv, **labels):
+    return SimpleNamespace(metadata=SimpleNamespace(name=name, resource_version=rv, labels=labels))
+
+
+class _Lister:
+    def __init__(self, *items):
+        self.items = list(items)
+        self.calls = 0
+        self.__name__ = "list_namespaced_pod"
+
+    def __call__(self, namespace, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(items=list(self.items), metadata=SimpleNamespace(resource_version=str(self.calls)))
+
+
+@pytest.fixture
+def streams(monkeypatch):
+    """
+    scripted watch streams: each entry is a list of events or an exception; once exhausted streams block
+    """
+    scripted, versions, idle = [], [], threading.Event()
+
+    class _Watch:
+        def stream(self, fn, namespace, resource_version=None, **kwargs):
+            versions.append(resource_version)
+            if not scripted:
+                idle.set()
+                threading.Event().wait(60)
+                return
+            step = scripted.pop(0)
+            if isinstance(step, Exception):
+                raise step
+            yield from step
+
+    monkeypatch.setattr(informer.watch, "Watch", _Watch)
+    return SimpleNamespace(scripted=scripted, versions=versions, idle=idle)
+
+
+def test_lists_once_then_applies_events(streams):
+    streams.scripted.append([
+        {'type': 'ADDED', 'object': _obj("b", "7", app="svc")},
+        {'type': 'MODIFIED', 'object': _obj("a", "8", app="other")},
+        {'type': 'DELETED', 'object': _obj("c", "9", app="svc")},
+    ])
+    lister = _Lister(_obj("a", "1", app="svc"), _obj("c", "1", app="svc"))
+    cache = Informer(lister, "ns").start()
+    assert streams.idle.wait(5)
+    assert [o.metadata.name for o in cache.select(app="svc")] == ["b"]
+    assert cache.get("a").metadata.labels == {"app": "other"}
+    assert lister.calls == 1 and cache.events == 3
+    assert streams.versions == ["1", "9"]  # the second watch resumes from the last event
+    cache.stop()
+
+
+def test_expired_watch_relists(streams):
+    streams.scripted.append(ApiException(status=410))
+    lister = _Lister(_obj("a", "1", app="svc"))
+    cache = Informer(lister, "ns").start()
+    assert streams.idle.wait(5)
+    assert lister.calls == 2 and cache.lists == 2
+    cache.stop()
+
+
+def test_factory_shares_informers(streams):
+    lister = _Lister(_obj("a", "1", app="svc"))
+    factory = InformerFactory()
+    assert factory.get(lister, "ns") is factory.get(lister, "ns")
+    assert factory.get(lister, "other") is not factory.get(lister, "ns")
+    assert lister.calls == 2
+    factory.stop()
+
+
+def test_older_events_do_not_replace_newer_objects(streams):
+    lister = _Lister(_obj("cm", "5"))
+    cache = Informer(lister, "ns")
+    cache._list()
+    cache.put(_obj("cm", "9", saved="yes"))
+    cache._apply('MODIFIED', _obj("cm", "7"))
+    assert cache.get("cm").metadata.labels == {"saved": "yes"}
+    cache._list()  # served before the write
+    assert cache.get("cm").metadata.resource_version == "9"
+    cache._apply('MODIFIED', _obj("cm", "10"))
+    assert cache.get("cm").metadata.resource_version == "10"
@@ -0,0 +1,63 @@
+import copy
+import logging
+import threading
+from datetime import datetime
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+JOURNAL_KEY = 'migration-journal'
+
+
+class Journal:
+    """
+    Per-service record of completed migration steps, persisted in the config store under JOURNAL_KEY so that a
+    rerun of sync or cutover (e.g. after a pod restart) skips the steps that already completed.
+    Values must be plain yaml types (str, int, dict, list).
+    """
+
+    def __init__(self, config, service, logger=None):
+        self._config = config
+        self._service = service
+        self._logger = logging.getLogger(__name__) if not logger else logger
+        self._lock = threading.Lock()
+        self._steps = copy.deepcopy(config[service].get(JOURNAL_KEY) or {})  # step -> {at:, value:}
+
+    def done(self, step) -> bool:
+        return step in self._steps
+
+    def get(self, step, default=None) -> Any:
+        entry = self._steps.get(step)
+        return entry.get('value') if entry is not None else default
+
+    def completed_at(self, step) -> Optional[str]:
+        """
+        :return: ISO time the step was recorded or None if it did not complete
+        """
+        entry = self._steps.get(step)
+        return entry.get('at') if entry is not None else None
+
+    def record(self, step, value=None):
+        with self._lock:
+            self._steps[step] = {"at": datetime.utcnow().isoformat(), "value": value}
+            self._config.save({JOURNAL_KEY: copy.deepcopy(self._steps)}, self._service)
+
+    def run(self, step, fn: Callable[[], Any]) -> Any:
+        """
+        Run fn unless step was already completed, in which case the recorded value is returned
+        """
+        if self.done(step):
+            self._logger.info(f"{self._service}: skipping '{step}', completed at {self.completed_at(step)}")
+            return self.get(step)
+        value = fn()
+        self.record(step, value)
+        return value
+
+    def clear(self, prefix="", keep=()):
+        """
+        Forget completed steps starting with prefix, or all steps
+        :param keep: steps to remember even if they match prefix
+        """
+        with self._lock:
+            self._steps = {k: v for k, v in self._steps.items() if k in keep or not k.startswith(prefix)}
+            self._config.save({JOURNAL_KEY: copy.deepcopy(self._steps)}, self._service)
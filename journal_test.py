@@ -0,0 +1,64 @@
+import pytest
+
+from config import DbConfig
+from journal import JOURNAL_KEY
+from journal import Journal
+
+
+class _Config(dict):
+    def __init__(self, **services):
+        super().__init__({k: DbConfig(k, v) for k, v in services.items()})
+        self.saves = []
+
+    def save(self, doc, service):
+        self.saves.append((service, doc))
+        self[service].props.update(doc)
+
+
+def test_run_skips_completed_steps():
+    config = _Config(svc={})
+    calls = []
+    journal = Journal(config, "svc")
+    assert journal.run("sync/create", lambda: calls.append(1) or "job-1") == "job-1"
+    assert journal.completed_at("sync/create") is not None
+
+    # a rerun, e.g. after a pod restart, reads the journal back from the config
+    journal = Journal(config, "svc")
+    assert journal.run("sync/create", lambda: calls.append(2) or "job-2") == "job-1"
+    assert calls == [1]
+    assert len(config.saves) == 1
+
+
+def test_failed_step_is_not_recorded():
+    config = _Config(svc={})
+    journal = Journal(config, "svc")
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        journal.run("cutover/promote", fail)
+    assert not journal.done("cutover/promote")
+    assert journal.completed_at("cutover/promote") is None
+    assert config["svc"].get(JOURNAL_KEY) is None
+    assert journal.run("cutover/promote", lambda: True) is True
+
+
+def test_clear_by_prefix():
+    config = _Config(svc={JOURNAL_KEY: {"sync/a": {"at": "2024-01-01T00:00:00", "value": 1},
+                                        "cutover/b": {"at": "2024-01-02T00:00:00", "value": 2}}})
+    journal = Journal(config, "svc")
+    assert journal.completed_at("cutover/b") == "2024-01-02T00:00:00"
+    journal.clear("sync/")
+    assert not journal.done("sync/a") and journal.get("cutover/b") == 2
+    assert list(config["svc"][JOURNAL_KEY]) == ["cutover/b"]
+
+
+def test_clear_keeps_steps():
+    config = _Config(svc={JOURNAL_KEY: {"sync/a": {"at": "2024-01-01T00:00:00", "value": 1},
+                                        "sync/instance-name": {"at": "2024-01-01T00:00:00", "value": "sql-1"}}})
+    journal = Journal(config, "svc")
+    journal.clear("sync/", keep=("sync/instance-name",))
+    assert not journal.done("sync/a") and journal.get("sync/instance-name") == "sql-1"
+    journal.clear()
+    assert config["svc"][JOURNAL_KEY] == {}
@@ -1,27 +1,96 @@
 import base64
+import hashlib
 import json
 import logging
 import subprocess as sp
 import sys
 import os
+import time
 import traceback
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from datetime import timezone
 import abc
 from typing import Optional
 from typing import Tuple
 import psycopg2
 
+import ddl
+from informer import InformerFactory
+from pgpool import ConnectionPool
+from psqlsession import PsqlSession
+from psqlsession import PsqlSessions
 
 from kubernetes import client
 from kubernetes import config
-from kubernetes.client import ApiException
-from kubernetes.client import V1ObjectMeta
+from kubernetes import watch
 from kubernetes.client import V1Pod
 from kubernetes.client import V1PodList
 from kubernetes.client import V1Secret
 
 
+# lag of the logical (pglogical) replication slots of the current database, in bytes and seconds
+REPLICATION_LAG_SQL = {
+    # postgres 10+
+    "wal": """
+    SELECT coalesce(max(pg_wal_lsn_diff(pg_current_wal_lsn(), s.confirmed_flush_lsn)), 0)::bigint,
+           (SELECT extract(epoch from max(replay_lag)) FROM pg_stat_replication)
+    FROM pg_replication_slots s
+    WHERE s.slot_type = 'logical' AND s.database = current_database();
+    """,
+    # postgres 9.6
+    "xlog": """
+    SELECT coalesce(max(pg_xlog_location_diff(pg_current_xlog_location(), s.confirmed_flush_lsn)), 0)::bigint, NULL
+    FROM pg_replication_slots s
+    WHERE s.slot_type = 'logical' AND s.database = current_database();
+    """,
+}
+
+# load of a source database: connections, max_connections, active backends, backends waiting on IO or locks,
+# and the server side duration in ms of a fixed probe, which grows when the instance is short of CPU
+SOURCE_LOAD_SQL = """
+SELECT count(*), current_setting('max_connections')::int,
+       count(*) FILTER (WHERE state = 'active' AND pid <> pg_backend_pid()),
+       count(*) FILTER (WHERE state = 'active' AND wait_event_type IN ('IO', 'Lock', 'LWLock', 'BufferPin')),
+       (SELECT extract(epoch from clock_timestamp() - p.t0) * 1000
+        FROM (SELECT clock_timestamp() AS t0, (SELECT count(*) FROM generate_series(1, 200000)) AS n OFFSET 0) p)
+FROM pg_stat_activity;
+"""
+
+# state of an RDS instance that the replication setup of preflight depends on: version, target databases and the
+# replication role with its memberships. Combined with REPLICATION_OBJECTS_SQL of every target database
+REPLICATION_FINGERPRINT_SQL = """
+SELECT version(),
+       (SELECT string_agg(datname, ',' ORDER BY datname) FROM pg_database pgd
+          JOIN pg_roles pgr ON pgr.oid = pgd.datdba
+        WHERE datistemplate = FALSE AND datallowconn = TRUE AND rolname <> 'rdsadmin'),
+       (SELECT row(r.rolcanlogin, r.rolreplication,
+                   (SELECT string_agg(g.rolname, ',' ORDER BY g.rolname) FROM pg_auth_members m
+                      JOIN pg_roles g ON g.oid = m.roleid WHERE m.member = r.oid))::text
+        FROM pg_roles r WHERE r.rolname = %s);
+"""
+
+# objects of one database that the replication grants of preflight cover: schemas, tables, views and sequences,
+# and whether pglogical is installed. Works on postgres 9.6 and later
+REPLICATION_OBJECTS_SQL = """
+SELECT md5(coalesce(string_agg(o, ',' ORDER BY o), '')),
+       EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pglogical')
+FROM (SELECT 'n:' || nspname AS o FROM pg_namespace
+      WHERE nspname NOT IN ('pg_catalog', 'information_schema') AND nspname NOT LIKE 'pg_toast%'
+        AND nspname NOT LIKE 'pg_temp%'
+      UNION ALL
+      SELECT c.relkind::text || ':' || n.nspname || '.' || c.relname FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+      WHERE c.relkind IN ('r', 'p', 'v', 'm', 'f', 'S')
+        AND n.nspname NOT IN ('pg_catalog', 'information_schema') AND n.nspname NOT LIKE 'pg_toast%'
+        AND n.nspname NOT LIKE 'pg_temp%') objects;
+"""
+
+# field manager of server-side apply requests
+FIELD_MANAGER = "cloudsql-migration"
+
+
 def d64(s: str):
     try:
         return str(base64.urlsafe_b64decode(bytes(s, encoding="UTF-8")), encoding="UTF-8")
@@ -49,6 +118,13 @@ class K8sApiBase:
             config.load_config()
         self._v1: client.CoreV1Api = client.CoreV1Api()
         self._v1_apps: client.AppsV1Api = client.AppsV1Api()
+        self._informers = InformerFactory(logger=self._logger)
+
+    def close(self):
+        """
+        Releases the database connections or sessions held between calls and stops the informers' watches
+        """
+        self._informers.stop()
 
     def check_connection(self, host, port, database_name, username, password):
         """
@@ -65,10 +141,11 @@ class K8sApiBase:
         """
         raise Exception("override me")
 
-    def restart_gcp_service(self, app, namespace):
+    def restart_gcp_service(self, app, namespace) -> Optional[str]:
         """
-        Tries to restart a gcp deployment or statefulset, logs if there's a problem related to discovering the service
+        Restarts a gcp deployment or statefulset, its kind resolved from the workload cache of the namespace
         (see: https://github.com/kubernetes-client/python/issues/1378 for why we restart this way)
+        :return: kind of the restarted workload, "deployment" or "statefulset", or None if it was not found
         """
         now = str(datetime.utcnow().isoformat("T") + "Z")
         body = {
@@ -82,38 +159,84 @@ class K8sApiBase:
                 }
             }
         }
-        try:
+        kind = self.workload_kind(app, namespace)
+        if kind == "deployment":
             self._v1_apps.patch_namespaced_deployment(app, namespace, body, pretty='true')
-            return
-        except ApiException as e:
-            if e.status != 404:
-                raise e
-
-        try:
+        elif kind == "statefulset":
             self._v1_apps.patch_namespaced_stateful_set(app, namespace, body, pretty='true')
-            return
-        except ApiException as e:
-            if e.status != 404:
-                raise e
+        else:
+            self._logger.warning(f"service '{namespace}/{app}' was not found, not restarting")
+        return kind
 
-        self._logger.warning(f"service '{namespace}/{app}' was not found, not restarting")
+    def _workload(self, app, namespace) -> Tuple[Optional[str], Optional[object]]:
+        """
+        :return: kind and object of the deployment or statefulset named app, from the namespace's workload cache
+        """
+        for kind, list_fn in (("deployment", self._v1_apps.list_namespaced_deployment),
+                              ("statefulset", self._v1_apps.list_namespaced_stateful_set)):
+            obj = self._informers.get(list_fn, namespace).get(app)
+            if obj is not None:
+                return kind, obj
+        return None, None
+
+    def workload_kind(self, app, namespace) -> Optional[str]:
+        """
+        :return: "deployment" or "statefulset", or None if app is neither
+        """
+        return self._workload(app, namespace)[0]
+
+    @staticmethod
+    def _rollout_complete(kind, obj) -> bool:
+        """
+        Same conditions as `kubectl rollout status`: the controller observed the latest spec and every replica
+        was updated and is ready
+        """
+        replicas = obj.spec.replicas if obj.spec.replicas is not None else 1
+        status = obj.status
+        if (status.observed_generation or 0) < obj.metadata.generation:
+            return False
+        if (status.updated_replicas or 0) < replicas or (status.ready_replicas or 0) < replicas:
+            return False
+        if kind == "deployment":
+            # old replicas are still terminating
+            return (status.replicas or 0) <= (status.updated_replicas or 0)
+        return status.update_revision is None or status.current_revision == status.update_revision
 
-    def create_secret(self, name, namespace, **kwargs):
+    def await_rollout(self, app, namespace, kind="deployment", timeout=600):
+        """
+        Watch a deployment or statefulset until its rollout is complete
+        :param kind: "deployment" or "statefulset", as returned by restart_gcp_service
+        :param timeout: deadline in seconds
+        :raises: TimeoutError if the rollout did not complete within the deadline
         """
-        Create a database secret.
+        list_fn = {"deployment": self._v1_apps.list_namespaced_deployment,
+                   "statefulset": self._v1_apps.list_namespaced_stateful_set}[kind]
+        start_time = time.time()
+        deadline = start_time + timeout
+        w = watch.Watch()
+        while time.time() < deadline:
+            for event in w.stream(list_fn, namespace, field_selector=f"metadata.name={app}",
+                                  timeout_seconds=max(1, int(deadline - time.time()))):
+                obj = event['object']
+                if event['type'] in ("ADDED", "MODIFIED") and self._rollout_complete(kind, obj):
+                    w.stop()
+                    self._logger.info(f"{kind} {namespace}/{app} rolled out after {time.time() - start_time:.1f}s: "
+                                      f"{obj.status.ready_replicas}/{obj.spec.replicas} ready")
+                    return
+        raise TimeoutError(f"{kind} {namespace}/{app} did not finish rolling out within {timeout}s")
+
+    def create_secret(self, name, namespace, **kwargs) -> bool:
+        """
+        Create or update a database secret with one server-side apply request. The existing secret, whose password
+        is kept as old-password, is read from the secret cache of the namespace, and the apply is skipped if the
+        content would not change.
 
         :raises: exception if there's an error creating the secret
-        :return:
+        :return: True if the secret was written, False if it was unchanged
         """
-        self._logger.info(f'creating secret "{namespace}/{name}"')
-        exists = False
-        old_password = None
-        try:
-            existing: V1Secret = self._v1.read_namespaced_secret(name, namespace)
-            exists = True
-            old_password = d64(existing.data["password"])
-        except:
-            pass
+        secrets = self._informers.get(self._v1.list_namespaced_secret, namespace)
+        existing: Optional[V1Secret] = secrets.get(name)
+        old_password = d64(existing.data["password"]) if existing and "password" in (existing.data or {}) else None
 
         jdbc_url = f'jdbc:postgresql://{kwargs.get("host", "?")}:{kwargs.get("port", "?")}/{kwargs.get("dbname", "?")}'
         kwargs["jdbc_url"] = jdbc_url
@@ -123,16 +246,44 @@ class K8sApiBase:
         data = {}
         for k, v in kwargs.items():
             data[k] = e64(str(v))
-        secret = V1Secret(metadata=V1ObjectMeta(name=name, namespace=namespace), data=data)
-        if exists:
-            self._v1.patch_namespaced_secret(name, namespace, secret)
-        else:
-            self._v1.create_namespaced_secret(namespace, secret)
+        if existing and self._content_hash(existing.data or {}) == self._content_hash(data):
+            self._logger.info(f'secret "{namespace}/{name}" is unchanged')
+            return False
+
+        self._logger.info(f'applying secret "{namespace}/{name}"')
+        manifest = {"apiVersion": "v1", "kind": "Secret", "metadata": {"name": name, "namespace": namespace},
+                    "data": data}
+        # kubernetes 18.x cannot send apply patches through patch_namespaced_secret: its content type selection
+        # never picks application/apply-patch+yaml, so the request is built here. JSON is valid YAML.
+        applied = self._v1.api_client.call_api(
+            '/api/v1/namespaces/{namespace}/secrets/{name}', 'PATCH',
+            path_params={'namespace': namespace, 'name': name},
+            query_params=[('fieldManager', FIELD_MANAGER), ('force', 'true')],
+            header_params={'Content-Type': 'application/apply-patch+yaml', 'Accept': 'application/json'},
+            body=json.dumps(manifest), response_type='V1Secret', auth_settings=['BearerToken'],
+            _return_http_data_only=True)
+        secrets.put(applied)
+        return True
+
+    def create_secrets(self, namespace, secrets: dict) -> dict:
+        """
+        Create or update several secrets concurrently
+        :param secrets: name -> kwargs of create_secret
+        :return: name -> True if the secret was written, False if it was unchanged
+        """
+        with ThreadPoolExecutor(max_workers=len(secrets) or 1) as executor:
+            futures = {name: executor.submit(self.create_secret, name, namespace, **kwargs)
+                       for name, kwargs in secrets.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    @staticmethod
+    def _content_hash(data: dict) -> str:
+        return hashlib.sha256(json.dumps(data, sort_keys=True).encode("UTF-8")).hexdigest()
 
-    def grant_access_to_user(self, host, port, database_name, username, password, username_to_grant):
+    def grant_access_to_user(self, host, port, database_name, username, password, username_to_grant) -> dict:
         """
-        Grants readonly user access to SELECT on all tables and readwrite user all actions on all tables.
-        Logs if there's an error
+        Grants readonly user access to SELECT on all tables and sequences of the public schema and readwrite user
+        all privileges on all tables, sequences and functions, in one transaction.
 
         :param host:
         :param port:
@@ -140,71 +291,162 @@ class K8sApiBase:
         :param username:
         :param password:
         :param username_to_grant:
-        :return:
+        :return: {statements:, seconds:}
+        """
+        return self._run_ddl(host, port, database_name, username, password,
+                             ddl.script(ddl.grant_block(username_to_grant), username_to_grant))
+
+    def set_owner_all_tables(self, host, port, database_name, username, password, username_to_grant) -> dict:
+        """
+        Transfers ownership of all tables, views, materialized views, sequences and functions in one transaction
+        :return: {statements:, seconds:}
+        """
+        return self._run_ddl(host, port, database_name, username, password,
+                             ddl.script(ddl.OWNERSHIP, username_to_grant))
+
+    def _run_ddl(self, host, port, database_name, username, password, sql) -> dict:
+        """
+        Runs a ddl script as a single query
+        :return: {statements: number of statements the script executed, seconds:}
+        """
+        start_time = time.monotonic()
+        statements = self._execute_ddl(host, port, database_name, username, password, sql)
+        result = {"statements": statements, "seconds": round(time.monotonic() - start_time, 2)}
+        self._logger.info(f"ran {statements} ddl statements on {host}/{database_name} in {result['seconds']}s")
+        return result
+
+    def _execute_ddl(self, host, port, database_name, username, password, sql) -> int:
+        raise Exception("override me")
+
+    def get_database_size(self, host, port, database_name, username, password) -> int:
+        """
+        :return: size of the database in bytes
         """
         raise Exception("override me")
 
-    def set_owner_all_tables(self, host, port, database_name, username, password, username_to_grant):
+    def get_replication_lag(self, host, port, database_name, username, password) -> Tuple[int, Optional[float]]:
+        """
+        Measures how far logical replication of a source database is behind, from the replication slot LSNs
+        :return: lag in bytes, lag in seconds (None if unknown)
+        """
         raise Exception("override me")
 
-    def get_pods_status(self, pod_name) -> Tuple[int, set, list]:
+    def get_source_load(self, host, port, database_name, username, password) -> dict:
         """
-        :param pod_name:
-        :return: restarts, states, raw pod info
+        Samples the load of a source database instance, see SOURCE_LOAD_SQL
+        :return: {connections:, maxConnections:, active:, waiting:, probeMs:}
         """
-        statuses = sp.check_output(
-            f"kubectl get pods -lapp={pod_name} -o=jsonpath=\'{{.items[*].status.containerStatuses[0]}}\'".split()).decode(
-            sys.stdout.encoding).strip()[1:-1].split()
-        pod_infos = []
-        for status_str in statuses:
-            status = json.loads(status_str)
-            info = {"restarts": status['restartCount']}
-            info["state"] = "running" if "running" in status['state'].keys() else "error"
-            info['raw'] = status
-            pod_infos.append(info)
-        restarts = sum([int(pod["restarts"]) for pod in pod_infos])
-        states = set([pod["state"] for pod in pod_infos])
-        return restarts, states, list(map(lambda x: x['raw'], pod_infos))
+        raise Exception("override me")
+
+    @staticmethod
+    def _source_load(row) -> dict:
+        connections, max_connections, active, waiting, probe_ms = row
+        return {"connections": int(connections), "maxConnections": int(max_connections), "active": int(active),
+                "waiting": int(waiting), "probeMs": round(float(probe_ms), 1)}
 
-    def check_app_healthy(self, namespace, app) -> Tuple[bool, Optional[str]]:
+    def get_pods_status(self, pod_name, namespace=None) -> Tuple[int, set, list]:
         """
+        :param pod_name: app label of the pods
+        :param namespace: namespace of the pods, served from the pod cache of the namespace. All namespaces if None
+        :return: restarts of all containers, states ("running" if all containers of a pod run, else "error"),
+                 container statuses [{pod:, name:, state:, ready:, restartCount:}]
+        """
+        if namespace is None:
+            pods = self._v1.list_pod_for_all_namespaces(label_selector=f"app={pod_name}").items
+        else:
+            pods = self._informers.get(self._v1.list_namespaced_pod, namespace).select(app=pod_name)
+        restarts, states, raw = 0, set(), []
+        for pod in pods:
+            containers = (pod.status.container_statuses if pod.status else None) or []
+            pod_running = bool(containers)
+            for container in containers:
+                if container.state and container.state.running:
+                    state = "running"
+                elif container.state and container.state.terminated:
+                    state = "terminated"
+                else:
+                    state = "waiting"
+                pod_running = pod_running and state == "running"
+                restarts += container.restart_count or 0
+                raw.append({"pod": pod.metadata.name, "name": container.name, "state": state,
+                            "ready": bool(container.ready), "restartCount": container.restart_count or 0})
+            states.add("running" if pod_running else "error")
+        return restarts, states, raw
+
+    def check_app_healthy(self, namespace, app, restart_window=600) -> Tuple[bool, Optional[str]]:
+        """
+        Checks that the app's deployment or statefulset exists and its pods are ready and have not restarted
+        recently, from the workload and pod caches of the namespace
         :param namespace: k8s namespace
         :param app: name of app
-        :return:
+        :param restart_window: seconds during which a container restart makes the app unhealthy
+        :return: healthy, reason if not healthy
         """
-        def statefulset_or_deployment_exists():
-            try:
-                self._v1_apps.read_namespaced_deployment_status(app, namespace)
-                return True, None
-            except ApiException as e:
-                if e.status != 404:
-                    raise
-            try:
-                self._v1_apps.read_namespaced_stateful_set_status(app, namespace)
-                return True, None
-            except ApiException as e:
-                if e.status != 404:
-                    raise
-            return False
         try:
-            if not statefulset_or_deployment_exists():
+            kind, workload = self._workload(app, namespace)
+            if kind is None:
                 return False, f"statefulset or deployment {namespace}/{app} does not exist"
+            pods = self._informers.get(self._v1.list_namespaced_pod, namespace).select(app=app)
         except Exception as e:
             return False, f"failed to call k8s api in namespace {namespace}: {str(e)}"
 
-        # TODO: check pods in healthy state: no recent restarts, etc
+        replicas = workload.spec.replicas if workload.spec.replicas is not None else 1
+        error = self._pods_health(pods, replicas, restart_window)
+        if error:
+            return False, f"{kind} {namespace}/{app}: {error}"
         return True, ""
 
+    @staticmethod
+    def _pods_health(pods, replicas, restart_window, now=None) -> Optional[str]:
+        """
+        :param pods: pods of the workload, terminating pods are ignored
+        :param replicas: desired replicas of the workload
+        :param restart_window: seconds during which a container restart makes the workload unhealthy
+        :return: why the pods are unhealthy, None if they are healthy
+        """
+        now = now or datetime.now(timezone.utc)
+        pods = [p for p in pods if p.metadata.deletion_timestamp is None]
+        ready = 0
+        for pod in pods:
+            containers = (pod.status.container_statuses if pod.status else None) or []
+            for container in containers:
+                terminated = container.last_state.terminated if container.last_state else None
+                if terminated and terminated.finished_at and \
+                        (now - terminated.finished_at).total_seconds() < restart_window:
+                    return f"container {pod.metadata.name}/{container.name} restarted at " \
+                           f"{terminated.finished_at.isoformat()} ({container.restart_count} restarts)"
+            if containers and all(c.ready for c in containers):
+                ready += 1
+        if ready < replicas:
+            return f"{ready}/{replicas} pods ready"
+        return None
 
-    def create_replication_user(self, username, replpw=None, **kwargs):
+
+    def create_replication_user(self, username, replpw=None, db_statuses: Optional[dict] = None, **kwargs):
         """
         :param username: username to create
+        :param db_statuses: if given, filled with database -> "ok" or error of the per database setup
         :param kwargs: connection parameters
         :return: password for the replication user
         """
         self._logger.warning("create_replication_user not implemented in this version of k8s API - skipping")
         return None
 
+    def replication_fingerprint(self, username, replpw=None, **kwargs) -> Optional[str]:
+        """
+        Content hash of everything create_replication_user depends on, to skip it on unchanged instances
+        :param username: replication username
+        :param replpw: replication password, only its hash is part of the fingerprint
+        :param kwargs: connection parameters
+        :return: hex digest or None if not supported
+        """
+        return None
+
+    @staticmethod
+    def _fingerprint(username, replpw, row) -> str:
+        password_hash = hashlib.sha256((replpw or "").encode("UTF-8")).hexdigest()
+        return hashlib.sha256(json.dumps([username, password_hash, *row]).encode("UTF-8")).hexdigest()
+
 
 class K8sApiLocal(K8sApiBase):
     """
@@ -214,37 +456,51 @@ class K8sApiLocal(K8sApiBase):
 
     def __init__(self, **kwargs):
         super(K8sApiLocal, self).__init__(**kwargs)
+        self._sessions = PsqlSessions(self.start_psql, logger=self._logger)
 
-    def start_psql(self):
+    def start_psql(self) -> str:
         """
         :raises: exception if fails to start psql
-        :return: None
+        :return: name of the psql client pod
         """
-        sp.check_output(['bash', '-c', 'source psql-commands.sh; _start_psql'])
+        return sp.check_output(['bash', '-c', 'source psql-commands.sh; _start_psql; echo "$pod_name"']) \
+            .decode(sys.stdout.encoding).strip().splitlines()[-1]
+
+    def _session(self, host, port, database_name, username, password) -> PsqlSession:
+        return self._sessions.get(host, port, database_name, username, password)
+
+    def close(self):
+        """
+        Ends the psql sessions
+        """
+        self._sessions.close()
+        super(K8sApiLocal, self).close()
 
     def check_connection(self, host, port, database_name, username, password):
-        command = f'source psql-commands.sh; _check_connection {host} {port} {database_name} {username} {password}'
-        sp.check_output(['bash', '-c', command])
+        self._session(host, port, database_name, username, password).query("SELECT TRUE;")
         self._logger.debug("connection to '{}@{}:{}/{}' was successful".format(username, host, port, database_name))
 
-    def grant_access_to_user(self, host, port, database_name, username, password, username_to_grant):
-        self._logger.debug(f"granting access to user '{username_to_grant}' on '{database_name}'")
+    def _execute_ddl(self, host, port, database_name, username, password, sql) -> int:
         try:
-            sp.check_output(['bash', '-c', 'source psql-commands.sh; _grant_access_to_user {} {} {} {} {} {}'.format(
-                host, port, database_name, username, password, username_to_grant)])
+            output = self._session(host, port, database_name, username, password).transaction(sql)
         except Exception as ex:
-            self._logger.warning(
-                f"failed to GRANT database access permission to '{username}' on database '{database_name}'")
+            self._logger.warning(f"failed to run ddl as '{username}' on database '{database_name}'")
             raise ex
+        return int(output.splitlines()[-1])
 
-    def set_owner_all_tables(self, host, port, database_name, username, password, username_to_grant):
-        self._logger.debug(f"giving owner to all tables to user '{username_to_grant}' on '{database_name}'")
-        try:
-            sp.check_output(['bash', '-c', 'source psql-commands.sh; _set_owner_all_tables {} {} {} {} {} {}'.format(
-                host, port, database_name, username, password, username_to_grant)])
-        except Exception as ex:
-            self._logger.warning(f"failed to GRANT owner to tables to '{username}' on database '{database_name}'")
-            raise ex
+    def get_database_size(self, host, port, database_name, username, password) -> int:
+        session = self._session(host, port, database_name, username, password)
+        return int(session.query("SELECT pg_database_size(current_database());"))
+
+    def get_replication_lag(self, host, port, database_name, username, password) -> Tuple[int, Optional[float]]:
+        session = self._session(host, port, database_name, username, password)
+        version = int(session.query("SHOW server_version_num;"))
+        lag_bytes, lag_seconds = session.query(REPLICATION_LAG_SQL["wal" if version >= 100000 else "xlog"]).split("|")
+        return int(lag_bytes), float(lag_seconds) if lag_seconds else None
+
+    def get_source_load(self, host, port, database_name, username, password) -> dict:
+        output = self._session(host, port, database_name, username, password).query(SOURCE_LOAD_SQL)
+        return self._source_load(output.split("|"))
 
 
 class K8sApiNative(K8sApiBase):
@@ -252,14 +508,24 @@ class K8sApiNative(K8sApiBase):
     k8s API to be used if running on a pod in k8s.
     """
 
-    def __init__(self, **kwargs):
+    def __init__(self, pool: ConnectionPool = None, replication_workers=8, **kwargs):
+        """
+        :param pool: connection pool to use, a new one by default
+        :param replication_workers: max databases granted to the replication user at the same time
+        """
         super(K8sApiNative, self).__init__(**kwargs)
+        self._pool = pool if pool is not None else ConnectionPool(logger=self._logger)
+        self._replication_workers = replication_workers
+
+    def close(self):
+        self._pool.close_all()
+        super(K8sApiNative, self).close()
 
     def check_connection(self, host, port, database_name, username, password):
         # try to connect using the basic psycopg
         try:
-            with psycopg2.connect(dbname=database_name, host=host, port=port,
-                                    user=username, password=password) as conn:
+            with self._pool.connection(dbname=database_name, host=host, port=port,
+                                       user=username, password=password) as conn:
                 with conn.cursor() as cur:
                     cur.execute("SELECT 1")
                     cur.fetchall()
@@ -267,6 +533,30 @@ class K8sApiNative(K8sApiBase):
             self._logger.warning(f"failed to connect to postgres {host}/{database_name}")
             raise
 
+    def get_database_size(self, host, port, database_name, username, password) -> int:
+        with self._pool.connection(dbname=database_name, host=host, port=port,
+                                   user=username, password=password) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_database_size(current_database())")
+                return int(cur.fetchone()[0])
+
+    def get_replication_lag(self, host, port, database_name, username, password) -> Tuple[int, Optional[float]]:
+        with self._pool.connection(dbname=database_name, host=host, port=port,
+                                   user=username, password=password) as conn:
+            with conn.cursor() as cur:
+                cur.execute("SHOW server_version_num")
+                version = int(cur.fetchone()[0])
+                cur.execute(REPLICATION_LAG_SQL["wal" if version >= 100000 else "xlog"])
+                lag_bytes, lag_seconds = cur.fetchone()
+                return int(lag_bytes), float(lag_seconds) if lag_seconds is not None else None
+
+    def get_source_load(self, host, port, database_name, username, password) -> dict:
+        with self._pool.connection(dbname=database_name, host=host, port=port,
+                                   user=username, password=password) as conn:
+            with conn.cursor() as cur:
+                cur.execute(SOURCE_LOAD_SQL)
+                return self._source_load(cur.fetchone())
+
     def _list_schemas(self, conn):
         with conn.cursor() as cur:
             cur.execute("""
@@ -276,34 +566,15 @@ class K8sApiNative(K8sApiBase):
             """)
             return [r[0] for r in cur.fetchall()]
 
-    def grant_access_to_user(self, host, port, database_name, username, password, username_to_grant):
-        try:
-            with psycopg2.connect(dbname=database_name, host=host, port=port,
-                                    user=username, password=password) as conn:
-                priv = "ALL PRIVILEGES" if username_to_grant == 'readwrite' else 'SELECT'
-                schemas = self._list_schemas(conn) if username_to_grant == 'readwrite' else ['public']
-                with conn.cursor() as cur:
-                    for schema in schemas:
-                        cur.execute(f"GRANT {priv} ON ALL TABLES in SCHEMA {schema} to {username_to_grant};")
-        except psycopg2.Error:
-            print(f"failed to connect to postgres")
-            raise
-
-    def set_owner_all_tables(self, host, port, database_name, username, password, username_to_grant):
+    def _execute_ddl(self, host, port, database_name, username, password, sql) -> int:
         try:
-            with psycopg2.connect(dbname=database_name, host=host, port=port,
-                                  user=username, password=password) as conn:
+            with self._pool.connection(dbname=database_name, host=host, port=port,
+                                       user=username, password=password) as conn:
                 with conn.cursor() as cur:
-                    cur.execute("""
-                    select schemaname, tablename from pg_catalog.pg_tables where schemaname in 
-                        (select distinct schemaname from pg_catalog.pg_tables
-                         where schemaname not in ('pg_catalog', 'information_schema', 'hdb_catalog', 'hdb_views', 'pglogical'));
-                    """)
-                    tables = [f"{r[0]}.{r[1]}" for r in cur.fetchall()]
-                    for table in tables:
-                        cur.execute(f"ALTER TABLE {table} OWNER TO {username_to_grant};")
+                    cur.execute(sql)
+                    return int(cur.fetchone()[0])
         except psycopg2.Error:
-            print(f"failed to connect to postgres")
+            self._logger.warning(f"failed to run ddl as '{username}' on database '{database_name}'")
             raise
 
     def _list_target_databases(self, conn):
@@ -333,10 +604,13 @@ class K8sApiNative(K8sApiBase):
             cur.execute(f"ALTER USER {username} PASSWORD '{password}'")
             cur.execute(f"GRANT rds_replication TO {username}")
 
-    def _assign_replication_user(self, username, **kwargs):
+    def _assign_replication_user(self, username, **kwargs) -> str:
+        """
+        :return: "ok" or the error
+        """
         self._logger.info(f"granting {username} on db/{kwargs['dbname']}")
         try:
-            with psycopg2.connect(**kwargs) as conn:
+            with self._pool.connection(**kwargs) as conn:
                 with conn.cursor() as cur:
                     self._logger.info(f"create pglogical extension on db/{kwargs['dbname']}")
                     cur.execute("CREATE EXTENSION IF NOT EXISTS pglogical;")
@@ -349,27 +623,52 @@ class K8sApiNative(K8sApiBase):
                         cur.execute(f"GRANT USAGE on SCHEMA {schema} to {username}")
                         cur.execute(f"GRANT SELECT on ALL TABLES in SCHEMA {schema} to {username}")
                         cur.execute(f"GRANT SELECT on ALL SEQUENCES in SCHEMA {schema} to {username}")
-        except psycopg2.Error:
+            return "ok"
+        except psycopg2.Error as e:
             self._logger.warning(f"failed to _assign_replication_user on db/{kwargs['dbname']}")
             self._logger.warning(traceback.format_exc())
+            return f"failed to grant {username} on db/{kwargs['dbname']}: {str(e).strip()}"
 
-
-    def create_replication_user(self, username, replpw=None, **kwargs):
+    def create_replication_user(self, username, replpw=None, db_statuses: Optional[dict] = None, **kwargs):
         """
         see: https://cloud.google.com/database-migration/docs/postgres/configure-source-database#configure-your-source-databases
         :param username: username to create
+        :param db_statuses: if given, filled with database -> "ok" or error of the per database grants
         :param kwargs: connection parameters: dbname, host, port, username, password
         :return: password for the replication user
         """
         replication_pw = replpw if replpw is not None else str(uuid.uuid4())
         try:
-            with psycopg2.connect(**kwargs) as conn:
+            with self._pool.connection(**kwargs) as conn:
                 self._create_replication_user(username, replication_pw, conn)
                 target_dbs = self._list_target_databases(conn)
                 conn.commit()
-            for db in target_dbs:
-                self._assign_replication_user(username, **{**kwargs, "dbname": db})
         except psycopg2.Error:
             self._logger.warning(f"failed to connect to postgres in create_replication_user")
             raise
-        return replication_pw
\ No newline at end of file
+        # each database needs its own connection, grant them concurrently
+        with ThreadPoolExecutor(max_workers=max(1, min(self._replication_workers, len(target_dbs))),
+                                thread_name_prefix="grant-replication") as pool:
+            statuses = dict(zip(target_dbs, pool.map(
+                lambda db: self._assign_replication_user(username, **{**kwargs, "dbname": db}), target_dbs)))
+        if db_statuses is not None:
+            db_statuses.update(statuses)
+        return replication_pw
+
+    def replication_fingerprint(self, username, replpw=None, **kwargs) -> Optional[str]:
+        with self._pool.connection(**kwargs) as conn:
+            with conn.cursor() as cur:
+                cur.execute(REPLICATION_FINGERPRINT_SQL, (username,))
+                row = cur.fetchone()
+
+        def objects(db):
+            with self._pool.connection(**{**kwargs, "dbname": db}) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(REPLICATION_OBJECTS_SQL)
+                    return [db, *cur.fetchone()]
+
+        # a new schema, table or sequence needs new grants, so it changes the fingerprint
+        databases = row[1].split(",") if row[1] else []
+        with ThreadPoolExecutor(max_workers=max(1, min(self._replication_workers, len(databases)))) as executor:
+            digests = list(executor.map(objects, databases))
+        return self._fingerprint(username, replpw, [*row, digests])
@@ -0,0 +1,79 @@
+import json
+import logging
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from types import SimpleNamespace
+
+from kube import K8sApiBase
+from kube import K8sApiNative
+from kube import d64
+from kube import e64
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def _pod(name, ready=True, restarted_ago=None, deleting=False):
+    terminated = SimpleNamespace(finished_at=NOW - timedelta(seconds=restarted_ago)) if restarted_ago else None
+    container = SimpleNamespace(name="app", ready=ready, restart_count=1 if terminated else 0,
+                                last_state=SimpleNamespace(terminated=terminated))
+    return SimpleNamespace(metadata=SimpleNamespace(name=name, deletion_timestamp=NOW if deleting else None),
+                           status=SimpleNamespace(container_statuses=[container]))
+
+
+def test_pods_health():
+    health = K8sApiBase._pods_health
+    assert health([_pod("a"), _pod("b", restarted_ago=3600)], 2, 600, now=NOW) is None
+    assert health([_pod("a"), _pod("b", ready=False)], 2, 600, now=NOW) == "1/2 pods ready"
+    assert health([_pod("a"), _pod("b", ready=False, deleting=True)], 1, 600, now=NOW) is None
+    assert "a/app restarted" in health([_pod("a", restarted_ago=60)], 1, 600, now=NOW)
+    assert health([], 0, 600, now=NOW) is None
+
+
+class _Secrets:
+    def __init__(self, **secrets):
+        self.secrets = secrets
+
+    def get(self, name):
+        return self.secrets.get(name)
+
+    def put(self, obj):
+        self.secrets[obj.metadata.name] = obj
+
+
+class _ApiClient:
+    def __init__(self):
+        self.applied = []
+
+    def call_api(self, path, method, path_params=None, body=None, header_params=None, **kwargs):
+        manifest = json.loads(body)
+        self.applied.append((method, header_params['Content-Type'], manifest))
+        return SimpleNamespace(metadata=SimpleNamespace(name=path_params['name']), data=manifest['data'])
+
+
+def test_create_secrets_applies_changed_only():
+    k8s = K8sApiBase.__new__(K8sApiBase)
+    k8s._logger = logging.getLogger(__name__)
+    secrets = _Secrets(rw=SimpleNamespace(data={"password": e64("old")}))
+    k8s._informers = SimpleNamespace(get=lambda list_fn, namespace: secrets)
+    k8s._v1 = SimpleNamespace(list_namespaced_secret=None, api_client=_ApiClient())
+
+    written = k8s.create_secrets("ns", {"rw": dict(password="new", host="h"), "ro": dict(password="ro", host="h")})
+    assert written == {"rw": True, "ro": True}
+    applied = {m["metadata"]["name"]: m for _, _, m in k8s._v1.api_client.applied}
+    assert {t for _, t, _ in k8s._v1.api_client.applied} == {'application/apply-patch+yaml'}
+    assert d64(applied["rw"]["data"]["old-password"]) == "old"
+    assert "old-password" not in applied["ro"]["data"]
+
+    # the next apply adds old-password, after that the content is unchanged
+    k8s.create_secrets("ns", {"ro": dict(password="ro", host="h")})
+    assert k8s.create_secrets("ns", {"ro": dict(password="ro", host="h")}) == {"ro": False}
+
+
+def test_close_stops_informers():
+    calls = []
+    k8s = K8sApiNative.__new__(K8sApiNative)
+    k8s._pool = SimpleNamespace(close_all=lambda: calls.append("pool"))
+    k8s._informers = SimpleNamespace(stop=lambda: calls.append("informers"))
+    k8s.close()
+    assert calls == ["pool", "informers"]
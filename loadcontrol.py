@@ -0,0 +1,110 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+# a source is overloaded when any of these is exceeded
+DEFAULT_THRESHOLDS = {
+    "connectionRatio": 0.8,  # connections / max_connections
+    "waiting": 8,  # active backends waiting on IO or locks
+    "probeFactor": 3.0,  # probe duration relative to the fastest probe seen on the source
+    "probeFloorMs": 20.0,  # probe durations below this are never considered slow
+}
+
+
+def decide(limit: int, running: int, load: dict, baseline_ms: float, min_limit=1, max_limit=4,
+           thresholds: Optional[dict] = None) -> Tuple[int, str]:
+    """
+    Additive increase / multiplicative decrease of the number of concurrent migrations on one source
+    :param limit: current limit
+    :param running: migrations currently running on the source
+    :param load: sample, see K8sApiBase.get_source_load
+    :param baseline_ms: fastest probe duration seen on the source
+    :return: new limit, reason
+    """
+    t = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+    reasons = []
+    if load['connections'] > t['connectionRatio'] * load['maxConnections']:
+        reasons.append(f"connections {load['connections']}/{load['maxConnections']}")
+    if load['waiting'] > t['waiting']:
+        reasons.append(f"{load['waiting']} backends waiting")
+    if load['probeMs'] > max(t['probeFloorMs'], t['probeFactor'] * baseline_ms):
+        reasons.append(f"probe {load['probeMs']}ms (baseline {baseline_ms}ms)")
+    if reasons:
+        return max(min_limit, limit // 2), "overloaded: " + ", ".join(reasons)
+    if running >= limit and limit < max_limit:
+        return limit + 1, "healthy and all slots in use"
+    return min(max(limit, min_limit), max_limit), "unchanged"
+
+
+class LoadController:
+    """
+    Feedback loop that adjusts the per source concurrency limit of a CapacityScheduler from the load of each source
+    RDS instance: slots are added one at a time while the source is healthy and fully used, and halved as soon as it
+    shows connection pressure, waiting backends or slow probes. Every decision is logged and kept in `decisions`.
+    """
+
+    def __init__(self, scheduler, sample: Callable[[str], dict], sources, min_limit=1, max_limit=4, interval=30.0,
+                 thresholds: Optional[dict] = None, logger=None):
+        """
+        :param scheduler: CapacityScheduler whose 'source' limits are controlled
+        :param sample: source key -> load sample, see K8sApiBase.get_source_load
+        :param sources: source keys (aws-instance) to control
+        :param max_limit: the limit never grows beyond this
+        :param interval: seconds between samples
+        """
+        self._scheduler = scheduler
+        self._sample = sample
+        self._sources = list(sources)
+        self._min = min_limit
+        self._max = max_limit
+        self._interval = interval
+        self._thresholds = thresholds
+        self._logger = logging.getLogger(__name__) if not logger else logger
+        self._baselines: Dict[str, float] = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self.decisions = deque(maxlen=1000)  # [{at:, source:, limit:, reason:, load:}]
+        for source in self._sources:
+            # slow start: the limit has to be earned from healthy samples
+            scheduler.set_limit('source', source, min_limit)
+
+    def step(self):
+        """
+        Samples every source once and adjusts its limit
+        """
+        for source in self._sources:
+            try:
+                load = self._sample(source)
+            except Exception as e:
+                self._logger.warning(f"unable to sample load of {source}, keeping its limit: {e}")
+                continue
+            baseline = self._baselines[source] = min(self._baselines.get(source, load['probeMs']), load['probeMs'])
+            limit = self._scheduler.limit('source', source)
+            new_limit, reason = decide(limit, self._scheduler.running('source', source), load, baseline,
+                                       self._min, self._max, self._thresholds)
+            if new_limit != limit:
+                self._scheduler.set_limit('source', source, new_limit)
+                self._logger.info(f"source {source}: concurrency {limit} -> {new_limit}, {reason}. load: {load}")
+            else:
+                self._logger.debug(f"source {source}: concurrency {limit}, {reason}. load: {load}")
+            self.decisions.append({"at": time.time(), "source": source, "limit": new_limit, "reason": reason,
+                                   "load": load})
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.step()
+            self._stop.wait(self._interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="load-controller", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
@@ -0,0 +1,36 @@
+from config import DbConfig
+from loadcontrol import LoadController
+from loadcontrol import decide
+from scheduler import CapacityScheduler
+
+
+def _load(connections=10, waiting=0, probe_ms=5.0):
+    return {"connections": connections, "maxConnections": 100, "active": 2, "waiting": waiting, "probeMs": probe_ms}
+
+
+def test_decide_aimd():
+    assert decide(2, 2, _load(), 5.0, max_limit=4) == (3, "healthy and all slots in use")
+    assert decide(2, 1, _load(), 5.0, max_limit=4)[0] == 2  # not all slots used
+    assert decide(4, 4, _load(), 5.0, max_limit=4)[0] == 4  # at max
+    assert decide(4, 4, _load(connections=90), 5.0)[0] == 2
+    assert decide(4, 4, _load(waiting=20), 5.0)[0] == 2
+    assert decide(4, 4, _load(probe_ms=50), 5.0)[0] == 2
+    assert decide(4, 4, _load(probe_ms=15), 1.0)[0] == 4  # below the probe floor
+    assert decide(1, 1, _load(connections=90), 5.0)[0] == 1
+
+
+def test_controller_adjusts_scheduler_limit():
+    cfg = {"a": DbConfig("a", {'gcp-project-name': 'p', 'gcp-instance-region': 'r', 'aws-instance': 'rds1',
+                               'aws-host': 'h'})}
+    scheduler = CapacityScheduler(cfg, {"source": 4})
+    samples = iter([_load(), _load(), _load(connections=95)])
+    controller = LoadController(scheduler, lambda source: next(samples), ["rds1"], max_limit=4)
+    assert scheduler.limit('source', 'rds1') == 1
+    assert scheduler.try_acquire("a")
+    controller.step()
+    assert scheduler.limit('source', 'rds1') == 2
+    controller.step()
+    assert scheduler.limit('source', 'rds1') == 2  # one of two slots in use
+    controller.step()
+    assert scheduler.limit('source', 'rds1') == 1
+    assert [d['limit'] for d in controller.decisions] == [2, 2, 1]
@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+import psycopg2
+
+
+class ConnectionPool:
+    """
+    psycopg2 connections keyed by host, port, dbname and user, so repeated operations against the same database
+    reuse an authenticated connection instead of paying a TLS handshake and authentication each time.
+    A checked out connection is used by one thread only. Connections idle for longer than check_after are
+    health checked before reuse, and connections idle for longer than idle_timeout are closed.
+    """
+
+    def __init__(self, max_size=4, idle_timeout=300.0, check_after=30.0, connect_timeout=10, logger=None):
+        """
+        :param max_size: max open connections per key; callers wait for a free one beyond that
+        :param idle_timeout: seconds after which an idle connection is closed
+        :param check_after: seconds of idleness after which a connection is checked with SELECT 1 before reuse
+        :param connect_timeout: seconds to wait for a new connection
+        """
+        self._max_size = max_size
+        self._idle_timeout = idle_timeout
+        self._check_after = check_after
+        self._connect_timeout = connect_timeout
+        self._logger = logging.getLogger(__name__) if not logger else logger
+        self._cond = threading.Condition()
+        self._idle: Dict[tuple, List[Tuple[float, object]]] = {}  # key -> [(released at, connection)]
+        self._open: Dict[tuple, int] = {}  # key -> open connections, idle or checked out
+        self.created = 0
+        self.reused = 0
+
+    @staticmethod
+    def key(host=None, port=None, dbname=None, user=None, **kwargs) -> tuple:
+        return host, int(port) if port is not None else None, dbname, user
+
+    @contextmanager
+    def connection(self, **kwargs):
+        """
+        Checks out a connection for psycopg2.connect(**kwargs). Like `with psycopg2.connect(...) as conn`, the
+        transaction is committed when the block succeeds and rolled back when it raises; the connection then
+        returns to the pool, or is closed if it broke.
+        """
+        key = self.key(**kwargs)
+        conn = self._acquire(key, kwargs)
+        try:
+            with conn:
+                yield conn
+        except BaseException:
+            self._release(key, conn)
+            raise
+        self._release(key, conn)
+
+    def _acquire(self, key, kwargs):
+        with self._cond:
+            while True:
+                self._evict_idle()
+                idle = self._idle.get(key)
+                if idle:
+                    released_at, conn = idle.pop()
+                    break
+                if self._open.get(key, 0) < self._max_size:
+                    self._open[key] = self._open.get(key, 0) + 1
+                    conn = None
+                    break
+                self._cond.wait(timeout=1.0)
+
+        if conn is not None:
+            if self._healthy(conn, time.monotonic() - released_at):
+                self.reused += 1
+                return conn
+            self._logger.debug(f"discarding broken connection to {key}")
+            self._close(conn)
+        try:
+            conn = psycopg2.connect(connect_timeout=self._connect_timeout, **kwargs)
+        except BaseException:
+            self._discard(key)
+            raise
+        self.created += 1
+        return conn
+
+    def _healthy(self, conn, idle_for) -> bool:
+        if conn.closed:
+            return False
+        if idle_for < self._check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+                cur.fetchone()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _release(self, key, conn):
+        if conn.closed:
+            self._discard(key)
+            return
+        if conn.status != psycopg2.extensions.STATUS_READY:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                self._close(conn)
+                self._discard(key)
+                return
+        with self._cond:
+            self._idle.setdefault(key, []).append((time.monotonic(), conn))
+            self._cond.notify_all()
+
+    def _discard(self, key):
+        with self._cond:
+            self._open[key] = max(0, self._open.get(key, 0) - 1)
+            self._cond.notify_all()
+
+    def _evict_idle(self):
+        """
+        must hold self._cond
+        """
+        now = time.monotonic()
+        for key, idle in self._idle.items():
+            expired = [c for t, c in idle if now - t > self._idle_timeout]
+            if expired:
+                idle[:] = [(t, c) for t, c in idle if now - t <= self._idle_timeout]
+                self._open[key] = max(0, self._open.get(key, 0) - len(expired))
+                for conn in expired:
+                    self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        with self._cond:
+            for key, idle in self._idle.items():
+                self._open[key] = max(0, self._open.get(key, 0) - len(idle))
+                for _, conn in idle:
+                    self._close(conn)
+            self._idle.clear()
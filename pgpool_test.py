@@ -0,0 +1,83 @@
+import threading
+
+import psycopg2
+import pytest
+
+import pgpool
+from pgpool import ConnectionPool
+
+
+class _Connection:
+    def __init__(self):
+        self.closed = 0
+        self.status = psycopg2.extensions.STATUS_READY
+        self.commits = 0
+        self.rollbacks = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.commits += 1
+        else:
+            self.rollbacks += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    created = []
+
+    def connect(**kwargs):
+        created.append(_Connection())
+        return created[-1]
+
+    monkeypatch.setattr(pgpool.psycopg2, "connect", connect)
+    return created
+
+
+def test_reuses_connection_per_key(connections):
+    pool = ConnectionPool()
+    for _ in range(3):
+        with pool.connection(host="h", port=5432, dbname="db", user="u", password="p"):
+            pass
+    with pool.connection(host="h", port=5432, dbname="other", user="u", password="p"):
+        pass
+    assert len(connections) == 2
+    assert pool.reused == 2
+    assert connections[0].commits == 3
+
+
+def test_broken_connection_is_replaced(connections):
+    pool = ConnectionPool()
+    with pytest.raises(ValueError):
+        with pool.connection(host="h", port=5432, dbname="db", user="u") as conn:
+            conn.closed = 2
+            raise ValueError()
+    with pool.connection(host="h", port=5432, dbname="db", user="u"):
+        pass
+    assert len(connections) == 2
+    assert connections[0].rollbacks == 1
+
+
+def test_idle_eviction_and_max_size(connections):
+    pool = ConnectionPool(max_size=1, idle_timeout=0)
+    with pool.connection(host="h", port=5432, dbname="db", user="u"):
+        waited = threading.Event()
+
+        def other():
+            with pool.connection(host="h", port=5432, dbname="db", user="u"):
+                waited.set()
+
+        thread = threading.Thread(target=other)
+        thread.start()
+        assert not waited.wait(0.2)  # blocked by max_size
+    thread.join(5)
+    assert waited.is_set()
+    assert connections[0].closed  # evicted once idle past the timeout
@@ -0,0 +1,126 @@
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Tuple
+
+
+class Step:
+    def __init__(self, name: str, fn: Callable[[], object], deps: Iterable[str] = ()):
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps)
+        self.start = None
+        self.end = None
+        self.value = None
+
+    @property
+    def duration(self):
+        if self.start is None or self.end is None:
+            return 0.0
+        return self.end - self.start
+
+
+class StepGraph:
+    """
+    A dependency graph of steps. Every step starts as soon as all of its dependencies are complete, so
+    independent steps run concurrently. The first failing step stops any new step from being scheduled and
+    its exception is re-raised once running steps have finished.
+    """
+
+    def __init__(self, name: str, logger=None, max_workers=4):
+        self._name = name
+        self._logger = logging.getLogger(__name__) if not logger else logger
+        self._max_workers = max_workers
+        self._steps: Dict[str, Step] = {}
+        self._start = None
+        self._end = None
+
+    def add(self, name: str, fn: Callable[[], object], deps: Iterable[str] = ()) -> 'StepGraph':
+        if name in self._steps:
+            raise ValueError(f"step '{name}' already exists in {self._name}")
+        self._steps[name] = Step(name, fn, deps)
+        return self
+
+    def __getitem__(self, name) -> Step:
+        return self._steps[name]
+
+    def _timed(self, step: Step):
+        step.start = time.monotonic()
+        try:
+            self._logger.debug(f"{self._name}: step '{step.name}' started")
+            step.value = step.fn()
+            return step.value
+        finally:
+            step.end = time.monotonic()
+            self._logger.debug(f"{self._name}: step '{step.name}' finished after {step.duration:.1f}s")
+
+    def run(self) -> Dict[str, object]:
+        """
+        :return: step name -> return value of the step
+        :raises: the exception of the first failed step
+        """
+        for step in self._steps.values():
+            missing = [d for d in step.deps if d not in self._steps]
+            if missing:
+                raise ValueError(f"step '{step.name}' depends on unknown steps {missing}")
+
+        done, running, error = set(), {}, None
+        self._start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix=self._name) as pool:
+            while len(done) < len(self._steps):
+                if error is None:
+                    for step in self._steps.values():
+                        if step.name not in done and step not in running.values() \
+                                and all(d in done for d in step.deps):
+                            running[pool.submit(self._timed, step)] = step
+                if not running:
+                    if error is not None:
+                        break
+                    raise ValueError(f"dependency cycle between steps {set(self._steps) - done}")
+
+                finished, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    if future.exception() is not None:
+                        self._logger.warning(f"{self._name}: step '{step.name}' failed: {future.exception()}")
+                        error = error or future.exception()
+                    else:
+                        done.add(step.name)
+        self._end = time.monotonic()
+        if error is not None:
+            raise error
+        return {name: step.value for name, step in self._steps.items()}
+
+    def critical_path(self) -> Tuple[List[str], float]:
+        """
+        :return: the chain of steps that determined the end time of the graph, and the graph's wall time
+        """
+        finished = [s for s in self._steps.values() if s.end is not None]
+        if not finished:
+            return [], 0.0
+        path = []
+        step = max(finished, key=lambda s: s.end)
+        while step is not None:
+            path.append(step.name)
+            deps = [self._steps[d] for d in step.deps if self._steps[d].end is not None]
+            step = max(deps, key=lambda s: s.end) if deps else None
+        return list(reversed(path)), self._end - self._start if self._end else 0.0
+
+    def report(self) -> dict:
+        """
+        Logs and returns the duration of each step and the critical path
+        """
+        path, wall_time = self.critical_path()
+        serial_time = sum(s.duration for s in self._steps.values())
+        self._logger.info(f"{self._name}: wall time {wall_time:.1f}s (serial {serial_time:.1f}s), "
+                          f"critical path: {' -> '.join(f'{n} ({self._steps[n].duration:.1f}s)' for n in path)}")
+        return {"wallTime": round(wall_time, 3),
+                "serialTime": round(serial_time, 3),
+                "criticalPath": path,
+                "steps": {n: round(s.duration, 3) for n, s in self._steps.items()}}
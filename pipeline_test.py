@@ -0,0 +1,47 @@
+import time
+
+import pytest
+
+from pipeline import StepGraph
+
+
+def test_independent_steps_run_concurrently():
+    graph = StepGraph("test")
+    graph.add("a", lambda: time.sleep(0.2))
+    graph.add("b", lambda: time.sleep(0.2))
+    graph.add("c", lambda: "c", deps=["a", "b"])
+    start = time.monotonic()
+    values = graph.run()
+    assert time.monotonic() - start < 0.35
+    assert values["c"] == "c"
+
+
+def test_critical_path_follows_slowest_dependency():
+    graph = StepGraph("test")
+    graph.add("fast", lambda: None)
+    graph.add("slow", lambda: time.sleep(0.1))
+    graph.add("end", lambda: None, deps=["fast", "slow"])
+    graph.run()
+    path, _ = graph.critical_path()
+    assert path == ["slow", "end"]
+
+
+def test_failure_stops_dependents():
+    ran = []
+
+    def fail():
+        raise ValueError("x")
+
+    graph = StepGraph("test")
+    graph.add("a", fail)
+    graph.add("b", lambda: ran.append("b"), deps=["a"])
+    with pytest.raises(ValueError):
+        graph.run()
+    assert ran == []
+
+
+def test_unknown_dependency():
+    graph = StepGraph("test")
+    graph.add("a", lambda: None, deps=["missing"])
+    with pytest.raises(ValueError):
+        graph.run()
@@ -0,0 +1,71 @@
+import logging
+import time
+
+
+class AdaptivePoller:
+    """
+    Poll schedule for awaiting a long running operation whose duration can be estimated.
+    Polls sparsely while the expected completion is far away (half of the remaining time per sleep) and
+    tightens to min_interval near the expected completion. Once the estimate is exceeded the interval
+    slowly backs off again, bounded by overdue_interval: an overdue operation is about to complete, and waits
+    such as promotion inside the write freeze add every second of detection latency to the downtime.
+    """
+
+    def __init__(self, name, expected: float, min_interval=2.0, max_interval=120.0, elapsed=0.0,
+                 overdue_interval=None, logger=None):
+        """
+        :param expected: expected total duration of the operation in seconds
+        :param elapsed: seconds the operation has already been running, e.g. the duration reported by DMS
+        :param overdue_interval: max interval once the expected duration is exceeded, min_interval * 4 if None
+        """
+        self._name = name
+        self._expected = float(expected)
+        self._min = min_interval
+        self._max = max_interval
+        self._overdue_max = min(max_interval, overdue_interval if overdue_interval is not None else min_interval * 4)
+        self._start = time.monotonic() - elapsed
+        self._begin = time.monotonic()
+        self._logger = logging.getLogger(__name__) if not logger else logger
+        self.polls = 0
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._start
+
+    @property
+    def expected(self) -> float:
+        return self._expected
+
+    def update_expected(self, expected: float):
+        """
+        Refine the expected total duration from observed progress
+        """
+        self._expected = float(expected)
+
+    def next_interval(self) -> float:
+        remaining = self._expected - self.elapsed
+        if remaining > 0:
+            return max(self._min, min(self._max, remaining / 2))
+        return max(self._min, min(self._overdue_max, -remaining / 4))
+
+    def sleep(self):
+        interval = self.next_interval()
+        self._logger.debug(f"{self._name}: next poll in {interval:.1f}s "
+                           f"(elapsed {self.elapsed:.0f}s, expected {self._expected:.0f}s)")
+        time.sleep(interval)
+        self.polls += 1
+
+    def summary(self) -> str:
+        return f"{self.polls} polls over {time.monotonic() - self._begin:.0f}s (expected {self._expected:.0f}s)"
+
+    @staticmethod
+    def estimate_polls(expected: float, min_interval=2.0, max_interval=120.0) -> int:
+        """
+        :return: number of polls needed if the operation completes exactly when expected
+        """
+        elapsed, polls = 0.0, 0
+        while elapsed < expected:
+            remaining = expected - elapsed
+            elapsed += max(min_interval, min(max_interval, remaining / 2))
+            polls += 1
+        return polls
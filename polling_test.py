@@ -0,0 +1,17 @@
+from polling import AdaptivePoller
+
+
+def test_sparse_early_tight_near_expected():
+    poller = AdaptivePoller("test", expected=1000, min_interval=2, max_interval=10000)
+    assert 490 < poller.next_interval() <= 500
+    poller = AdaptivePoller("test", expected=1000, min_interval=2, max_interval=10000, elapsed=999)
+    assert poller.next_interval() == 2
+
+
+def test_backs_off_when_overdue():
+    poller = AdaptivePoller("test", expected=100, min_interval=2, max_interval=60, elapsed=400)
+    assert poller.next_interval() == 8
+    poller = AdaptivePoller("test", expected=100, min_interval=2, max_interval=60, elapsed=400, overdue_interval=30)
+    assert poller.next_interval() == 30
+    poller.update_expected(1000)
+    assert poller.next_interval() == 60
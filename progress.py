@@ -0,0 +1,81 @@
+import time
+from collections import deque
+from typing import Optional
+
+
+class DumpProgress:
+    """
+    Tracks a FULL_DUMP by comparing the source database size with the growing destination database size.
+    Throughput is measured over the last `window` samples, so the ETA follows recent speed rather than the
+    average since the start of the dump.
+    """
+
+    def __init__(self, source_bytes: int, window=5, stall_after=900.0):
+        """
+        :param source_bytes: size of the source database
+        :param stall_after: seconds without destination growth after which the dump is reported as stalled
+        """
+        self._source_bytes = source_bytes
+        self._samples = deque(maxlen=window)  # (monotonic time, destination bytes)
+        self._stall_after = stall_after
+        self._last_growth = time.monotonic()
+
+    def add(self, dest_bytes: int, at: Optional[float] = None) -> dict:
+        """
+        :param dest_bytes: current size of the destination database
+        :param at: monotonic time of the sample, defaults to now
+        :return: snapshot, see snapshot()
+        """
+        at = time.monotonic() if at is None else at
+        if not self._samples or dest_bytes > self._samples[-1][1]:
+            self._last_growth = at
+        self._samples.append((at, dest_bytes))
+        return self.snapshot(at)
+
+    def throughput(self) -> Optional[float]:
+        """
+        :return: bytes per second over the sample window or None if there are not enough samples
+        """
+        if len(self._samples) < 2:
+            return None
+        (t0, b0), (t1, b1) = self._samples[0], self._samples[-1]
+        if t1 <= t0:
+            return None
+        return max(0.0, (b1 - b0) / (t1 - t0))
+
+    def eta(self) -> Optional[float]:
+        """
+        :return: estimated seconds until the destination reaches the source size or None if unknown
+        """
+        if not self._samples:
+            return None
+        remaining = self._source_bytes - self._samples[-1][1]
+        if remaining <= 0:
+            return 0.0
+        rate = self.throughput()
+        return remaining / rate if rate else None
+
+    def stalled(self, at: Optional[float] = None) -> bool:
+        at = time.monotonic() if at is None else at
+        return len(self._samples) > 1 and at - self._last_growth > self._stall_after
+
+    def snapshot(self, at: Optional[float] = None) -> dict:
+        dest_bytes = self._samples[-1][1] if self._samples else 0
+        rate = self.throughput()
+        eta = self.eta()
+        return {
+            "sourceBytes": self._source_bytes,
+            "destinationBytes": dest_bytes,
+            "percent": round(min(100.0, 100.0 * dest_bytes / self._source_bytes), 1) if self._source_bytes else None,
+            "throughputBytesPerSec": round(rate) if rate is not None else None,
+            "etaSeconds": round(eta) if eta is not None else None,
+            "stalled": self.stalled(at),
+        }
+
+    def __str__(self):
+        s = self.snapshot()
+        mb = 1024 * 1024
+        eta = f"{s['etaSeconds'] // 60}m{s['etaSeconds'] % 60:02d}s" if s['etaSeconds'] is not None else "?"
+        rate = f"{s['throughputBytesPerSec'] / mb:.1f}MB/s" if s['throughputBytesPerSec'] is not None else "?MB/s"
+        return (f"{s['percent']}% ({s['destinationBytes'] // mb}MB/{s['sourceBytes'] // mb}MB), {rate}, ETA {eta}"
+                + (", STALLED" if s['stalled'] else ""))
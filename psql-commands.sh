@@ -57,60 +57,6 @@ _check_connection() {
   return $?
 }
 
-_grant_access_to_user() {
-  # Grants permission to READWRITE or READONLY
-  host=$1
-  port=$2
-  db=$3
-  username=$4
-  password=$5
-  username_to_grant=$6
-
-  _start_psql
-
-  if [ "$username_to_grant" == "readwrite" ] ; then
-    # iterate over possible schemas and give permission READWRITE
-    schema_list=$(kubectl exec "$pod_name" -- env PGPASSWORD="${password}" psql -h "${host}" \
-    -p "${port}" -d "${db}" -U "${username}" -qAt -c "\dn;")
-    for schema in 'public' 'hdb_catalog' 'hdb_views' ; do
-      if [[ $( echo "$schema_list" | grep -c "${schema}") == 1 ]] ; then
-        kubectl exec "$pod_name" -- env PGPASSWORD="$password" psql -h "${host}" \
-        -p "${port}" -d "${db}" -U "${username}" \
-        -qAt -c "GRANT ALL PRIVILEGES ON ALL TABLES in SCHEMA ${schema} to readwrite;"
-      fi
-    done
-  else
-    # READONLY - public schema only
-    kubectl exec "$pod_name" -- env PGPASSWORD="$password" psql -h "${host}" \
-    -p "${port}" -d "${db}" -U "${username}" \
-    -qAt -c "GRANT SELECT ON ALL TABLES in SCHEMA public to readonly;"
-    return $?
-  fi
-}
-
-_set_owner_all_tables() {
-  # Grants permission to READWRITE or READONLY
-  host=$1
-  port=$2
-  db=$3
-  username=$4
-  password=$5
-  username_to_grant=$6
-
-  _start_psql
-
-  # iterate over possible schemas and give permission READWRITE
-  table_list=$(kubectl exec "$pod_name" -- env PGPASSWORD="${password}" psql -h "${host}" \
-  -p "${port}" -d "${db}" -U "${username}" -qAt -c "\dt;")
-  while IFS= read -r line
-  do
-      alter=$(echo "$line" | awk -F  "|" '{printf "alter table %s.%s owner to readwrite;\n",$1,$2}')
-      kubectl exec "$pod_name" -- env PGPASSWORD="$password" psql -h "${host}" \
-      -p "${port}" -d "${db}" -U "${username}" \
-      -qAt -c "${alter}"
-  done <<< "$table_list"
-}
-
 _create_replication_user() {
    host=$1
    port=$2
@@ -0,0 +1,125 @@
+import logging
+import re
+import shlex
+import subprocess as sp
+import threading
+import uuid
+from typing import List
+
+_ERROR = re.compile(r"^(psql:[^ ]*: )?(ERROR|FATAL|PANIC):")
+
+
+class PsqlError(Exception):
+    pass
+
+
+class PsqlSession:
+    """
+    One long lived `kubectl exec -i psql` into the psql client pod, so statements are pipelined over a single
+    exec and database connection instead of a new exec and connection per statement. After every query a
+    sentinel is echoed, marking the end of its output; stderr is merged into stdout so errors arrive in order.
+    """
+
+    def __init__(self, pod, host, port, database, user, password, logger=None):
+        self._pod = pod
+        self._args = [str(host), str(port), str(database), str(user)]
+        self._password = password
+        self._logger = logging.getLogger(__name__) if not logger else logger
+        self._lock = threading.Lock()
+        self._proc = None
+
+    def _start(self):
+        host, port, database, user = self._args
+        psql = (f"PGPASSWORD={shlex.quote(str(self._password))} exec psql -h {shlex.quote(host)} -p {shlex.quote(port)} "
+                f"-d {shlex.quote(database)} -U {shlex.quote(user)} -X -q -A -t -v ON_ERROR_STOP=0 2>&1")
+        self._proc = sp.Popen(['kubectl', 'exec', '-i', self._pod, '--', 'sh', '-c', psql],
+                              stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.STDOUT, text=True, bufsize=1)
+        self._logger.debug(f"started psql session to {user}@{host}:{port}/{database}")
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def query(self, sql: str) -> str:
+        """
+        :param sql: one or more statements
+        :raises PsqlError: if any statement failed or the session ended
+        :return: output rows, '|' separated columns
+        """
+        with self._lock:
+            if not self.alive:
+                self._start()
+            sentinel = f"__csm_{uuid.uuid4().hex}__"
+            try:
+                self._proc.stdin.write(f"{sql.rstrip()}\n\\echo {sentinel}\n")
+                self._proc.stdin.flush()
+            except (BrokenPipeError, OSError) as e:
+                self.close()
+                raise PsqlError(f"psql session ended: {e}")
+            lines, errors = [], []
+            while True:
+                line = self._proc.stdout.readline()
+                if not line:
+                    output = "\n".join(lines)
+                    self.close()
+                    raise PsqlError(f"psql session ended: {output}")
+                line = line.rstrip("\n")
+                if line == sentinel:
+                    break
+                (errors if _ERROR.match(line) else lines).append(line)
+            if errors:
+                raise PsqlError("\n".join(errors))
+            return "\n".join(lines)
+
+    def transaction(self, sql: str) -> str:
+        """
+        Runs statements in one transaction: after a failing statement the rest fail and COMMIT rolls back
+        """
+        return self.query(f"BEGIN;\n{sql.rstrip()}\nCOMMIT;")
+
+    def close(self):
+        if self._proc is None:
+            return
+        try:
+            self._proc.stdin.close()
+        except Exception:
+            pass
+        try:
+            self._proc.wait(timeout=5)
+        except sp.TimeoutExpired:
+            self._proc.kill()
+        self._proc = None
+
+
+class PsqlSessions:
+    """
+    Sessions keyed by host, port, database and user, started on first use
+    """
+
+    def __init__(self, pod_name_fn, logger=None):
+        """
+        :param pod_name_fn: starts the psql client pod if needed and returns its name
+        """
+        self._pod_name_fn = pod_name_fn
+        self._pod = None
+        self._logger = logging.getLogger(__name__) if not logger else logger
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def get(self, host, port, database, user, password) -> PsqlSession:
+        key = (host, str(port), database, user)
+        with self._lock:
+            if self._pod is None:
+                self._pod = self._pod_name_fn()
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = PsqlSession(self._pod, host, port, database, user, password,
+                                                            logger=self._logger)
+            return session
+
+    def close(self):
+        with self._lock:
+            sessions: List[PsqlSession] = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
@@ -0,0 +1,56 @@
+import subprocess
+import sys
+
+import pytest
+
+import psqlsession
+from psqlsession import PsqlError
+from psqlsession import PsqlSessions
+
+# stands in for `kubectl exec -i psql`: answers every statement with a row or an error, handles \echo
+FAKE_PSQL = r"""
+import sys
+for line in sys.stdin:
+    line = line.rstrip("\n")
+    if line.startswith("\\echo "):
+        print(line[len("\\echo "):])
+    elif "fail" in line:
+        print("psql:<stdin>:1: ERROR:  boom")
+    elif line in ("BEGIN;", "COMMIT;"):
+        pass
+    elif line:
+        print(f"row|{line}")
+    sys.stdout.flush()
+"""
+
+
+@pytest.fixture
+def execs(monkeypatch):
+    started = []
+    real_popen = subprocess.Popen
+
+    def popen(args, **kwargs):
+        started.append(args)
+        return real_popen([sys.executable, "-c", FAKE_PSQL], **kwargs)
+
+    monkeypatch.setattr(psqlsession.sp, "Popen", popen)
+    return started
+
+
+def test_statements_share_one_exec(execs):
+    sessions = PsqlSessions(lambda: "psql-pod")
+    session = sessions.get("h", 5432, "db", "u", "pw")
+    assert session.query("SELECT 1;") == "row|SELECT 1;"
+    assert session.transaction("SELECT 2;\nSELECT 3;") == "row|SELECT 2;\nrow|SELECT 3;"
+    assert sessions.get("h", "5432", "db", "u", "pw") is session
+    assert len(execs) == 1
+    assert execs[0][:4] == ['kubectl', 'exec', '-i', 'psql-pod']
+    sessions.close()
+
+
+def test_errors_raise_and_session_continues(execs):
+    session = PsqlSessions(lambda: "psql-pod").get("h", 5432, "db", "u", "pw")
+    with pytest.raises(PsqlError, match="boom"):
+        session.query("SELECT fail;")
+    assert session.query("SELECT 1;") == "row|SELECT 1;"
+    session.close()
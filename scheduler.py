@@ -0,0 +1,111 @@
+import logging
+import threading
+import time
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+
+# dimensions a service is limited by, see CapacityScheduler.keys
+DIMENSIONS = ('project', 'region', 'source')
+
+
+class CapacityScheduler:
+    """
+    Admission control for FleetRunner: orders services by priority and database size, and only admits a service
+    while every limit it falls under has a free slot:
+      - project: concurrent migrations per gcp project (DMS jobs, cloudsql instance creations)
+      - region: concurrent migrations per gcp project and region
+      - source: concurrent migrations per RDS instance (aws-instance), to bound the dump load on shared sources
+    Starts within a project are additionally spaced by creation_interval seconds to respect the cloudsql
+    instance creation rate. Limits can be changed while running, e.g. by a load controller.
+    """
+
+    def __init__(self, config, limits: Dict[str, Optional[int]], order="size", creation_interval=0.0,
+                 sizes: Optional[Dict[str, int]] = None, logger=None):
+        """
+        :param config: Config with the services to schedule
+        :param limits: dimension -> max concurrent services per key of that dimension, None for unlimited
+        :param order: "size" (largest first, so the longest dumps do not end up last) or "priority"
+                      (migration-priority ascending, then largest first)
+        :param creation_interval: min seconds between two starts in the same gcp project
+        :param sizes: service -> database size, defaults to gcp-instance-storage of the service
+        """
+        unknown = [d for d in limits if d not in DIMENSIONS]
+        if unknown:
+            raise ValueError(f"unknown limits {unknown}, expecting {DIMENSIONS}")
+        if order not in ("size", "priority"):
+            raise ValueError(f"unknown order '{order}', expecting 'size' or 'priority'")
+        self._config = config
+        self._limits = dict(limits)
+        self._overrides: Dict[tuple, int] = {}  # (dimension, key) -> limit
+        self._order = order
+        self._creation_interval = creation_interval
+        self._sizes = sizes or {}
+        self._logger = logging.getLogger(__name__) if not logger else logger
+        self._lock = threading.Lock()
+        self._running: Dict[tuple, int] = {}  # (dimension, key) -> running services
+        self._last_start: Dict[str, float] = {}  # project -> monotonic time of the last start
+
+    def keys(self, service) -> Dict[str, str]:
+        cfg = self._config[service]
+        return {"project": cfg['gcp-project-name'],
+                "region": f"{cfg['gcp-project-name']}/{cfg['gcp-instance-region']}",
+                "source": cfg.get('aws-instance') or cfg['aws-host']}
+
+    def size(self, service) -> int:
+        if service in self._sizes:
+            return self._sizes[service]
+        return int(self._config[service].get('gcp-instance-storage') or 0)
+
+    def order(self, services: Iterable[str]) -> list:
+        def key(service):
+            priority = int(self._config[service].get('migration-priority', 0)) if self._order == "priority" else 0
+            return priority, -self.size(service)
+        return sorted(services, key=key)
+
+    def limit(self, dimension, key) -> Optional[int]:
+        return self._overrides.get((dimension, key), self._limits.get(dimension))
+
+    def set_limit(self, dimension, key, limit: int):
+        """
+        Overrides the limit of one key, e.g. a single source instance
+        """
+        with self._lock:
+            self._overrides[(dimension, key)] = limit
+
+    def running(self, dimension, key) -> int:
+        return self._running.get((dimension, key), 0)
+
+    def try_acquire(self, service) -> bool:
+        """
+        :return: True and takes a slot in every dimension if the service can start now
+        """
+        keys = self.keys(service)
+        with self._lock:
+            for dimension, key in keys.items():
+                limit = self.limit(dimension, key)
+                if limit is not None and self._running.get((dimension, key), 0) >= limit:
+                    return False
+            last = self._last_start.get(keys['project'])
+            if last is not None and time.monotonic() - last < self._creation_interval:
+                return False
+            for dimension, key in keys.items():
+                self._running[(dimension, key)] = self._running.get((dimension, key), 0) + 1
+            self._last_start[keys['project']] = time.monotonic()
+        self._logger.info(f"admitting {service} ({', '.join(f'{d}={k}' for d, k in keys.items())})")
+        return True
+
+    def blocked(self, service) -> Optional[str]:
+        """
+        :return: why the service can never start under the current limits, even with nothing running; None if it can
+        """
+        for dimension, key in self.keys(service).items():
+            limit = self.limit(dimension, key)
+            if limit is not None and limit <= 0:
+                return f"{dimension} {key} has a limit of {limit}"
+        return None
+
+    def release(self, service):
+        with self._lock:
+            for dimension, key in self.keys(service).items():
+                self._running[(dimension, key)] = max(0, self._running.get((dimension, key), 0) - 1)
@@ -0,0 +1,76 @@
+import threading
+import time
+
+from config import DbConfig
+from fleet import FleetRunner
+from scheduler import CapacityScheduler
+
+
+class _Config(dict):
+    def keys(self):
+        return list(super().keys())
+
+
+def _config():
+    def service(name, project, source, storage, priority=0):
+        return DbConfig(name, {'gcp-project-name': project, 'gcp-instance-region': 'us-east4', 'aws-instance': source,
+                               'aws-host': f"{source}.rds", 'gcp-instance-storage': storage,
+                               'migration-priority': priority})
+
+    return _Config({s.name: s for s in [service("a", "p1", "rds1", 10, priority=2),
+                                        service("b", "p1", "rds1", 100, priority=1),
+                                        service("c", "p1", "rds2", 50),
+                                        service("d", "p2", "rds3", 20)]})
+
+
+def test_order_by_size_and_priority():
+    cfg = _config()
+    assert CapacityScheduler(cfg, {}).order(cfg.keys()) == ["b", "c", "d", "a"]
+    assert CapacityScheduler(cfg, {}, order="priority").order(cfg.keys()) == ["c", "d", "b", "a"]
+
+
+def test_limits_per_source_and_region():
+    scheduler = CapacityScheduler(_config(), {"region": 2, "source": 1})
+    assert scheduler.try_acquire("a")
+    assert not scheduler.try_acquire("b")  # rds1 busy
+    assert scheduler.try_acquire("c")
+    assert scheduler.try_acquire("d")  # other project
+    scheduler.release("a")
+    assert scheduler.try_acquire("b")
+    scheduler.set_limit("source", "rds3", 0)
+    scheduler.release("d")
+    assert not scheduler.try_acquire("d")
+
+
+def test_fleet_respects_admission(tmp_path):
+    lock = threading.Lock()
+    active, peak = set(), {}
+
+    class _Commands:
+        def sync(self, service):
+            source = _config()[service]['aws-instance']
+            with lock:
+                active.add(service)
+                peak[source] = max(peak.get(source, 0), len([s for s in active
+                                                            if _config()[s]['aws-instance'] == source]))
+            time.sleep(0.05)
+            with lock:
+                active.discard(service)
+
+    runner = FleetRunner(lambda logger: _Commands(), parallel=4, log_dir=str(tmp_path), refresh=0.01)
+    rows = runner.run("sync", ["a", "b", "c", "d"], admission=CapacityScheduler(_config(), {"source": 1}))
+    assert all(row['state'] == 'ok' for row in rows.values())
+    assert peak == {"rds1": 1, "rds2": 1, "rds3": 1}
+
+
+def test_fleet_fails_services_never_admitted(tmp_path):
+    class _Commands:
+        def sync(self, service):
+            pass
+
+    scheduler = CapacityScheduler(_config(), {"source": 1})
+    scheduler.set_limit("source", "rds1", 0)
+    runner = FleetRunner(lambda logger: _Commands(), parallel=4, log_dir=str(tmp_path), refresh=0.01)
+    rows = runner.run("sync", ["a", "b", "c", "d"], admission=scheduler)
+    assert {s: row['state'] for s, row in rows.items()} == {"a": "failed", "b": "failed", "c": "ok", "d": "ok"}
+    assert rows["a"]["error"] == "not admitted: source rds1 has a limit of 0"
@@ -48,6 +48,7 @@ class Link:
         self._name = name
         self._ok = Value('b', True)
         self._rv = Array('c', 2**14)    # return value, if any. should be json string
+        self._progress = Array('c', 2**12)  # live progress reported while running, json object
         self._messages = Queue()        # log messages from process
         self._level = level
 
@@ -82,6 +83,18 @@ class Link:
     def rv(self, value: typing.Any):
         self._rv.value = bytes(json.dumps(value), 'UTF-8')
 
+    @property
+    def progress(self) -> dict:
+        v = str(self._progress.value, 'UTF-8')
+        return json.loads(v) if v else {}
+
+    def report(self, key: str, value: typing.Any):
+        """
+        Publish live progress under key, see MigrationCommands reporter
+        """
+        with self._progress.get_lock():
+            self._progress.value = bytes(json.dumps({**self.progress, key: value}), 'UTF-8')
+
     @property
     def ok(self):
         return bool(self._ok.value)
@@ -103,7 +116,11 @@ class Link:
 @catch_ex
 def _t_preflight(link, service):
     cfg = K8sConfig()
-    commands = MigrationCommands(config=cfg, k8s=K8sApiNative(logger=link), logger=link)
+    commands = MigrationCommands(config=cfg, k8s=K8sApiNative(logger=link), logger=link, reporter=link.report)
+    if service == 'all':
+        rv = commands.preflight_all()
+        link.ok = all(status['pass'] for status in rv.values())
+        return rv
     rv = commands.preflight(service)
     link.ok = rv['pass']
     return rv
@@ -112,22 +129,47 @@ def _t_preflight(link, service):
 @catch_ex
 def _t_sync(link, service):
     cfg = K8sConfig()
-    commands = MigrationCommands(config=cfg, k8s=K8sApiNative(logger=link), logger=link)
-    commands.sync(service)
+    commands = MigrationCommands(config=cfg, k8s=K8sApiNative(logger=link), logger=link, reporter=link.report)
+    return commands.sync(service)
+
+
+@catch_ex
+def _t_sync_reset(link, service):
+    cfg = K8sConfig()
+    commands = MigrationCommands(config=cfg, k8s=K8sApiNative(logger=link), logger=link, reporter=link.report)
+    return commands.sync(service, reset=True)
 
 
 @catch_ex
 def _t_cutover(link, service):
     cfg = K8sConfig()
-    commands = MigrationCommands(config=cfg, k8s=K8sApiNative(logger=link), logger=link)
-    commands.cutover(service)
+    commands = MigrationCommands(config=cfg, k8s=K8sApiNative(logger=link), logger=link, reporter=link.report)
+    return commands.cutover(service)
+
+
+@catch_ex
+def _t_cutover_instance(link, aws_instance):
+    cfg = K8sConfig()
+    commands = MigrationCommands(config=cfg, k8s=K8sApiNative(logger=link), logger=link, reporter=link.report)
+    return commands.cutover_instance(aws_instance)
+
+
+@catch_ex
+def _t_verify(link, service):
+    cfg = K8sConfig()
+    commands = MigrationCommands(config=cfg, k8s=K8sApiNative(logger=link), logger=link, reporter=link.report)
+    rv = commands.verify(service)
+    link.ok = rv['pass']
+    return rv
 
 
 @catch_ex
 def _t_cleanup(link, service):
     cfg = K8sConfig()
-    commands = MigrationCommands(config=cfg, k8s=K8sApiNative(logger=link), logger=link)
-    commands.cleanup(service)
+    commands = MigrationCommands(config=cfg, k8s=K8sApiNative(logger=link), logger=link, reporter=link.report)
+    if service == 'all':
+        return commands.cleanup_completed()
+    return commands.cleanup(service)
 
 
 class ProcessManagementServer(http.server.HTTPServer):
@@ -153,6 +195,9 @@ class RequestHandler(http.server.BaseHTTPRequestHandler):
             task = {"state": state,
                     "createTime": link.create_time,
                     "messages": history}
+            progress = link.progress
+            if progress:
+                task['progress'] = progress
             if state == "complete":
                 task['ok'] = link.ok
                 task['value'] = link.rv
@@ -272,7 +317,10 @@ if __name__ == '__main__':
         RequestHandler,
         targets={"preflight": _t_preflight,
                  "sync": _t_sync,
+                 "sync-reset": _t_sync_reset,
                  "cutover": _t_cutover,
+                 "cutover-instance": _t_cutover_instance,
+                 "verify": _t_verify,
                  "cleanup": _t_cleanup,
                  "dummy": _t_dummy, })
     if DEBUG:
@@ -0,0 +1,64 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Optional
+
+
+class Timeline:
+    """
+    Structured timing events of a task. Offsets come from a monotonic clock so windows between events are
+    not affected by wall clock adjustments; the wall clock time is kept for correlating with other logs.
+    """
+
+    def __init__(self, name, logger=None, origin: Optional[float] = None):
+        """
+        :param origin: monotonic time offsets are measured from, to compare timelines of concurrent tasks
+        """
+        self._name = name
+        self._logger = logging.getLogger(__name__) if not logger else logger
+        self._origin = time.monotonic() if origin is None else origin
+        self._lock = threading.Lock()
+        self._events = []  # [{event:, t:, at:}]
+
+    def mark(self, event: str, **fields) -> float:
+        """
+        :return: seconds since the timeline started
+        """
+        t = time.monotonic() - self._origin
+        with self._lock:
+            self._events.append({"event": event, "t": round(t, 3), "at": datetime.utcnow().isoformat(), **fields})
+        self._logger.info(f"timing {self._name}: {event} at +{t:.1f}s")
+        return t
+
+    @contextmanager
+    def span(self, event: str):
+        """
+        Marks {event}-begin and {event}-end around a block. If the block raises, the end is marked with its error
+        """
+        self.mark(f"{event}-begin")
+        try:
+            yield
+        except BaseException as e:
+            self.mark(f"{event}-end", error=f"{type(e).__name__}: {e}")
+            raise
+        self.mark(f"{event}-end")
+
+    def first(self, event: str) -> Optional[float]:
+        return next((e['t'] for e in self._events if e['event'] == event), None)
+
+    def last(self, event: str) -> Optional[float]:
+        return next((e['t'] for e in reversed(self._events) if e['event'] == event), None)
+
+    def window(self, start_event: str, end_event: str) -> Optional[float]:
+        """
+        :return: seconds between the first start_event and the last end_event, None if either is missing
+        """
+        start, end = self.first(start_event), self.last(end_event)
+        if start is None or end is None:
+            return None
+        return round(end - start, 3)
+
+    def to_dict(self) -> dict:
+        return {"events": list(self._events)}
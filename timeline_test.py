@@ -0,0 +1,26 @@
+import pytest
+
+from timeline import Timeline
+
+
+def test_span_marks_end_on_failure():
+    timeline = Timeline("test")
+    with timeline.span("restart"):
+        pass
+    with pytest.raises(ValueError):
+        with timeline.span("restart"):
+            raise ValueError("boom")
+    events = timeline.to_dict()["events"]
+    assert [e["event"] for e in events] == ["restart-begin", "restart-end", "restart-begin", "restart-end"]
+    assert "error" not in events[1] and events[3]["error"] == "ValueError: boom"
+    assert timeline.window("restart-begin", "restart-end") is not None
+
+
+def test_first_last_and_window():
+    timeline = Timeline("test", origin=0.0)
+    for t, event in [(1.0, "a"), (2.5, "b"), (4.0, "a")]:
+        timeline._events.append({"event": event, "t": t})
+    assert timeline.first("a") == 1.0 and timeline.last("a") == 4.0
+    assert timeline.window("a", "b") == 1.5
+    assert timeline.window("a", "missing") is None
+    assert timeline.first("missing") is None
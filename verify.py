@@ -0,0 +1,203 @@
+import logging
+import multiprocessing
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import psycopg2
+from psycopg2 import sql
+
+EXCLUDED_SCHEMAS = ('pg_catalog', 'information_schema', 'hdb_catalog', 'hdb_views', 'pglogical')
+
+# per worker process connections, one per side: at most 2 connections per worker
+_connections = {}
+# t::text renders floats, timestamps, dates and intervals per session settings: both sides must use the same
+SESSION_SETTINGS = ("SET extra_float_digits = 3; SET TimeZone = 'UTC'; SET DateStyle = 'ISO, MDY'; "
+                    "SET IntervalStyle = 'postgres';")
+
+
+class Chunk:
+    """
+    A primary key range [lo, hi) of a table, or the whole table if it has no single integer primary key
+    """
+
+    def __init__(self, schema, table, pk=None, lo=None, hi=None):
+        self.schema = schema
+        self.table = table
+        self.pk = pk
+        self.lo = lo
+        self.hi = hi
+
+    def query(self) -> sql.Composed:
+        # order independent hash aggregate: no sort and no large intermediate string per chunk
+        select = sql.SQL("SELECT count(*), coalesce(sum(('x' || substr(md5(t::text), 1, 16))::bit(64)::bigint), 0) "
+                         "FROM {}.{} t").format(sql.Identifier(self.schema), sql.Identifier(self.table))
+        if self.pk is None:
+            return select
+        return select + sql.SQL(" WHERE {pk} >= {lo} AND {pk} < {hi}").format(
+            pk=sql.Identifier(self.pk), lo=sql.Literal(self.lo), hi=sql.Literal(self.hi))
+
+    def __str__(self):
+        if self.pk is None:
+            return f"{self.schema}.{self.table}"
+        return f"{self.schema}.{self.table}[{self.pk} {self.lo}..{self.hi})"
+
+
+def _connection(side, params):
+    conn = _connections.get(side)
+    if conn is None or conn.closed:
+        conn = psycopg2.connect(**params)
+        conn.set_session(readonly=True, autocommit=True)
+        with conn.cursor() as cur:
+            cur.execute(SESSION_SETTINGS)
+        _connections[side] = conn
+    return conn
+
+
+def _digest(side, params, chunk: Chunk) -> Tuple[int, str]:
+    """
+    Runs in a worker process
+    :return: row count, hash aggregate of the rows
+    """
+    with _connection(side, params).cursor() as cur:
+        cur.execute(chunk.query())
+        count, digest = cur.fetchone()
+        return int(count), str(digest)
+
+
+class ParityVerifier:
+    """
+    Compares a source and a target database chunk by chunk. Tables are split by integer primary key range,
+    and row counts and hash aggregates of every chunk are computed on source and target concurrently in a
+    process pool, each worker keeping one connection per side.
+    """
+
+    def __init__(self, source: dict, target: dict, workers=4, chunk_rows=200000, logger=None):
+        """
+        :param source: psycopg2 connection parameters of the source database
+        :param target: psycopg2 connection parameters of the target database
+        :param chunk_rows: approximate rows per chunk
+        """
+        self._source = source
+        self._target = target
+        self._workers = workers
+        self._chunk_rows = chunk_rows
+        self._logger = logging.getLogger(__name__) if not logger else logger
+
+    def chunks(self) -> List[Chunk]:
+        """
+        Splits every table of the source database by primary key range, from one catalog query and a
+        min/max lookup per table on each side. The ranges span the keys of both sides, so rows that only
+        exist on the target are compared too.
+        """
+        chunks = []
+        conn = psycopg2.connect(**self._source)
+        target = psycopg2.connect(**self._target)
+        try:
+            for c in (conn, target):
+                c.set_session(readonly=True, autocommit=True)
+            with conn.cursor() as cur, target.cursor() as target_cur:
+                # partitions and inheritance children are compared through their parent. pg_inherits instead of
+                # relispartition, which postgres 9.6 does not have
+                cur.execute("""
+                SELECT n.nspname, c.relname, greatest(c.reltuples, 0)::bigint,
+                       (SELECT a.attname FROM pg_index i
+                          JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+                        WHERE i.indrelid = c.oid AND i.indisprimary AND i.indnatts = 1
+                          AND a.atttypid IN ('int2'::regtype, 'int4'::regtype, 'int8'::regtype))
+                FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE c.relkind IN ('r', 'p') AND n.nspname NOT IN %s AND n.nspname NOT LIKE 'pg_%%'
+                  AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)
+                ORDER BY 1, 2;
+                """, (EXCLUDED_SCHEMAS,))
+                tables = cur.fetchall()
+                for schema, table, rows, pk in tables:
+                    if pk is None:
+                        chunks.append(Chunk(schema, table))
+                        continue
+                    lo, hi = self._pk_range([cur, target_cur], schema, table, pk)
+                    if lo is None:
+                        chunks.append(Chunk(schema, table))
+                        continue
+                    if rows <= 0:
+                        # never analysed: reltuples is 0 or -1, assume dense keys
+                        rows = hi - lo + 1
+                    if rows <= self._chunk_rows:
+                        chunks.append(Chunk(schema, table))
+                        continue
+                    step = max(1, (hi - lo + 1) * self._chunk_rows // rows)
+                    for start in range(lo, hi + 1, step):
+                        chunks.append(Chunk(schema, table, pk, start, start + step))
+        finally:
+            conn.close()
+            target.close()
+        return chunks
+
+    @staticmethod
+    def _pk_range(cursors, schema, table, pk) -> Tuple[Optional[int], Optional[int]]:
+        """
+        :return: min and max of pk over all cursors' databases, None if the table is empty everywhere
+        """
+        lows, highs = [], []
+        for cur in cursors:
+            try:
+                cur.execute(sql.SQL("SELECT min({pk}), max({pk}) FROM {}.{}").format(
+                    sql.Identifier(schema), sql.Identifier(table), pk=sql.Identifier(pk)))
+                lo, hi = cur.fetchone()
+            except psycopg2.Error:
+                # missing on the target: its chunks fail to compare and are reported
+                continue
+            if lo is not None:
+                lows.append(lo)
+                highs.append(hi)
+        if not lows:
+            return None, None
+        return min(lows), max(highs)
+
+    def _compare(self, pool, chunks: List[Chunk]) -> List[dict]:
+        futures = [(chunk,
+                    pool.submit(_digest, 'source', self._source, chunk),
+                    pool.submit(_digest, 'target', self._target, chunk)) for chunk in chunks]
+        mismatches = []
+        for chunk, source, target in futures:
+            try:
+                source, target = source.result(), target.result()
+            except Exception as e:
+                mismatches.append({"chunk": str(chunk), "error": str(e).strip(), "_chunk": chunk})
+                continue
+            if source != target:
+                mismatches.append({"chunk": str(chunk), "sourceRows": source[0], "targetRows": target[0],
+                                   "_chunk": chunk})
+        return mismatches
+
+    def run(self, sample: Optional[float] = None, recheck_after: float = 10.0) -> dict:
+        """
+        :param sample: fraction of chunks to compare for a quick check, all chunks if None
+        :param recheck_after: seconds to wait before comparing mismatching chunks again, to let
+                              replication catch up with the last writes. 0 disables the recheck
+        :return: {chunks:, compared:, mismatches: [{chunk:, sourceRows:, targetRows:} or {chunk:, error:}],
+                  seconds:, pass:}
+        """
+        start_time = time.monotonic()
+        chunks = self.chunks()
+        compared = chunks
+        if sample is not None and chunks:
+            compared = random.sample(chunks, max(1, int(len(chunks) * sample)))
+        self._logger.info(f"verifying {len(compared)}/{len(chunks)} chunks with {self._workers} workers")
+        # spawn: forked workers would inherit the parent's threads and locks, e.g. of the informers or a fleet run
+        with ProcessPoolExecutor(max_workers=self._workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            mismatches = self._compare(pool, compared)
+            if mismatches and recheck_after:
+                self._logger.info(f"{len(mismatches)} chunks differ, rechecking in {recheck_after}s")
+                time.sleep(recheck_after)
+                mismatches = self._compare(pool, [m['_chunk'] for m in mismatches])
+        for m in mismatches:
+            del m['_chunk']
+            self._logger.warning(f"chunk mismatch: {m}")
+        seconds = round(time.monotonic() - start_time, 1)
+        self._logger.info(f"verified {len(compared)} chunks in {seconds}s, {len(mismatches)} mismatches")
+        return {"chunks": len(chunks), "compared": len(compared), "mismatches": mismatches,
+                "seconds": seconds, "pass": not mismatches}
@@ -0,0 +1,81 @@
+import verify
+from verify import ParityVerifier
+
+
+class _Cursor:
+    def __init__(self, tables, ranges):
+        self._tables = tables
+        self._ranges = ranges
+        self._result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, args=None):
+        if isinstance(query, str):
+            self._result = self._tables
+        else:
+            self._result = [self._ranges.pop(0)]
+
+    def fetchall(self):
+        return self._result
+
+    def fetchone(self):
+        return self._result[0]
+
+
+class _Connection:
+    closed = False
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+    def set_session(self, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+
+def _connect(tables, source_ranges, target_ranges):
+    return lambda side=None, **kw: _Connection(_Cursor(tables, list(target_ranges if side else source_ranges)))
+
+
+def test_chunks_split_by_integer_pk(monkeypatch):
+    tables = [("public", "big", 1000, "id"), ("public", "nopk", 5000, None), ("public", "small", 10, "id")]
+    monkeypatch.setattr(verify.psycopg2, "connect", _connect(tables, [(1, 1000), (1, 10)], [(1, 1000), (1, 10)]))
+    chunks = ParityVerifier({}, {"side": "target"}, chunk_rows=250).chunks()
+    assert [str(c) for c in chunks] == ["public.big[id 1..251)", "public.big[id 251..501)",
+                                        "public.big[id 501..751)", "public.big[id 751..1001)",
+                                        "public.nopk", "public.small"]
+
+
+def test_chunks_of_unanalysed_tables_and_target_only_rows(monkeypatch):
+    # reltuples is 0 before the first analyze, and the target has rows beyond the source's keys
+    tables = [("public", "fresh", 0, "id"), ("public", "gone", 0, "id")]
+    monkeypatch.setattr(verify.psycopg2, "connect", _connect(tables, [(1, 500), (None, None)], [(1, 700), (5, 9)]))
+    chunks = ParityVerifier({}, {"side": "target"}, chunk_rows=250).chunks()
+    assert [str(c) for c in chunks] == ["public.fresh[id 1..251)", "public.fresh[id 251..501)",
+                                        "public.fresh[id 501..751)", "public.gone"]
+
+
+def test_digest_pins_session_settings(monkeypatch):
+    executed = []
+    cursor = _Cursor([], [(3, 42)])
+    cursor.execute = lambda query, args=None: executed.append(query)
+    cursor.fetchone = lambda: (3, 42)
+    monkeypatch.setattr(verify, "_connections", {})
+    monkeypatch.setattr(verify.psycopg2, "connect", lambda **kw: _Connection(cursor))
+    chunk = verify.Chunk("public", "t", "id", 1, 10)
+    for side in ("source", "target"):
+        assert verify._digest(side, {}, chunk) == (3, "42")
+        assert verify._digest(side, {}, chunk) == (3, "42")
+    assert executed[0] == executed[3] == verify.SESSION_SETTINGS
+    assert "extra_float_digits = 3" in executed[0] and "TimeZone = 'UTC'" in executed[0]
+    assert executed.count(verify.SESSION_SETTINGS) == 2